@@ -0,0 +1,221 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud, models
+from .compiler import CompiledRule, CompiledRuleCache, load_node
+from .evaluator import RuleEvaluator
+from .fields import RecordSchema
+from .schemas import NodeBase
+
+class SchemaCache:
+    # Record schemas by id. They are immutable once registered, so entries
+    # never go stale and are kept for the life of the process.
+    def __init__(self):
+        self._schemas: Dict[int, RecordSchema] = {}
+
+    def __len__(self) -> int:
+        return len(self._schemas)
+
+    def get(self, schema_id: Optional[int]) -> Optional[RecordSchema]:
+        return None if schema_id is None else self._schemas.get(schema_id)
+
+    def put(self, db_schema: models.RuleSchema) -> RecordSchema:
+        schema = RecordSchema.from_json(db_schema.fields)
+        self._schemas[db_schema.id] = schema
+        return schema
+
+    async def load(self, db: AsyncSession, schema_ids: Iterable[Optional[int]]) -> None:
+        missing = [schema_id for schema_id in schema_ids if schema_id is not None and schema_id not in self._schemas]
+        if missing:
+            for db_schema in await crud.AsyncRuleRepository.get_schemas_by_ids(db, missing):
+                self.put(db_schema)
+
+    async def fetch(self, db: AsyncSession, schema_id: int) -> Optional[RecordSchema]:
+        await self.load(db, [schema_id])
+        return self._schemas.get(schema_id)
+
+class CachedRule:
+    # Immutable snapshot of one version of a rule, compiled when it is
+    # written or loaded. It is shared between requests, so neither it nor
+    # its ast_json/ast may be mutated. The AST is decoded on first use.
+    __slots__ = (
+        "id", "name", "description", "rule_string", "ast_json", "ast_blob",
+        "created_at", "updated_at", "version", "schema_id", "schema", "compiled", "_ast", "_fields"
+    )
+
+    def __init__(
+        self,
+        rule: models.Rule,
+        ast: Optional[NodeBase] = None,
+        compiled: Optional[CompiledRule] = None,
+        schema: Optional[RecordSchema] = None
+    ):
+        self.id: int = rule.id
+        self.name: str = rule.name
+        self.description: Optional[str] = rule.description
+        self.rule_string: str = rule.rule_string
+        self.ast_json: dict = rule.ast_json
+        self.ast_blob: Optional[bytes] = rule.ast_blob
+        self.created_at: Optional[datetime] = rule.created_at
+        self.updated_at: Optional[datetime] = rule.updated_at
+        self.version: int = rule.version or 1
+        self.schema_id: Optional[int] = rule.schema_id
+        self.schema = schema
+        self.compiled = compiled
+        self._ast = ast
+        self._fields: Optional[Tuple[str, ...]] = None
+
+    @property
+    def ast(self) -> NodeBase:
+        if self._ast is None:
+            self._ast = load_node(self.ast_json, self.ast_blob)
+        return self._ast
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        # Identifies this exact definition (ids are never reused)
+        return (self.id, self.version)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        # Sorted so that it can be used to build cache keys
+        if self._fields is None:
+            self._fields = tuple(sorted(RuleEvaluator.referenced_fields(self.ast)))
+        return self._fields
+
+class RuleCache:
+    # Registry of the active version of each rule as a compiled CachedRule,
+    # warmed from the rules table at startup and read through on a miss.
+    # Readers never take the lock: a lookup is one dict read, and writers
+    # build and compile the new snapshot first and then publish it with a
+    # single assignment, so a reader sees either the old version or the new
+    # one. An older version never replaces a newer one. Beyond max_size the
+    # least recently used entries are dropped; a hit moves its entry to the
+    # end only if the lock is free, so readers never wait on a writer.
+    def __init__(self, compiled: CompiledRuleCache, schemas: SchemaCache, max_size: int = 10000):
+        self.compiled = compiled
+        self.schemas = schemas
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, CachedRule]" = OrderedDict()
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, rule_id: int) -> Optional[CachedRule]:
+        cached = self._entries.get(rule_id)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._lock.acquire(blocking=False):
+            try:
+                if self._entries.get(rule_id) is cached:
+                    self._entries.move_to_end(rule_id)
+            finally:
+                self._lock.release()
+        return cached
+
+    def _snapshot(self, rule: models.Rule, ast: Optional[NodeBase] = None) -> CachedRule:
+        # The rule's schema must already be in self.schemas
+        version = rule.version or 1
+        schema = self.schemas.get(rule.schema_id)
+        if rule.schema_id is not None and schema is None:
+            raise ValueError(f"Schema {rule.schema_id} is not loaded")
+        compiled = self.compiled.get(rule.id, version, rule.ast_json, rule.ast_blob, schema)
+        return CachedRule(rule, ast, compiled, schema)
+
+    def _store(self, cached: CachedRule) -> None:
+        # Callers hold the lock
+        if self.max_size <= 0:
+            return
+        current = self._entries.get(cached.id)
+        if current is not None and current.version > cached.version:
+            return
+        if current is None:
+            while len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+        self._entries[cached.id] = cached
+        self._entries.move_to_end(cached.id)
+
+    def _store_loaded(self, rules: Iterable[models.Rule], invalidations: int) -> Dict[int, CachedRule]:
+        # A row read before a concurrent update/delete finished may already
+        # be stale; it is still returned to its reader but not cached
+        loaded = {rule.id: self._snapshot(rule) for rule in rules}
+        with self._lock:
+            if invalidations == self._invalidations:
+                for cached in loaded.values():
+                    self._store(cached)
+        return loaded
+
+    def warm(self, rules: Iterable[models.Rule]) -> List[CachedRule]:
+        # Replaces the whole registry with snapshots of the given rows (one
+        # bulk load at startup, after their schemas); everything is compiled
+        # before the swap
+        self.compiled.clear()
+        snapshots = [self._snapshot(rule) for rule in rules]
+        entries = OrderedDict((cached.id, cached) for cached in snapshots[:max(0, self.max_size)])
+        with self._lock:
+            self._invalidations += 1
+            self._entries = entries
+        return snapshots
+
+    async def get(self, db: AsyncSession, rule_id: int) -> Optional[CachedRule]:
+        cached = self._lookup(rule_id)
+        if cached is not None:
+            return cached
+        invalidations = self._invalidations
+        rule = await crud.AsyncRuleRepository.get_rule(db, rule_id)
+        if rule is None:
+            return None
+        await self.schemas.load(db, [rule.schema_id])
+        return self._store_loaded([rule], invalidations)[rule.id]
+
+    async def get_many(self, db: AsyncSession, rule_ids: Iterable[int]) -> Dict[int, CachedRule]:
+        # Misses are loaded with a single IN (...) query; ids that do not
+        # exist are absent from the result
+        found: Dict[int, CachedRule] = {}
+        missing = []
+        for rule_id in dict.fromkeys(rule_ids):
+            cached = self._lookup(rule_id)
+            if cached is None:
+                missing.append(rule_id)
+            else:
+                found[rule_id] = cached
+        if missing:
+            invalidations = self._invalidations
+            rules = await crud.AsyncRuleRepository.get_rules_by_ids(db, missing)
+            await self.schemas.load(db, {rule.schema_id for rule in rules})
+            found.update(self._store_loaded(rules, invalidations))
+        return found
+
+    def put(self, rule: models.Rule, ast: Optional[NodeBase] = None) -> CachedRule:
+        # Called after a write with the committed row (and the AST it was
+        # parsed to, which saves decoding it again); swaps in the new version
+        cached = self._snapshot(rule, ast)
+        with self._lock:
+            self._invalidations += 1
+            self._store(cached)
+        return cached
+
+    def compile(self, rule: CachedRule) -> CompiledRule:
+        if rule.compiled is None:
+            rule.compiled = self.compiled.get(rule.id, rule.version, rule.ast_json, rule.ast_blob, rule.schema)
+        return rule.compiled
+
+    def invalidate(self, rule_id: int) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._entries.pop(rule_id, None)
+        self.compiled.invalidate(rule_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._entries = OrderedDict()
+        self.compiled.clear()
@@ -0,0 +1,250 @@
+import json
+import struct
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from .schemas import NodeBase
+from .parser import Operator, NodeType
+
+MAGIC = b"RAST"
+FORMAT_VERSION = 1
+
+OPCODES = {
+    Operator.AND.value: 1,
+    Operator.OR.value: 2,
+    Operator.GT.value: 3,
+    Operator.LT.value: 4,
+    Operator.EQ.value: 5,
+    Operator.GTE.value: 6,
+    Operator.LTE.value: 7,
+    Operator.IN.value: 8,
+}
+OPERATORS = {opcode: operator for operator, opcode in OPCODES.items()}
+LOGICAL_OPCODES = (OPCODES[Operator.AND.value], OPCODES[Operator.OR.value])
+# Constant TRUE/FALSE leaf; its value is in the constant table
+CONSTANT_OPCODE = 9
+
+# Constant tags in the binary constant table
+CONST_NONE, CONST_FALSE, CONST_TRUE, CONST_INT, CONST_FLOAT, CONST_STR, CONST_JSON = range(7)
+
+_HEADER = struct.Struct("<4sBIII")
+_LENGTH = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_SWAP = sys.byteorder != "little"
+
+def constant_key(value: Any) -> Tuple[str, Any]:
+    # 1, 1.0 and True are equal in Python but must round-trip as themselves
+    if isinstance(value, (list, dict)):
+        return ("json", json.dumps(value, sort_keys=True))
+    return (type(value).__name__, value)
+
+def _u32(values: List[int]) -> array:
+    data = array("I", values)
+    if data.itemsize != 4:
+        data = array("L", values)
+    return data
+
+class CompactRule:
+    # Flat postorder encoding of a rule AST. Node i has an opcode, an index
+    # into the interned field table and constant table (leaves only) and the
+    # size of its subtree, so the right child of an operator at i is i - 1
+    # and its left child is i - 1 - size[i - 1].
+    __slots__ = ("opcodes", "field_ids", "constant_ids", "sizes", "fields", "constants")
+
+    def __init__(
+        self,
+        opcodes: array,
+        field_ids: array,
+        constant_ids: array,
+        sizes: array,
+        fields: List[str],
+        constants: List[Any]
+    ):
+        self.opcodes = opcodes
+        self.field_ids = field_ids
+        self.constant_ids = constant_ids
+        self.sizes = sizes
+        self.fields = fields
+        self.constants = constants
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    @classmethod
+    def from_node(cls, root: NodeBase) -> "CompactRule":
+        opcodes: List[int] = []
+        field_ids: List[int] = []
+        constant_ids: List[int] = []
+        sizes: List[int] = []
+        fields: Dict[str, int] = {}
+        constants: Dict[Tuple[str, Any], int] = {}
+        constant_values: List[Any] = []
+
+        # Iterative postorder: (node, children_done)
+        def constant_id(value: Any) -> int:
+            key = constant_key(value)
+            if key not in constants:
+                constants[key] = len(constant_values)
+                constant_values.append(value)
+            return constants[key]
+
+        pending: List[Tuple[NodeBase, bool]] = [(root, False)]
+        while pending:
+            node, expanded = pending.pop()
+            opcode = OPCODES.get(node.operator)
+            if node.type == NodeType.OPERATOR:
+                if opcode not in LOGICAL_OPCODES or node.left is None or node.right is None \
+                        or node.field is not None or node.value is not None:
+                    raise ValueError(f"Cannot encode operator node: {node.operator}")
+                if not expanded:
+                    pending.append((node, True))
+                    pending.append((node.right, False))
+                    pending.append((node.left, False))
+                    continue
+                right_size = sizes[-1]
+                left_size = sizes[-1 - right_size]
+                opcodes.append(opcode)
+                field_ids.append(0)
+                constant_ids.append(0)
+                sizes.append(left_size + right_size + 1)
+            elif node.type == NodeType.COMPARISON:
+                if opcode is None or opcode in LOGICAL_OPCODES or not isinstance(node.field, str) \
+                        or node.left is not None or node.right is not None:
+                    raise ValueError(f"Cannot encode comparison node: {node.operator}")
+                opcodes.append(opcode)
+                field_ids.append(fields.setdefault(node.field, len(fields)))
+                constant_ids.append(constant_id(node.value))
+                sizes.append(1)
+            elif node.type == NodeType.CONSTANT:
+                if node.value not in (True, False) or node.left is not None or node.right is not None:
+                    raise ValueError(f"Cannot encode constant node: {node.value!r}")
+                opcodes.append(CONSTANT_OPCODE)
+                field_ids.append(0)
+                constant_ids.append(constant_id(bool(node.value)))
+                sizes.append(1)
+            else:
+                raise ValueError(f"Cannot encode node type: {node.type}")
+
+        return cls(
+            array("B", opcodes), _u32(field_ids), _u32(constant_ids), _u32(sizes),
+            list(fields), constant_values
+        )
+
+    def to_node(self) -> NodeBase:
+        stack: List[NodeBase] = []
+        for i, opcode in enumerate(self.opcodes):
+            if opcode in LOGICAL_OPCODES:
+                right = stack.pop()
+                left = stack.pop()
+                stack.append(NodeBase.model_construct(
+                    type=NodeType.OPERATOR.value, operator=OPERATORS[opcode],
+                    field=None, value=None, left=left, right=right
+                ))
+            elif opcode == CONSTANT_OPCODE:
+                stack.append(NodeBase.model_construct(
+                    type=NodeType.CONSTANT.value, operator=None, field=None,
+                    value=self.constants[self.constant_ids[i]], left=None, right=None
+                ))
+            else:
+                stack.append(NodeBase.model_construct(
+                    type=NodeType.COMPARISON.value, operator=OPERATORS[opcode],
+                    field=self.fields[self.field_ids[i]],
+                    value=self.constants[self.constant_ids[i]],
+                    left=None, right=None
+                ))
+        return stack[0]
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, len(self.opcodes), len(self.fields), len(self.constants))]
+        for field in self.fields:
+            encoded = field.encode("utf-8")
+            parts.append(_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        for value in self.constants:
+            parts.append(self._encode_constant(value))
+        parts.append(self.opcodes.tobytes())
+        for values in (self.field_ids, self.constant_ids, self.sizes):
+            if _SWAP:
+                values = array(values.typecode, values)
+                values.byteswap()
+            parts.append(values.tobytes())
+        return b"".join(parts)
+
+    @staticmethod
+    def _encode_constant(value: Any) -> bytes:
+        if value is None:
+            return bytes([CONST_NONE])
+        if value is True or value is False:
+            return bytes([CONST_TRUE if value else CONST_FALSE])
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return bytes([CONST_INT]) + _INT.pack(value)
+        if type(value) is float:
+            return bytes([CONST_FLOAT]) + _FLOAT.pack(value)
+        if type(value) is str:
+            encoded = value.encode("utf-8")
+            return bytes([CONST_STR]) + _LENGTH.pack(len(encoded)) + encoded
+        encoded = json.dumps(value).encode("utf-8")
+        return bytes([CONST_JSON]) + _LENGTH.pack(len(encoded)) + encoded
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CompactRule":
+        view = memoryview(data)
+        magic, version, node_count, field_count, constant_count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Unsupported compact rule encoding")
+        offset = _HEADER.size
+
+        fields = []
+        for _ in range(field_count):
+            (length,) = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            fields.append(str(view[offset:offset + length], "utf-8"))
+            offset += length
+
+        constants = []
+        for _ in range(constant_count):
+            tag = view[offset]
+            offset += 1
+            if tag == CONST_NONE:
+                constants.append(None)
+            elif tag in (CONST_FALSE, CONST_TRUE):
+                constants.append(tag == CONST_TRUE)
+            elif tag == CONST_INT:
+                constants.append(_INT.unpack_from(view, offset)[0])
+                offset += _INT.size
+            elif tag == CONST_FLOAT:
+                constants.append(_FLOAT.unpack_from(view, offset)[0])
+                offset += _FLOAT.size
+            else:
+                (length,) = _LENGTH.unpack_from(view, offset)
+                offset += _LENGTH.size
+                text = str(view[offset:offset + length], "utf-8")
+                constants.append(text if tag == CONST_STR else json.loads(text))
+                offset += length
+
+        opcodes = array("B")
+        opcodes.frombytes(view[offset:offset + node_count])
+        offset += node_count
+        columns = []
+        for _ in range(3):
+            values = _u32([])
+            size = node_count * values.itemsize
+            values.frombytes(view[offset:offset + size])
+            if _SWAP:
+                values.byteswap()
+            columns.append(values)
+            offset += size
+
+        return cls(opcodes, columns[0], columns[1], columns[2], fields, constants)
+
+def encode_rule(node: NodeBase) -> Optional[bytes]:
+    # None when the tree holds something the compact form cannot represent
+    # losslessly (e.g. an unknown operator); such rules keep only ast_json
+    try:
+        return CompactRule.from_node(node).to_bytes()
+    except ValueError:
+        return None
+
+def decode_rule(data: bytes) -> CompactRule:
+    return CompactRule.from_bytes(data)
@@ -0,0 +1,429 @@
+import operator
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+from .schemas import NodeBase
+from .fields import FieldSpec, RecordSchema
+from .parser import Operator, NodeType
+from .compact import CompactRule, CONSTANT_OPCODE, LOGICAL_OPCODES, OPERATORS, decode_rule
+
+CompiledFn = Callable[[Dict[str, Any]], bool]
+
+def is_member(value: Any, values: Any) -> bool:
+    # An unhashable record value cannot equal any of the (scalar) constants
+    try:
+        return value in values
+    except TypeError:
+        return False
+
+def member_constant(values: List[Any]) -> Any:
+    # The constants of an IN comparison as a frozenset when possible
+    try:
+        return frozenset(values)
+    except TypeError:
+        return tuple(values)
+
+COMPARATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    Operator.GT.value: operator.gt,
+    Operator.LT.value: operator.lt,
+    Operator.EQ.value: operator.eq,
+    Operator.GTE.value: operator.ge,
+    Operator.LTE.value: operator.le,
+    Operator.IN.value: is_member,
+}
+
+LOGICAL_OPERATORS = (Operator.AND.value, Operator.OR.value)
+
+def flatten_logical(node: NodeBase) -> List[NodeBase]:
+    # Collects the operands of a chain of the same AND/OR operator, left to right
+    children = []
+    stack = [node.right, node.left]
+    while stack:
+        child = stack.pop()
+        if child.type == NodeType.OPERATOR and child.operator == node.operator:
+            stack.append(child.right)
+            stack.append(child.left)
+        else:
+            children.append(child)
+    return children
+
+def load_node(ast_json: Optional[dict], ast_blob: Optional[bytes] = None) -> NodeBase:
+    # The compact encoding skips JSON decoding and pydantic validation
+    if ast_blob is not None:
+        return decode_rule(ast_blob).to_node()
+    return NodeBase.model_validate(ast_json)
+
+def render_node(node: NodeBase) -> str:
+    if node.type == NodeType.OPERATOR:
+        return f"({render_node(node.left)} {node.operator} {render_node(node.right)})"
+    if node.type == NodeType.CONSTANT:
+        return "TRUE" if node.value else "FALSE"
+    if node.operator == Operator.IN:
+        return f"{node.field} IN ({', '.join(map(str, node.value))})"
+    return f"{node.field} {node.operator} {node.value}"
+
+def compile_error(message: str) -> CompiledFn:
+    def error(data: Dict[str, Any]) -> bool:
+        raise ValueError(message)
+    return error
+
+def compile_constant(value: Any) -> CompiledFn:
+    result = bool(value)
+
+    def constant(data: Dict[str, Any]) -> bool:
+        return result
+    return constant
+
+def compile_comparison(node: NodeBase) -> CompiledFn:
+    return compile_predicate(node.operator, node.field, node.value)
+
+def compile_predicate(operator_value: str, field: str, value: Any) -> CompiledFn:
+    compare = COMPARATORS.get(operator_value)
+    if compare is None:
+        return compile_error(f"Invalid comparison operator: {operator_value}")
+    if operator_value == Operator.IN:
+        value = member_constant(value)
+
+    missing = f"Field '{field}' not found in data"
+
+    def comparison(data: Dict[str, Any]) -> bool:
+        field_value = data.get(field)
+        if field_value is None:
+            raise ValueError(missing)
+        return compare(field_value, value)
+
+    return comparison
+
+def compile_typed_predicate(operator_value: str, spec: FieldSpec, value: Any) -> CompiledFn:
+    # The constant is already of the field's type. A record value of that
+    # type (and, for enums, an allowed value) is compared as is; anything
+    # else goes through the field's coercer, which converts it or raises.
+    # Null fails the comparison if the field is nullable and is reported
+    # as missing otherwise.
+    compare = COMPARATORS.get(operator_value)
+    if compare is None:
+        return compile_error(f"Invalid comparison operator: {operator_value}")
+    if operator_value == Operator.IN:
+        value = member_constant(value)
+
+    field = spec.name
+    expected = spec.python_type
+    allowed = spec.enum
+    coerce = spec.coerce
+    nullable = spec.nullable
+    missing = f"Field '{field}' not found in data"
+
+    def slow_path(field_value: Any) -> bool:
+        field_value = coerce(field_value)
+        if field_value is None:
+            if nullable:
+                return False
+            raise ValueError(missing)
+        return compare(field_value, value)
+
+    if allowed is None:
+        def typed_comparison(data: Dict[str, Any]) -> bool:
+            field_value = data.get(field)
+            if type(field_value) is expected:
+                return compare(field_value, value)
+            return slow_path(field_value)
+        return typed_comparison
+
+    def enum_comparison(data: Dict[str, Any]) -> bool:
+        field_value = data.get(field)
+        if type(field_value) is expected and field_value in allowed:
+            return compare(field_value, value)
+        return slow_path(field_value)
+    return enum_comparison
+
+def compile_group(operator_value: str, children: List[CompiledFn]) -> CompiledFn:
+    # Short-circuits left to right over the (possibly reordered) operands
+    if operator_value == Operator.AND:
+        if len(children) == 2:
+            first, second = children
+            def logical_and(data: Dict[str, Any]) -> bool:
+                return bool(first(data) and second(data))
+            return logical_and
+
+        def logical_all(data: Dict[str, Any]) -> bool:
+            for child in children:
+                if not child(data):
+                    return False
+            return True
+        return logical_all
+
+    if len(children) == 2:
+        first, second = children
+        def logical_or(data: Dict[str, Any]) -> bool:
+            return bool(first(data) or second(data))
+        return logical_or
+
+    def logical_any(data: Dict[str, Any]) -> bool:
+        for child in children:
+            if child(data):
+                return True
+        return False
+    return logical_any
+
+class RuleCompiler:
+    # Operators are resolved and literals bound once, so the returned closure
+    # does no enum dispatch and no pydantic attribute access per evaluation
+    def compile(self, node: NodeBase) -> CompiledFn:
+        if node.type == NodeType.OPERATOR:
+            if node.operator not in LOGICAL_OPERATORS:
+                return compile_error(f"Invalid logical operator: {node.operator}")
+            children = [self.compile(child) for child in flatten_logical(node)]
+            return compile_group(node.operator, children)
+        elif node.type == NodeType.COMPARISON:
+            return compile_comparison(node)
+        elif node.type == NodeType.CONSTANT:
+            return compile_constant(node.value)
+        return compile_error(f"Invalid node type: {node.type}")
+
+    def compile_typed(self, node: NodeBase, schema: RecordSchema) -> CompiledFn:
+        # Like compile(), with comparisons specialized to their field's type.
+        # The node must already be bound to the schema (RecordSchema.bind).
+        if node.type == NodeType.OPERATOR:
+            if node.operator not in LOGICAL_OPERATORS:
+                return compile_error(f"Invalid logical operator: {node.operator}")
+            children = [self.compile_typed(child, schema) for child in flatten_logical(node)]
+            return compile_group(node.operator, children)
+        elif node.type == NodeType.COMPARISON:
+            return compile_typed_predicate(node.operator, schema.field(node.field), node.value)
+        elif node.type == NodeType.CONSTANT:
+            return compile_constant(node.value)
+        return compile_error(f"Invalid node type: {node.type}")
+
+    def compile_compact(self, rule: CompactRule) -> CompiledFn:
+        # Same closures as compile(), built straight from the flat postorder
+        # arrays: no NodeBase objects and no recursion. Operands of
+        # same-operator chains are merged into one group as they are popped.
+        stack: List[Tuple[Optional[int], Any]] = []
+
+        def finish(entry: Tuple[Optional[int], Any]) -> CompiledFn:
+            opcode, payload = entry
+            return payload if opcode is None else compile_group(OPERATORS[opcode], payload)
+
+        for i, opcode in enumerate(rule.opcodes):
+            if opcode in LOGICAL_OPCODES:
+                right = stack.pop()
+                left = stack.pop()
+                children = left[1] if left[0] == opcode else [finish(left)]
+                children.extend(right[1] if right[0] == opcode else [finish(right)])
+                stack.append((opcode, children))
+            elif opcode == CONSTANT_OPCODE:
+                stack.append((None, compile_constant(rule.constants[rule.constant_ids[i]])))
+            else:
+                stack.append((None, compile_predicate(
+                    OPERATORS[opcode],
+                    rule.fields[rule.field_ids[i]],
+                    rule.constants[rule.constant_ids[i]]
+                )))
+        return finish(stack[0])
+
+class AdaptiveRule:
+    # A compiled rule that samples per-node pass rates from live traffic and
+    # periodically reorders the operands of AND/OR groups. For AND the
+    # operand most likely to fail per unit of cost runs first, for OR the
+    # one most likely to pass. Cost is the number of comparisons underneath.
+    #
+    # Operands are not interchangeable when a missing field or a type
+    # mismatch raises, so a reordered group that raises is evaluated again
+    # as written (nested groups included) and returns or raises exactly what
+    # the rule's own order does. When both orders return, the values are
+    # equal; the one difference left is that a record the rule's own order
+    # rejects with an error can get a result if the reordered group is
+    # decided before reaching the failing operand.
+    def __init__(self, node: NodeBase, sample_every: int = 10, replan_every: int = 500):
+        self.sample_every = max(1, sample_every)
+        self.replan_every = max(1, replan_every)
+        self.nodes: List[NodeBase] = []
+        self.children: List[List[int]] = []
+        self.cost: List[int] = []
+        self._index(node)
+
+        count = len(self.nodes)
+        self.order: List[List[int]] = [list(children) for children in self.children]
+        self.evaluations = [0] * count
+        self.passes = [0] * count
+        self.calls = 0
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._fast = self._build(0, instrumented=False)
+        self._sampled = self._build(0, instrumented=True)
+
+    def __call__(self, data: Dict[str, Any]) -> bool:
+        self.calls += 1
+        if self.calls % self.sample_every:
+            return self._fast(data)
+
+        result = self._sampled(data)
+        self.samples += 1
+        if self.samples % self.replan_every == 0:
+            self.replan()
+        return result
+
+    def _index(self, root: NodeBase) -> None:
+        # Preorder ids over leaves and flattened AND/OR groups
+        pending: List[Tuple[NodeBase, int]] = [(root, -1)]
+        while pending:
+            node, parent = pending.pop()
+            node_id = len(self.nodes)
+            self.nodes.append(node)
+            self.children.append([])
+            self.cost.append(1)
+            if parent >= 0:
+                self.children[parent].append(node_id)
+            if node.type == NodeType.OPERATOR and node.operator in LOGICAL_OPERATORS:
+                for child in reversed(flatten_logical(node)):
+                    pending.append((child, node_id))
+
+        for node_id in range(len(self.nodes) - 1, -1, -1):
+            if self.children[node_id]:
+                self.cost[node_id] = sum(self.cost[child] for child in self.children[node_id])
+
+    def _build(self, node_id: int, instrumented: bool) -> CompiledFn:
+        node = self.nodes[node_id]
+        if self.children[node_id]:
+            fn = compile_group(
+                node.operator,
+                [self._build(child, instrumented) for child in self.order[node_id]]
+            )
+            if self.order[node_id] != self.children[node_id]:
+                fn = self._guarded(fn, RuleCompiler().compile(node))
+        else:
+            fn = RuleCompiler().compile(node)
+
+        if not instrumented:
+            return fn
+
+        evaluations = self.evaluations
+        passes = self.passes
+
+        def counted(data: Dict[str, Any]) -> bool:
+            evaluations[node_id] += 1
+            result = fn(data)
+            if result:
+                passes[node_id] += 1
+            return result
+
+        return counted
+
+    @staticmethod
+    def _guarded(planned: CompiledFn, original: CompiledFn) -> CompiledFn:
+        def guarded(data: Dict[str, Any]) -> bool:
+            try:
+                return planned(data)
+            except Exception:
+                return original(data)
+        return guarded
+
+    def pass_rate(self, node_id: int) -> float:
+        # Laplace-smoothed so unsampled nodes start at 0.5
+        return (self.passes[node_id] + 1) / (self.evaluations[node_id] + 2)
+
+    def replan(self) -> None:
+        order = []
+        for node_id, children in enumerate(self.children):
+            if not children:
+                order.append([])
+                continue
+            if self.nodes[node_id].operator == Operator.AND:
+                decisive = lambda child: (1 - self.pass_rate(child)) / self.cost[child]
+            else:
+                decisive = lambda child: self.pass_rate(child) / self.cost[child]
+            order.append(sorted(children, key=decisive, reverse=True))
+
+        with self._lock:
+            self.order = order
+            self._fast = self._build(0, instrumented=False)
+            self._sampled = self._build(0, instrumented=True)
+
+    def render(self, node_id: int = 0) -> str:
+        node = self.nodes[node_id]
+        if self.children[node_id]:
+            parts = [self.render(child) for child in self.order[node_id]]
+            return f"({f' {node.operator} '.join(parts)})"
+        return render_node(node)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "node_id": node_id,
+                "expression": self.render(node_id),
+                "cost": self.cost[node_id],
+                "evaluations": self.evaluations[node_id],
+                "passes": self.passes[node_id],
+                "pass_rate": (
+                    self.passes[node_id] / self.evaluations[node_id]
+                    if self.evaluations[node_id] else None
+                ),
+                "children": self.order[node_id],
+            }
+            for node_id in range(len(self.nodes))
+        ]
+
+CompiledRule = Union[CompiledFn, AdaptiveRule]
+
+class CompiledRuleCache:
+    # Process-wide, keyed by rule id; an entry is reused only while the
+    # rule's version matches the one it was compiled from
+    def __init__(
+        self,
+        compiler: Optional[RuleCompiler] = None,
+        adaptive: bool = False,
+        sample_every: int = 10,
+        replan_every: int = 500
+    ):
+        self.compiler = compiler or RuleCompiler()
+        self.adaptive = adaptive
+        self.sample_every = sample_every
+        self.replan_every = replan_every
+        self._entries: Dict[int, Tuple[Hashable, CompiledRule]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        rule_id: int,
+        version: Hashable,
+        ast_json: Optional[dict],
+        ast_blob: Optional[bytes] = None,
+        schema: Optional[RecordSchema] = None
+    ) -> CompiledRule:
+        entry = self._entries.get(rule_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        # Rules with a schema always use the typed form (not adaptive plans)
+        if schema is not None:
+            compiled = self.compiler.compile_typed(load_node(ast_json, ast_blob), schema)
+        elif self.adaptive:
+            compiled = AdaptiveRule(load_node(ast_json, ast_blob), self.sample_every, self.replan_every)
+        elif ast_blob is not None:
+            compiled = self.compiler.compile_compact(decode_rule(ast_blob))
+        else:
+            compiled = self.compiler.compile(NodeBase.model_validate(ast_json))
+        with self._lock:
+            self._entries[rule_id] = (version, compiled)
+        return compiled
+
+    def plan(
+        self,
+        rule_id: int,
+        version: Hashable,
+        ast_json: Optional[dict],
+        ast_blob: Optional[bytes] = None,
+        schema: Optional[RecordSchema] = None
+    ) -> AdaptiveRule:
+        # Outside adaptive mode this is the static plan with empty stats
+        compiled = self.get(rule_id, version, ast_json, ast_blob, schema)
+        if isinstance(compiled, AdaptiveRule):
+            return compiled
+        return AdaptiveRule(load_node(ast_json, ast_blob), self.sample_every, self.replan_every)
+
+    def invalidate(self, rule_id: int) -> None:
+        with self._lock:
+            self._entries.pop(rule_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,113 @@
+import os
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+# Adaptive evaluation: reorder AND/OR children from observed pass rates
+ADAPTIVE_EVALUATION = _env_bool("RULE_ENGINE_ADAPTIVE", False)
+# Every Nth evaluation of a rule is instrumented to collect per-node stats
+ADAPTIVE_SAMPLE_EVERY = _env_int("RULE_ENGINE_ADAPTIVE_SAMPLE_EVERY", 10)
+# The plan is recomputed after this many instrumented evaluations
+ADAPTIVE_REPLAN_EVERY = _env_int("RULE_ENGINE_ADAPTIVE_REPLAN_EVERY", 500)
+
+# Evaluation history: sync, buffered, sampled or off
+HISTORY_MODE = os.environ.get("RULE_ENGINE_HISTORY_MODE", "sync").strip().lower()
+HISTORY_BATCH_SIZE = _env_int("RULE_ENGINE_HISTORY_BATCH_SIZE", 500)
+HISTORY_FLUSH_INTERVAL_MS = _env_int("RULE_ENGINE_HISTORY_FLUSH_INTERVAL_MS", 50)
+HISTORY_SAMPLE_RATE = _env_float("RULE_ENGINE_HISTORY_SAMPLE_RATE", 0.1)
+# Rows waiting for the history writer; beyond this they are dropped (and
+# counted) instead of stalling requests
+HISTORY_QUEUE_SIZE = _env_int("RULE_ENGINE_HISTORY_QUEUE_SIZE", 100000)
+# Background compaction of the history: rows older than ARCHIVE_AFTER_DAYS
+# move to the archive table and rows older than RETENTION_DAYS are deleted
+# (0 disables either step); it runs every COMPACTION_INTERVAL_SECONDS (0:
+# never) in transactions of at most COMPACTION_BATCH_SIZE rows
+HISTORY_ARCHIVE_AFTER_DAYS = _env_int("RULE_ENGINE_HISTORY_ARCHIVE_AFTER_DAYS", 30)
+HISTORY_RETENTION_DAYS = _env_int("RULE_ENGINE_HISTORY_RETENTION_DAYS", 0)
+HISTORY_COMPACTION_INTERVAL_SECONDS = _env_int("RULE_ENGINE_HISTORY_COMPACTION_INTERVAL_SECONDS", 3600)
+HISTORY_COMPACTION_BATCH_SIZE = _env_int("RULE_ENGINE_HISTORY_COMPACTION_BATCH_SIZE", 5000)
+
+# Per-rule evaluation stats (GET /api/rules/{id}/stats) are kept in minute
+# and hour rollups, written every ROLLUP_FLUSH_INTERVAL_MS; minute rollups
+# are dropped after ROLLUP_MINUTE_RETENTION_DAYS (0: kept). With
+# ROLLUP_BACKFILL the history recorded before rollups were enabled is
+# added once, in the background, reading BACKFILL_CHUNK_SIZE rows at a time.
+ROLLUPS_ENABLED = _env_bool("RULE_ENGINE_ROLLUPS", True)
+ROLLUP_FLUSH_INTERVAL_MS = _env_int("RULE_ENGINE_ROLLUP_FLUSH_INTERVAL_MS", 1000)
+ROLLUP_MINUTE_RETENTION_DAYS = _env_int("RULE_ENGINE_ROLLUP_MINUTE_RETENTION_DAYS", 7)
+ROLLUP_BACKFILL = _env_bool("RULE_ENGINE_ROLLUP_BACKFILL", True)
+ROLLUP_BACKFILL_CHUNK_SIZE = _env_int("RULE_ENGINE_ROLLUP_BACKFILL_CHUNK_SIZE", 10000)
+# Largest number of buckets one stats request may span
+ROLLUP_MAX_BUCKETS = _env_int("RULE_ENGINE_ROLLUP_MAX_BUCKETS", 10000)
+
+# Database: any SQLAlchemy URL; the async driver is derived from it
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///rule_engine.db")
+DB_POOL_SIZE = _env_int("RULE_ENGINE_DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _env_int("RULE_ENGINE_DB_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT = _env_int("RULE_ENGINE_DB_POOL_TIMEOUT", 30)
+SQLITE_BUSY_TIMEOUT_MS = _env_int("RULE_ENGINE_SQLITE_BUSY_TIMEOUT_MS", 5000)
+
+# In-process cache of rule rows and their decoded/compiled ASTs (LRU)
+RULE_CACHE_SIZE = _env_int("RULE_ENGINE_RULE_CACHE_SIZE", 10000)
+
+# Worker processes for bulk scoring (0 disables the pool); batches smaller
+# than EVAL_PARALLEL_MIN_RECORDS are evaluated in-process
+EVAL_WORKERS = _env_int("RULE_ENGINE_EVAL_WORKERS", os.cpu_count() or 1)
+EVAL_CHUNK_SIZE = _env_int("RULE_ENGINE_EVAL_CHUNK_SIZE", 1000)
+EVAL_MAX_PENDING_CHUNKS = _env_int("RULE_ENGINE_EVAL_MAX_PENDING_CHUNKS", 0)
+EVAL_PARALLEL_MIN_RECORDS = _env_int("RULE_ENGINE_EVAL_PARALLEL_MIN_RECORDS", 5000)
+EVAL_WORKER_RULE_CACHE_SIZE = _env_int("RULE_ENGINE_EVAL_WORKER_RULE_CACHE_SIZE", 256)
+
+# Streaming evaluation: longest NDJSON line accepted (longer lines are errors)
+STREAM_MAX_LINE_BYTES = _env_int("RULE_ENGINE_STREAM_MAX_LINE_BYTES", 16 * 1024 * 1024)
+
+# Rows fetched per round trip when exporting evaluation history
+EXPORT_BATCH_SIZE = _env_int("RULE_ENGINE_EXPORT_BATCH_SIZE", 1000)
+
+# Memoized results keyed on the fields a rule reads (size 0 disables);
+# hits can optionally skip the history write
+RESULT_CACHE_SIZE = _env_int("RULE_ENGINE_RESULT_CACHE_SIZE", 100000)
+RESULT_CACHE_TTL_SECONDS = _env_float("RULE_ENGINE_RESULT_CACHE_TTL_SECONDS", 300.0)
+RESULT_CACHE_SKIP_HISTORY = _env_bool("RULE_ENGINE_RESULT_CACHE_SKIP_HISTORY", False)
+
+# Engine behind /api/rules/match: "index" (shared predicate index) or "dag"
+# (decision diagram over all rules, rebuilt in the background on change;
+# rule sets needing more than DAG_MAX_NODES nodes fall back to trees)
+MATCH_ENGINE = os.environ.get("RULE_ENGINE_MATCH_ENGINE", "index").strip().lower()
+DAG_MAX_NODES = _env_int("RULE_ENGINE_DAG_MAX_NODES", 20000)
+
+# Entities kept by PATCH /api/entities/{id} with per-node rule outcomes for
+# incremental re-evaluation (least recently updated dropped first)
+ENTITY_CACHE_SIZE = _env_int("RULE_ENGINE_ENTITY_CACHE_SIZE", 10000)
+
+# Multi-worker serving: memory-mapped registry file (on tmpfs) through which
+# the uvicorn workers of one server share rule definitions, see rule changes
+# made by the others and allocate history ids; empty for a single process.
+# Entity state (/api/entities), the result cache, /metrics (labelled with
+# the worker's pid) and the profiler (/api/profile) stay per worker, so
+# entity updates need a single worker or a proxy that pins each entity id
+# to one worker.
+SHARED_REGISTRY_PATH = os.environ.get("RULE_ENGINE_SHARED_REGISTRY", "")
+SHARED_REGISTRY_BYTES = _env_int("RULE_ENGINE_SHARED_REGISTRY_BYTES", 64 * 2**20)
+
+# Simplify rule trees (interval merging, constant folding) before storing
+OPTIMIZE_RULES = _env_bool("RULE_ENGINE_OPTIMIZE_RULES", True)
+
+# Request/stage timings exported at /metrics; per-rule series are capped at
+# METRICS_MAX_RULE_LABELS rule ids (the rest are reported as "other")
+METRICS_ENABLED = _env_bool("RULE_ENGINE_METRICS", True)
+METRICS_MAX_RULE_LABELS = _env_int("RULE_ENGINE_METRICS_MAX_RULE_LABELS", 1000)
+# Fraction of requests run under cProfile at startup; adjustable at runtime
+# through PUT /api/profile
+PROFILE_SAMPLE_RATE = _env_float("RULE_ENGINE_PROFILE_SAMPLE_RATE", 0.0)
@@ -1,18 +1,168 @@
+from sqlalchemy import JSON, CompoundSelect, Delete, Row, Select, String, delete, insert, null, select, tuple_, type_coerce, union_all
+from sqlalchemy.types import TypeEngine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import inputs, models, schemas
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterable, List, Optional, Tuple
+
+# Ids per IN (...) query, well under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+def _chunks(ids: Iterable[int]) -> List[List[int]]:
+    unique = list(dict.fromkeys(ids))
+    return [unique[i:i + IN_CHUNK_SIZE] for i in range(0, len(unique), IN_CHUNK_SIZE)]
+
+# Keyset pagination: pass the sort key of the last row seen instead of an
+# offset, so deep pages cost the same as the first one
+
+def rules_query(skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> Select:
+    query = select(models.Rule).order_by(models.Rule.id)
+    if after_id is not None:
+        query = query.filter(models.Rule.id > after_id)
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+_LIVE = models.RuleEvaluation.__table__
+_ARCHIVE = models.ArchivedRuleEvaluation.__table__
+_INPUTS = models.EvaluationInput.__table__
+
+def _history(
+    rule_id: int,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    after: Optional[Tuple[Optional[datetime], int]],
+    input_type: TypeEngine
+) -> CompoundSelect:
+    # Live and archived rows of one rule read as a single history, each
+    # joined to its stored input. Both sides are scanned on their
+    # (rule_id, evaluated_at, id) index, so the ordered UNION ALL is a merge.
+    # Rows still carrying an inline input return it as input_data.
+    parts = []
+    for table in (_LIVE, _ARCHIVE):
+        inline = table.c.input_data if table is _LIVE else null()
+        query = select(
+            table.c.id,
+            table.c.rule_id,
+            table.c.rule_version,
+            table.c.result,
+            table.c.evaluated_at,
+            type_coerce(inline, input_type).label("input_data"),
+            _INPUTS.c.data
+        ).select_from(
+            table.outerjoin(_INPUTS, _INPUTS.c.hash == table.c.input_hash)
+        ).filter(table.c.rule_id == rule_id)
+        if since is not None:
+            query = query.filter(table.c.evaluated_at >= since)
+        if until is not None:
+            query = query.filter(table.c.evaluated_at < until)
+        if after is not None:
+            evaluated_at, evaluation_id = after
+            if evaluated_at is None:
+                query = query.filter(table.c.id > evaluation_id)
+            else:
+                query = query.filter(tuple_(table.c.evaluated_at, table.c.id) > tuple_(evaluated_at, evaluation_id))
+        parts.append(query)
+    history = union_all(*parts)
+    return history.order_by(history.selected_columns.evaluated_at, history.selected_columns.id)
+
+def evaluations_query(
+    rule_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Tuple[Optional[datetime], int]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> CompoundSelect:
+    query = _history(rule_id, since, until, after, JSON())
+    if after is None and skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def evaluation_export_query(
+    rule_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> CompoundSelect:
+    # Plain rows for streaming; inline inputs come back as the stored JSON
+    # text and stored ones as their packed bytes, neither decoded only to
+    # be encoded again
+    return _history(rule_id, since, until, None, String())
+
+def _evaluation(row: Row) -> schemas.RuleEvaluation:
+    return schemas.RuleEvaluation(
+        id=row.id,
+        rule_id=row.rule_id,
+        input_data=inputs.decode(row.data) if row.data is not None else row.input_data,
+        result=row.result,
+        evaluated_at=row.evaluated_at,
+        rule_version=row.rule_version
+    )
+
+def _evaluation_rows(rule_id: int, evaluations: List[Tuple[dict, bool]], rule_version: Optional[int]) -> Tuple[List[dict], List[dict]]:
+    hashes, stored = inputs.encode_many(input_data for input_data, _ in evaluations)
+    return stored, [
+        {"rule_id": rule_id, "rule_version": rule_version, "input_hash": input_hash, "result": result}
+        for input_hash, (_, result) in zip(hashes, evaluations)
+    ]
+
+def rollups_query(rule_id: int, granularity: int, start: datetime, end: datetime) -> Select:
+    # Buckets starting in [start, end), in time order; the primary key
+    # (rule_id, granularity, bucket_start, rule_version) is the scan order
+    rollup = models.RuleEvaluationRollup
+    return (
+        select(rollup)
+        .where(
+            rollup.rule_id == rule_id,
+            rollup.granularity == granularity,
+            rollup.bucket_start >= start,
+            rollup.bucket_start < end
+        )
+        .order_by(rollup.bucket_start, rollup.rule_version)
+    )
+
+def _delete_rule_rollups(rule_id: int) -> List[Delete]:
+    return [
+        delete(models.RuleEvaluationRollup).where(models.RuleEvaluationRollup.rule_id == rule_id),
+        delete(models.RuleRollupBackfill).where(models.RuleRollupBackfill.rule_id == rule_id),
+    ]
+
+def _version_of(db_rule: models.Rule) -> models.RuleVersion:
+    # Immutable copy of the rule's current definition
+    return models.RuleVersion(
+        rule_id=db_rule.id,
+        version=db_rule.version,
+        rule_string=db_rule.rule_string,
+        ast_json=db_rule.ast_json,
+        ast_blob=db_rule.ast_blob,
+        schema_id=db_rule.schema_id,
+        created_at=db_rule.updated_at
+    )
+
+def _versions_query(rule_id: int) -> Select:
+    return select(models.RuleVersion).filter(models.RuleVersion.rule_id == rule_id).order_by(models.RuleVersion.version)
+
+def _version_query(rule_id: int, version: int) -> Select:
+    return select(models.RuleVersion).filter(
+        models.RuleVersion.rule_id == rule_id, models.RuleVersion.version == version
+    )
 
 class RuleRepository:
     @staticmethod
-    def create_rule(db: Session, rule: schemas.RuleCreate, ast_json: dict):
+    def create_rule(db: Session, rule: schemas.RuleCreate, ast_json: dict, ast_blob: Optional[bytes] = None):
         db_rule = models.Rule(
             name=rule.name,
             description=rule.description,
             rule_string=rule.rule_string,
-            ast_json=ast_json
+            ast_json=ast_json,
+            ast_blob=ast_blob,
+            schema_id=rule.schema_id,
+            version=1
         )
         db.add(db_rule)
+        db.flush()
+        db.add(_version_of(db_rule))
         db.commit()
         db.refresh(db_rule)
         return db_rule
@@ -22,18 +172,43 @@ class RuleRepository:
         return db.query(models.Rule).filter(models.Rule.id == rule_id).first()
     
     @staticmethod
-    def get_rules(db: Session, skip: int = 0, limit: int = 100) -> List[models.Rule]:
-        return db.query(models.Rule).offset(skip).limit(limit).all()
+    def get_rules(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[models.Rule]:
+        return list(db.scalars(rules_query(skip, limit, after_id)))
+    
+    @staticmethod
+    def get_rules_by_ids(db: Session, rule_ids: Iterable[int]) -> List[models.Rule]:
+        # Unordered, and ids that do not exist are simply absent
+        rules = []
+        for chunk in _chunks(rule_ids):
+            rules.extend(db.query(models.Rule).filter(models.Rule.id.in_(chunk)).all())
+        return rules
+    
+    @staticmethod
+    def get_all_rules(db: Session) -> List[models.Rule]:
+        return db.query(models.Rule).all()
     
     @staticmethod
-    def update_rule(db: Session, rule_id: int, rule: schemas.RuleCreate, ast_json: dict) -> Optional[models.Rule]:
+    def update_rule(
+        db: Session,
+        rule_id: int,
+        rule: schemas.RuleCreate,
+        ast_json: dict,
+        ast_blob: Optional[bytes] = None
+    ) -> Optional[models.Rule]:
         db_rule = db.query(models.Rule).filter(models.Rule.id == rule_id).first()
         if db_rule:
             db_rule.name = rule.name
             db_rule.description = rule.description
             db_rule.rule_string = rule.rule_string
             db_rule.ast_json = ast_json
+            db_rule.ast_blob = ast_blob
+            db_rule.schema_id = rule.schema_id
             db_rule.updated_at = datetime.utcnow()
+            # Incremented in SQL so concurrent updates cannot reuse a number
+            db_rule.version = models.Rule.version + 1
+            db.flush()
+            db.refresh(db_rule, ["version"])
+            db.add(_version_of(db_rule))
             db.commit()
             db.refresh(db_rule)
         return db_rule
@@ -42,37 +217,231 @@ class RuleRepository:
     def delete_rule(db: Session, rule_id: int) -> bool:
         db_rule = db.query(models.Rule).filter(models.Rule.id == rule_id).first()
         if db_rule:
+            db.execute(delete(models.RuleVersion).where(models.RuleVersion.rule_id == rule_id))
+            for statement in _delete_rule_rollups(rule_id):
+                db.execute(statement)
             db.delete(db_rule)
             db.commit()
             return True
         return False
     
+    @staticmethod
+    def get_rule_versions(db: Session, rule_id: int) -> List[models.RuleVersion]:
+        return list(db.scalars(_versions_query(rule_id)))
+    
+    @staticmethod
+    def get_rule_version(db: Session, rule_id: int, version: int) -> Optional[models.RuleVersion]:
+        return db.scalars(_version_query(rule_id, version)).first()
+    
     @staticmethod
     def create_evaluation(
         db: Session, 
         rule_id: int, 
         input_data: dict, 
-        result: bool
+        result: bool,
+        rule_version: Optional[int] = None
     ) -> models.RuleEvaluation:
-        evaluation = models.RuleEvaluation(
-            rule_id=rule_id,
-            input_data=input_data,
-            result=result
-        )
+        stored, rows = _evaluation_rows(rule_id, [(input_data, result)], rule_version)
+        db.execute(inputs.insert_inputs(db.bind.dialect.name), stored)
+        evaluation = models.RuleEvaluation(**rows[0])
         db.add(evaluation)
         db.commit()
         db.refresh(evaluation)
         return evaluation
     
+    @staticmethod
+    def create_evaluations(
+        db: Session,
+        rule_id: int,
+        evaluations: List[Tuple[dict, bool]],
+        rule_version: Optional[int] = None
+    ) -> List[int]:
+        if not evaluations:
+            return []
+        # Distinct inputs not stored yet, then one multi-row INSERT ...
+        # RETURNING and a single commit for the batch
+        stored, rows = _evaluation_rows(rule_id, evaluations, rule_version)
+        db.execute(inputs.insert_inputs(db.bind.dialect.name), stored)
+        ids = db.scalars(
+            insert(models.RuleEvaluation)
+            .returning(models.RuleEvaluation.id, sort_by_parameter_order=True),
+            rows
+        ).all()
+        db.commit()
+        return list(ids)
+    
     @staticmethod
     def get_rule_evaluations(
         db: Session, 
         rule_id: int, 
         skip: int = 0, 
-        limit: int = 100
-    ) -> List[models.RuleEvaluation]:
-        return db.query(models.RuleEvaluation)\
-            .filter(models.RuleEvaluation.rule_id == rule_id)\
-            .offset(skip)\
-            .limit(limit)\
-            .all()
+        limit: int = 100,
+        after: Optional[Tuple[Optional[datetime], int]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> List[schemas.RuleEvaluation]:
+        return [_evaluation(row) for row in db.execute(evaluations_query(rule_id, skip, limit, after, since, until))]
+    
+    @staticmethod
+    def get_rule_rollups(
+        db: Session, rule_id: int, granularity: int, start: datetime, end: datetime
+    ) -> List[models.RuleEvaluationRollup]:
+        return list(db.scalars(rollups_query(rule_id, granularity, start, end)))
+
+class AsyncRuleRepository:
+    @staticmethod
+    async def create_rule(
+        db: AsyncSession,
+        rule: schemas.RuleCreate,
+        ast_json: dict,
+        ast_blob: Optional[bytes] = None
+    ) -> models.Rule:
+        db_rule = models.Rule(
+            name=rule.name,
+            description=rule.description,
+            rule_string=rule.rule_string,
+            ast_json=ast_json,
+            ast_blob=ast_blob,
+            schema_id=rule.schema_id,
+            version=1
+        )
+        db.add(db_rule)
+        await db.flush()
+        db.add(_version_of(db_rule))
+        await db.commit()
+        await db.refresh(db_rule)
+        return db_rule
+    
+    @staticmethod
+    async def get_rule(db: AsyncSession, rule_id: int) -> Optional[models.Rule]:
+        return await db.get(models.Rule, rule_id)
+    
+    @staticmethod
+    async def get_rules(
+        db: AsyncSession,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: Optional[int] = None
+    ) -> List[models.Rule]:
+        result = await db.scalars(rules_query(skip, limit, after_id))
+        return list(result)
+    
+    @staticmethod
+    async def get_rules_by_ids(db: AsyncSession, rule_ids: Iterable[int]) -> List[models.Rule]:
+        rules = []
+        for chunk in _chunks(rule_ids):
+            rules.extend(await db.scalars(select(models.Rule).filter(models.Rule.id.in_(chunk))))
+        return rules
+    
+    @staticmethod
+    async def get_all_rules(db: AsyncSession) -> List[models.Rule]:
+        result = await db.scalars(select(models.Rule))
+        return list(result)
+    
+    @staticmethod
+    async def update_rule(
+        db: AsyncSession,
+        rule_id: int,
+        rule: schemas.RuleCreate,
+        ast_json: dict,
+        ast_blob: Optional[bytes] = None
+    ) -> Optional[models.Rule]:
+        db_rule = await db.get(models.Rule, rule_id)
+        if db_rule:
+            db_rule.name = rule.name
+            db_rule.description = rule.description
+            db_rule.rule_string = rule.rule_string
+            db_rule.ast_json = ast_json
+            db_rule.ast_blob = ast_blob
+            db_rule.schema_id = rule.schema_id
+            db_rule.updated_at = datetime.utcnow()
+            # Incremented in SQL so concurrent updates cannot reuse a number
+            db_rule.version = models.Rule.version + 1
+            await db.flush()
+            await db.refresh(db_rule, ["version"])
+            db.add(_version_of(db_rule))
+            await db.commit()
+            await db.refresh(db_rule)
+        return db_rule
+    
+    @staticmethod
+    async def delete_rule(db: AsyncSession, rule_id: int) -> bool:
+        db_rule = await db.get(models.Rule, rule_id)
+        if db_rule:
+            await db.execute(delete(models.RuleVersion).where(models.RuleVersion.rule_id == rule_id))
+            for statement in _delete_rule_rollups(rule_id):
+                await db.execute(statement)
+            await db.delete(db_rule)
+            await db.commit()
+            return True
+        return False
+    
+    @staticmethod
+    async def get_rule_versions(db: AsyncSession, rule_id: int) -> List[models.RuleVersion]:
+        result = await db.scalars(_versions_query(rule_id))
+        return list(result)
+    
+    @staticmethod
+    async def get_rule_version(db: AsyncSession, rule_id: int, version: int) -> Optional[models.RuleVersion]:
+        result = await db.scalars(_version_query(rule_id, version))
+        return result.first()
+    
+    @staticmethod
+    async def create_schema(db: AsyncSession, name: str, fields: List[dict]) -> models.RuleSchema:
+        db_schema = models.RuleSchema(name=name, fields=fields)
+        db.add(db_schema)
+        await db.commit()
+        await db.refresh(db_schema)
+        return db_schema
+    
+    @staticmethod
+    async def get_schemas_by_ids(db: AsyncSession, schema_ids: Iterable[int]) -> List[models.RuleSchema]:
+        schemas_found = []
+        for chunk in _chunks(schema_ids):
+            schemas_found.extend(await db.scalars(select(models.RuleSchema).filter(models.RuleSchema.id.in_(chunk))))
+        return schemas_found
+    
+    @staticmethod
+    async def get_all_schemas(db: AsyncSession) -> List[models.RuleSchema]:
+        result = await db.scalars(select(models.RuleSchema).order_by(models.RuleSchema.id))
+        return list(result)
+    
+    @staticmethod
+    async def create_evaluations(
+        db: AsyncSession,
+        rule_id: int,
+        evaluations: List[Tuple[dict, bool]],
+        rule_version: Optional[int] = None
+    ) -> List[int]:
+        if not evaluations:
+            return []
+        stored, rows = _evaluation_rows(rule_id, evaluations, rule_version)
+        await db.execute(inputs.insert_inputs(db.bind.dialect.name), stored)
+        result = await db.scalars(
+            insert(models.RuleEvaluation)
+            .returning(models.RuleEvaluation.id, sort_by_parameter_order=True),
+            rows
+        )
+        ids = list(result)
+        await db.commit()
+        return ids
+    
+    @staticmethod
+    async def get_rule_evaluations(
+        db: AsyncSession,
+        rule_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Tuple[Optional[datetime], int]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> List[schemas.RuleEvaluation]:
+        result = await db.execute(evaluations_query(rule_id, skip, limit, after, since, until))
+        return [_evaluation(row) for row in result]
+    
+    @staticmethod
+    async def get_rule_rollups(
+        db: AsyncSession, rule_id: int, granularity: int, start: datetime, end: datetime
+    ) -> List[models.RuleEvaluationRollup]:
+        result = await db.scalars(rollups_query(rule_id, granularity, start, end))
+        return list(result)
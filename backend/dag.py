@@ -0,0 +1,452 @@
+import math
+import threading
+from itertools import compress
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from .schemas import NodeBase
+from .parser import Operator, NodeType
+from .fields import RecordSchema
+from .compiler import COMPARATORS, LOGICAL_OPERATORS, CompiledFn, RuleCompiler, flatten_logical
+
+# A rule's residual while the diagram is built: True/False, an error raised
+# by predicate p ("E", p), an undecided predicate ("P", p), or an AND/OR of
+# residuals that keeps the short-circuit order of the original rule
+Residual = Union[bool, Tuple]
+
+_AND = Operator.AND.value
+_OR = Operator.OR.value
+_EQ = Operator.EQ.value
+_BELOW = (Operator.LT.value, Operator.LTE.value)
+
+class TooLarge(Exception):
+    pass
+
+def _kind(value: Any) -> Optional[str]:
+    kind = type(value)
+    if kind in (int, float, bool):
+        return "number"
+    if kind is str:
+        return "string"
+    return None
+
+def _combine(operator: str, children: List[Residual]) -> Residual:
+    # Left to right like compile_group: the operand that decides the group
+    # (FALSE for AND, TRUE for OR) or an error stops evaluation, so nothing
+    # after it can matter; the identity is dropped
+    decisive = operator == _OR
+    kept: List[Residual] = []
+    for child in children:
+        if child is (not decisive):
+            continue
+        kept.append(child)
+        if child is decisive or (type(child) is tuple and child[0] == "E"):
+            break
+    if not kept:
+        return not decisive
+    if len(kept) == 1 or kept[0] is decisive or (type(kept[0]) is tuple and kept[0][0] == "E"):
+        return kept[0]
+    return (operator, tuple(kept))
+
+class _Leaf:
+    __slots__ = ("matched", "errors")
+
+    def __init__(self, matched: Tuple[int, ...], errors: Tuple[Tuple[int, int], ...]):
+        self.matched = matched
+        self.errors = errors
+
+class _Field:
+    # The values a field can take are split into regions that no comparison
+    # on the field can tell apart: below, at and between its sorted numeric
+    # thresholds, the same for string thresholds, then missing and NaN. A
+    # record's region is one bisect.
+    def __init__(self, name: str, predicates: List[Tuple[int, str, Any]]):
+        self.name = name
+        self.predicates = predicates
+        self.numbers = sorted({value for _, _, value in predicates if _kind(value) == "number"})
+        self.strings = sorted({value for _, _, value in predicates if _kind(value) == "string"})
+        self.string_base = 2 * len(self.numbers) + 1
+        self.missing = self.string_base + 2 * len(self.strings) + 1
+        self.nan = self.missing + 1
+        self.regions = self.nan + 1
+
+    def outcomes(self, region: int) -> Dict[int, Residual]:
+        return {predicate_id: self._outcome(predicate_id, operator, value, region)
+                for predicate_id, operator, value in self.predicates}
+
+    def _outcome(self, predicate_id: int, operator: str, value: Any, region: int) -> Residual:
+        if region == self.missing:
+            return ("E", predicate_id)
+        kind = _kind(value)
+        if region == self.nan:
+            return False if kind == "number" or operator == _EQ else ("E", predicate_id)
+        if region < self.string_base:
+            region_kind, thresholds, index = "number", self.numbers, region
+        else:
+            region_kind, thresholds, index = "string", self.strings, region - self.string_base
+        if region_kind != kind:
+            # '=' across kinds is False, ordering raises TypeError
+            return False if operator == _EQ else ("E", predicate_id)
+        if index % 2:
+            return bool(COMPARATORS[operator](thresholds[index // 2], value))
+        # Strictly between thresholds[i - 1] and thresholds[i]
+        if operator == _EQ:
+            return False
+        below = index // 2 <= bisect_left(thresholds, value)
+        return below if operator in _BELOW else not below
+
+    def classifier(self) -> Callable[[Dict[str, Any]], int]:
+        name = self.name
+        numbers, strings = self.numbers, self.strings
+        number_count, string_count = len(numbers), len(strings)
+        string_base, missing, nan = self.string_base, self.missing, self.nan
+
+        def classify(data: Dict[str, Any]) -> int:
+            # -1: a value the regions do not cover (lists, dicts, ...)
+            value = data.get(name)
+            if value is None:
+                return missing
+            kind = type(value)
+            if kind is int or kind is float or kind is bool:
+                if value != value:
+                    return nan
+                index = bisect_left(numbers, value)
+                return 2 * index + 1 if index < number_count and numbers[index] == value else 2 * index
+            if kind is str:
+                index = bisect_left(strings, value)
+                if index < string_count and strings[index] == value:
+                    return string_base + 2 * index + 1
+                return string_base + 2 * index
+            return -1
+
+        return classify
+
+class _Diagram:
+    # One built diagram and the rules it was built from; never mutated
+    __slots__ = ("root", "covered", "uncovered", "order", "predicates", "node_count", "exploded")
+
+    def __init__(self, rules: List[Tuple[int, NodeBase, Optional[RecordSchema]]], max_nodes: int):
+        self.order = {rule_id: position for position, (rule_id, _, _) in enumerate(rules)}
+        self.predicates: List[Tuple[str, str, Any]] = []
+        predicate_ids: Dict[Tuple, int] = {}
+        covered, uncovered, residuals = [], [], []
+        for rule_id, node, schema in rules:
+            # Typed rules coerce record values first, which regions cannot express
+            residual = None if schema is not None else self._translate(node, predicate_ids)
+            if residual is None:
+                uncovered.append(rule_id)
+            else:
+                covered.append(rule_id)
+                residuals.append(residual)
+
+        by_field: Dict[str, List[Tuple[int, str, Any]]] = {}
+        for predicate_id, (field, operator, value) in enumerate(self.predicates):
+            by_field.setdefault(field, []).append((predicate_id, operator, value))
+        rules_per_field: Dict[str, int] = {}
+        for residual in residuals:
+            for field in self._fields_of(residual):
+                rules_per_field[field] = rules_per_field.get(field, 0) + 1
+        order = sorted(by_field, key=lambda field: (-rules_per_field.get(field, 0), field))
+        fields = [_Field(field, by_field[field]) for field in order]
+        level_of_predicate = {}
+        for level, field in enumerate(fields):
+            for predicate_id, _, _ in field.predicates:
+                level_of_predicate[predicate_id] = level
+
+        try:
+            builder = _Builder(fields, level_of_predicate, covered, max_nodes)
+            self.root = builder.build(tuple(residuals))
+            self.node_count = builder.nodes
+            self.exploded = False
+            self.covered, self.uncovered = covered, uncovered
+        except TooLarge:
+            self.root = None
+            self.node_count = 0
+            self.exploded = True
+            self.covered, self.uncovered = [], [rule_id for rule_id, _, _ in rules]
+
+    def _translate(self, node: NodeBase, predicate_ids: Dict[Tuple, int]) -> Optional[Residual]:
+        # None when the rule holds something the regions cannot represent
+        if node.type == NodeType.OPERATOR:
+            if node.operator not in LOGICAL_OPERATORS or node.left is None or node.right is None:
+                return None
+            children = []
+            for child in flatten_logical(node):
+                residual = self._translate(child, predicate_ids)
+                if residual is None:
+                    return None
+                children.append(residual)
+            return _combine(node.operator, children)
+        if node.type == NodeType.CONSTANT:
+            return bool(node.value)
+        if node.type != NodeType.COMPARISON or not isinstance(node.field, str):
+            return None
+        if node.operator == Operator.IN:
+            if not isinstance(node.value, list):
+                return None
+            comparisons = [(_EQ, value) for value in node.value]
+        elif node.operator in COMPARATORS:
+            comparisons = [(node.operator, node.value)]
+        else:
+            return None
+
+        children = []
+        for operator, value in comparisons:
+            if _kind(value) is None or (type(value) is float and math.isnan(value)):
+                return None
+            # 1, 1.0 and True share a threshold but not a predicate: their
+            # TypeError messages differ
+            key = (node.field, operator, type(value).__name__, value)
+            predicate_id = predicate_ids.get(key)
+            if predicate_id is None:
+                predicate_id = predicate_ids[key] = len(self.predicates)
+                self.predicates.append((node.field, operator, value))
+            children.append(("P", predicate_id))
+        return _combine(_OR, children)
+
+    def _fields_of(self, residual: Residual) -> set:
+        fields = set()
+        stack = [residual]
+        while stack:
+            current = stack.pop()
+            if type(current) is not tuple:
+                continue
+            if current[0] == "P":
+                fields.add(self.predicates[current[1]][0])
+            elif current[0] != "E":
+                stack.extend(current[1])
+        return fields
+
+    def explain(self, predicate_id: int, data: Dict[str, Any]) -> str:
+        # The message the row evaluator would have raised with
+        field, operator, value = self.predicates[predicate_id]
+        if data.get(field) is None:
+            return f"Field '{field}' not found in data"
+        try:
+            COMPARATORS[operator](data[field], value)
+        except TypeError as e:
+            return str(e)
+        return f"Could not evaluate '{field} {operator} {value}'"
+
+class DecisionDag:
+    # Matches a record against every rule by walking one path of a reduced
+    # multi-terminal decision diagram. Levels test one field each (fields
+    # shared by most rules first) and branch on the field's region; equal
+    # sub-diagrams are shared and nodes whose branches all agree are
+    # skipped. Leaves hold the matched rule ids and the predicates whose
+    # errors decide the other rules, so results and error messages equal
+    # RuleEvaluator.evaluate_rule.
+    #
+    # Same interface as RuleIndex. After a change the diagram is rebuilt
+    # (in a background thread unless background=False) and swapped in;
+    # until then every rule is evaluated as a compiled tree. Rules the
+    # diagram cannot represent (including rules bound to a schema), every
+    # rule when it would exceed max_nodes, and records holding values
+    # outside the regions (lists, dicts) are evaluated as compiled trees as
+    # well.
+    def __init__(self, max_nodes: int = 20000, background: bool = True):
+        self.max_nodes = max_nodes
+        self.background = background
+        self._lock = threading.RLock()
+        self._compiler = RuleCompiler()
+        self._builder: Optional[threading.Thread] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._rules: Dict[int, Tuple[NodeBase, Optional[RecordSchema]]] = {}
+        self._compiled: Dict[int, CompiledFn] = {}
+        self._changes = 0
+        self._diagram: Optional[_Diagram] = None
+        self._diagram_changes = -1
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    @property
+    def predicate_count(self) -> int:
+        diagram = self._diagram
+        return 0 if diagram is None else len(diagram.predicates)
+
+    @property
+    def node_count(self) -> int:
+        diagram = self._diagram
+        return 0 if diagram is None else diagram.node_count
+
+    @property
+    def exploded(self) -> bool:
+        diagram = self._diagram
+        return diagram is not None and diagram.exploded
+
+    @property
+    def current(self) -> bool:
+        return self._diagram_changes == self._changes
+
+    def add_rule(self, rule_id: int, node: NodeBase, schema: Optional[RecordSchema] = None) -> None:
+        with self._lock:
+            compiled = self._compiler.compile(node) if schema is None else self._compiler.compile_typed(node, schema)
+            self._rules.pop(rule_id, None)
+            self._rules[rule_id] = (node, schema)
+            self._compiled[rule_id] = compiled
+            self._changes += 1
+
+    def remove_rule(self, rule_id: int) -> bool:
+        with self._lock:
+            if self._rules.pop(rule_id, None) is None:
+                return False
+            del self._compiled[rule_id]
+            self._changes += 1
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+            self._changes += 1
+
+    def build(self) -> None:
+        # Builds a diagram for the current rules outside the lock and swaps
+        # it in unless the rules changed meanwhile
+        while True:
+            with self._lock:
+                changes = self._changes
+                if self._diagram_changes == changes:
+                    return
+                rules = [(rule_id, node, schema) for rule_id, (node, schema) in self._rules.items()]
+            diagram = _Diagram(rules, self.max_nodes)
+            with self._lock:
+                if self._changes == changes:
+                    self._diagram = diagram
+                    self._diagram_changes = changes
+                    return
+
+    def _schedule(self) -> None:
+        if self._builder is None or not self._builder.is_alive():
+            self._builder = threading.Thread(target=self.build, name="decision-dag-build", daemon=True)
+            self._builder.start()
+
+    def match(self, data: Dict[str, Any]) -> Tuple[List[int], Dict[int, str]]:
+        if not self.background and not self.current:
+            self.build()
+        with self._lock:
+            diagram = self._diagram if self.current else None
+            if diagram is None and self.background:
+                self._schedule()
+            matched: List[int] = []
+            errors: Dict[int, str] = {}
+            node = None if diagram is None else diagram.root
+            while type(node) is tuple:
+                region = node[0](data)
+                if region < 0:
+                    node = None
+                    break
+                node = node[1][region]
+
+            if node is not None:
+                matched.extend(node.matched)
+                for rule_id, predicate_id in node.errors:
+                    errors[rule_id] = diagram.explain(predicate_id, data)
+                fallback = diagram.uncovered
+            else:
+                fallback = list(self._rules)
+
+            for rule_id in fallback:
+                try:
+                    if self._compiled[rule_id](data):
+                        matched.append(rule_id)
+                except Exception as e:
+                    errors[rule_id] = str(e)
+            if fallback and node is not None and len(matched) > len(node.matched):
+                # Report in rule order, like RuleIndex
+                matched.sort(key=diagram.order.__getitem__)
+            return matched, errors
+
+class _Builder:
+    # Residuals are interned to ints so states hash cheaply, and each
+    # residual is rewritten at most once per (level, region)
+    def __init__(self, fields: List[_Field], level_of_predicate: Dict[int, int], rule_ids: List[int], max_nodes: int):
+        self.fields = fields
+        self.classifiers = [field.classifier() for field in fields]
+        self.level_of_predicate = level_of_predicate
+        self.rule_ids = rule_ids
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self._unique: Dict[Tuple[int, ...], Any] = {}
+        self._ids: Dict[Residual, int] = {}
+        self._residuals: List[Residual] = []
+        self._levels: List[int] = []
+        self._true: List[bool] = []
+        self._error: List[bool] = []
+        self._rewrites: Dict[Tuple[int, int], Dict[int, int]] = {}
+        self._outcomes: Dict[Tuple[int, int], Dict[int, Residual]] = {}
+
+    def _intern(self, residual: Residual) -> int:
+        residual_id = self._ids.get(residual)
+        if residual_id is None:
+            residual_id = self._ids[residual] = len(self._residuals)
+            self._residuals.append(residual)
+            self._levels.append(self._level(residual))
+            self._true.append(residual is True)
+            self._error.append(type(residual) is tuple and residual[0] == "E")
+        return residual_id
+
+    def _level(self, residual: Residual) -> int:
+        # Shallowest field an undecided residual still depends on
+        if type(residual) is not tuple or residual[0] == "E":
+            return len(self.fields)
+        if residual[0] == "P":
+            return self.level_of_predicate[residual[1]]
+        return min(self._level(child) for child in residual[1])
+
+    @staticmethod
+    def _substitute(residual: Residual, outcomes: Dict[int, Residual]) -> Residual:
+        if type(residual) is not tuple or residual[0] == "E":
+            return residual
+        if residual[0] == "P":
+            return outcomes.get(residual[1], residual)
+        return _combine(residual[0], [_Builder._substitute(child, outcomes) for child in residual[1]])
+
+    def _rewrite(self, residual_id: int, level: int, region: int, rewrites: Dict[int, int]) -> None:
+        outcomes = self._outcomes.get((level, region))
+        if outcomes is None:
+            outcomes = self._outcomes[(level, region)] = self.fields[level].outcomes(region)
+        rewrites[residual_id] = self._intern(self._substitute(self._residuals[residual_id], outcomes))
+
+    def build(self, residuals: Tuple[Residual, ...]) -> Any:
+        return self._build(tuple(self._intern(residual) for residual in residuals))
+
+    def _build(self, state: Tuple[int, ...]) -> Any:
+        node = self._unique.get(state)
+        if node is not None:
+            return node
+        if len(self._unique) >= self.max_nodes:
+            raise TooLarge()
+
+        level = min(map(self._levels.__getitem__, state), default=len(self.fields))
+        if level == len(self.fields):
+            residuals = self._residuals
+            node = _Leaf(
+                tuple(compress(self.rule_ids, map(self._true.__getitem__, state))),
+                tuple(
+                    (rule_id, residuals[residual_id][1])
+                    for rule_id, residual_id in compress(zip(self.rule_ids, state), map(self._error.__getitem__, state))
+                )
+            )
+        else:
+            # Only residuals that test this field change from region to
+            # region; a level's rewrite table holds nothing else, so
+            # rewrites.get(id, id) leaves the other residuals as they are
+            affected = [residual_id for residual_id in set(state) if self._levels[residual_id] == level]
+            children = []
+            for region in range(self.fields[level].regions):
+                rewrites = self._rewrites.get((level, region))
+                if rewrites is None:
+                    rewrites = self._rewrites[(level, region)] = {}
+                for residual_id in affected:
+                    if residual_id not in rewrites:
+                        self._rewrite(residual_id, level, region, rewrites)
+                children.append(self._build(tuple(map(rewrites.get, state, state))))
+            if all(child is children[0] for child in children):
+                node = children[0]
+            else:
+                node = (self.classifiers[level], tuple(children))
+        self.nodes += 1
+        self._unique[state] = node
+        return node
@@ -1,15 +1,101 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from . import config
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False) if driver else url
+
+def _is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+def _engine_options(url: str, is_async: bool) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        if not _is_sqlite_file(url):
+            return {}
+        # aiosqlite defaults to NullPool, which opens a connection (and a
+        # thread) per session; keep a real pool of WAL connections instead
+        options = {"pool_size": config.DB_POOL_SIZE, "max_overflow": config.DB_MAX_OVERFLOW}
+        if is_async:
+            options["poolclass"] = AsyncAdaptedQueuePool
+        return options
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+
+def _configure_sqlite(engine: Engine) -> None:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+DATABASE_URL = config.DATABASE_URL
+ASYNC_DATABASE_URL = async_url(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL, is_async=False))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(DATABASE_URL, is_async=True))
+if _is_sqlite_file(DATABASE_URL):
+    _configure_sqlite(engine)
+    _configure_sqlite(async_engine.sync_engine)
 
-SQLITE_URL = "sqlite:///rule_engine.db"
-engine = create_engine(SQLITE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+def _add_missing_columns(conn, table: str, columns: dict) -> None:
+    # CREATE TABLE IF NOT EXISTS leaves older databases untouched
+    existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+
+_RULE_EVALUATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rule_id INTEGER NOT NULL,
+    input_hash BLOB,
+    input_data JSON,
+    result BOOLEAN NOT NULL,
+    evaluated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    rule_version INTEGER,
+    FOREIGN KEY (rule_id) REFERENCES rules(id)
+)
+"""
+
 def create_tables():
+    if engine.dialect.name != "sqlite":
+        Base.metadata.create_all(bind=engine)
+        return
+
     # Create tables using raw SQL
     with engine.connect() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS rule_schemas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR NOT NULL,
+            fields JSON NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """))
+        
         conn.execute(text("""
         CREATE TABLE IF NOT EXISTS rules (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -17,28 +103,122 @@ def create_tables():
             description VARCHAR,
             rule_string VARCHAR NOT NULL,
             ast_json JSON NOT NULL,
+            ast_blob BLOB,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 1,
+            schema_id INTEGER REFERENCES rule_schemas(id)
         )
         """))
         
         conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS rule_evaluations (
+        CREATE TABLE IF NOT EXISTS rule_versions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             rule_id INTEGER NOT NULL,
-            input_data JSON NOT NULL,
+            version INTEGER NOT NULL,
+            rule_string VARCHAR NOT NULL,
+            ast_json JSON NOT NULL,
+            ast_blob BLOB,
+            schema_id INTEGER REFERENCES rule_schemas(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (rule_id) REFERENCES rules(id)
+        )
+        """))
+        
+        conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_rule_versions_rule_version
+        ON rule_versions(rule_id, version)
+        """))
+        
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS evaluation_inputs (
+            hash BLOB PRIMARY KEY,
+            data BLOB NOT NULL
+        )
+        """))
+        
+        conn.execute(text(_RULE_EVALUATIONS_DDL.format(table="rule_evaluations")))
+        _add_missing_columns(conn, "rule_evaluations", {"rule_version": "INTEGER", "input_hash": "BLOB"})
+        
+        # input_data was NOT NULL before inputs were stored by hash; SQLite
+        # cannot drop the constraint in place, so older tables are rebuilt
+        not_null = {row[1]: row[3] for row in conn.execute(text("PRAGMA table_info(rule_evaluations)"))}
+        if not_null.get("input_data"):
+            conn.execute(text(_RULE_EVALUATIONS_DDL.format(table="rule_evaluations_rebuild")))
+            conn.execute(text("""
+            INSERT INTO rule_evaluations_rebuild (id, rule_id, input_hash, input_data, result, evaluated_at, rule_version)
+            SELECT id, rule_id, input_hash, input_data, result, evaluated_at, rule_version FROM rule_evaluations
+            """))
+            conn.execute(text("DROP TABLE rule_evaluations"))
+            conn.execute(text("ALTER TABLE rule_evaluations_rebuild RENAME TO rule_evaluations"))
+        
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS rule_evaluations_archive (
+            id INTEGER PRIMARY KEY,
+            rule_id INTEGER NOT NULL,
+            input_hash BLOB NOT NULL,
             result BOOLEAN NOT NULL,
-            evaluated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            evaluated_at TIMESTAMP,
+            rule_version INTEGER,
             FOREIGN KEY (rule_id) REFERENCES rules(id)
         )
         """))
         
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_rule_evaluations_archive_rule_time
+        ON rule_evaluations_archive(rule_id, evaluated_at, id)
+        """))
+        
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS rule_evaluation_rollups (
+            rule_id INTEGER NOT NULL,
+            granularity INTEGER NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            rule_version INTEGER NOT NULL,
+            evaluations INTEGER NOT NULL DEFAULT 0,
+            true_count INTEGER NOT NULL DEFAULT 0,
+            error_count INTEGER NOT NULL DEFAULT 0,
+            latency BLOB,
+            PRIMARY KEY (rule_id, granularity, bucket_start, rule_version)
+        ) WITHOUT ROWID
+        """))
+        
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS rule_evaluation_rollup_backfill (
+            rule_id INTEGER PRIMARY KEY,
+            until TIMESTAMP NOT NULL,
+            position TIMESTAMP NOT NULL
+        )
+        """))
+        
         # Create an index on rule_id for better query performance
         conn.execute(text("""
         CREATE INDEX IF NOT EXISTS idx_rule_evaluations_rule_id 
         ON rule_evaluations(rule_id)
         """))
         
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_rule_evaluations_rule_time
+        ON rule_evaluations(rule_id, evaluated_at, id)
+        """))
+        
+        _add_missing_columns(conn, "rules", {
+            "ast_blob": "BLOB",
+            "version": "INTEGER NOT NULL DEFAULT 1",
+            "schema_id": "INTEGER REFERENCES rule_schemas(id)"
+        })
+        _add_missing_columns(conn, "rule_versions", {"schema_id": "INTEGER REFERENCES rule_schemas(id)"})
+        
+        # Rules created before versioning get their current state as a version
+        conn.execute(text("""
+        INSERT INTO rule_versions (rule_id, version, rule_string, ast_json, ast_blob, schema_id, created_at)
+        SELECT id, version, rule_string, ast_json, ast_blob, schema_id, updated_at FROM rules
+        WHERE NOT EXISTS (
+            SELECT 1 FROM rule_versions
+            WHERE rule_versions.rule_id = rules.id AND rule_versions.version = rules.version
+        )
+        """))
+        
         conn.commit()
 
 def get_db():
@@ -46,4 +226,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
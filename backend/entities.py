@@ -0,0 +1,265 @@
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+from .compact import constant_key
+from .compiler import (
+    LOGICAL_OPERATORS, CompiledFn, compile_constant, compile_error, compile_predicate, compile_typed_predicate,
+    flatten_logical
+)
+from .fields import RecordSchema
+from .parser import NodeType, Operator
+from .schemas import NodeBase
+from .workers import Outcome
+
+class RuleFlip(NamedTuple):
+    rule_id: int
+    previous: Outcome
+    current: Outcome
+
+class EntityUpdate(NamedTuple):
+    changed_fields: List[str]
+    flipped: List[RuleFlip]
+    evaluated_nodes: int
+
+def _test(leaf: CompiledFn, fields: Dict[str, Any]) -> Outcome:
+    try:
+        return bool(leaf(fields))
+    except Exception as e:
+        return str(e)
+
+class _Network:
+    # Immutable node graph of every registered rule. Comparisons are leaves
+    # shared by all rules testing the same (field, operator, constant), and
+    # AND/OR groups with the same operands in the same order are shared too.
+    # Nodes are numbered children first, so ascending ids are a valid
+    # propagation order.
+    def __init__(self, rules: Dict[int, Tuple[NodeBase, Optional[RecordSchema]]]):
+        self.operators: List[Optional[str]] = []
+        self.children: List[Tuple[int, ...]] = []
+        self.parents: List[List[int]] = []
+        self.leaves: List[Optional[CompiledFn]] = []
+        self.field_leaves: Dict[str, List[int]] = {}
+        self.roots: Dict[int, int] = {}
+        self.root_rules: Dict[int, List[int]] = {}
+        self._ids: Dict[Hashable, int] = {}
+        for rule_id, (node, schema) in rules.items():
+            root = self._add(node, schema)
+            self.roots[rule_id] = root
+            self.root_rules.setdefault(root, []).append(rule_id)
+        del self._ids
+
+    def __len__(self) -> int:
+        return len(self.operators)
+
+    def _intern(self, key: Hashable, operator: Optional[str], children: Tuple[int, ...], leaf: Optional[CompiledFn]) -> int:
+        node_id = self._ids.get(key)
+        if node_id is None:
+            node_id = len(self.operators)
+            self._ids[key] = node_id
+            self.operators.append(operator)
+            self.children.append(children)
+            self.parents.append([])
+            self.leaves.append(leaf)
+            for child in children:
+                if node_id not in self.parents[child]:
+                    self.parents[child].append(node_id)
+        return node_id
+
+    def _add(self, node: NodeBase, schema: Optional[RecordSchema]) -> int:
+        if node.type == NodeType.OPERATOR:
+            if node.operator not in LOGICAL_OPERATORS:
+                return self._error(f"Invalid logical operator: {node.operator}")
+            children = tuple(self._add(child, schema) for child in flatten_logical(node))
+            return self._intern((node.operator, children), node.operator, children, None)
+        elif node.type == NodeType.COMPARISON:
+            return self._comparison(node, schema)
+        elif node.type == NodeType.CONSTANT:
+            return self._intern(("constant", bool(node.value)), None, (), compile_constant(node.value))
+        return self._error(f"Invalid node type: {node.type}")
+
+    def _comparison(self, node: NodeBase, schema: Optional[RecordSchema]) -> int:
+        # Typed leaves depend on the field spec, so schemas do not share them
+        key = ("comparison", node.field, node.operator, constant_key(node.value), id(schema) if schema else None)
+        node_id = self._ids.get(key)
+        if node_id is not None:
+            return node_id
+        if schema is None:
+            leaf = compile_predicate(node.operator, node.field, node.value)
+        else:
+            try:
+                leaf = compile_typed_predicate(node.operator, schema.field(node.field), node.value)
+            except ValueError as e:
+                leaf = compile_error(str(e))
+        node_id = self._intern(key, None, (), leaf)
+        self.field_leaves.setdefault(node.field, []).append(node_id)
+        return node_id
+
+    def _error(self, message: str) -> int:
+        return self._intern(("error", message), None, (), compile_error(message))
+
+    def combine(self, node_id: int, values: List[Outcome]) -> Outcome:
+        # The first operand that decides the group (or fails) is its outcome,
+        # which is what short-circuit evaluation would return or raise
+        if self.operators[node_id] == Operator.AND:
+            for child in self.children[node_id]:
+                value = values[child]
+                if value is not True:
+                    return value
+            return True
+        for child in self.children[node_id]:
+            value = values[child]
+            if value is not False:
+                return value
+        return False
+
+    def evaluate(self, fields: Dict[str, Any]) -> List[Outcome]:
+        values: List[Outcome] = [False] * len(self.operators)
+        for node_id, leaf in enumerate(self.leaves):
+            values[node_id] = _test(leaf, fields) if leaf is not None else self.combine(node_id, values)
+        return values
+
+class _Entity:
+    __slots__ = ("fields", "values", "network")
+
+    def __init__(self, network: _Network):
+        self.fields: Dict[str, Any] = {}
+        self.network = network
+        self.values = network.evaluate(self.fields)
+
+class EntityNetwork:
+    # Latest field values of long-lived entities plus the outcome of every
+    # rule node for each of them, in the style of a Rete network. A partial
+    # update re-tests only the comparisons on fields whose value changed and
+    # re-combines only the AND/OR nodes above an operand whose outcome
+    # changed, so the work is proportional to what the update affects
+    # rather than to the size of the rule set.
+    #
+    # Rule changes rebuild the shared network on next use; an entity last
+    # updated against an older network is re-evaluated in full against the
+    # new one before its update is applied, so flips only ever reflect the
+    # update itself. At most max_entities are kept (least recently updated
+    # first out); each holds one outcome per network node.
+    def __init__(self, max_entities: int = 10000):
+        self.max_entities = max_entities
+        self.evictions = 0
+        self.evaluated_nodes = 0
+        self._rules: Dict[int, Tuple[NodeBase, Optional[RecordSchema]]] = {}
+        self._network: Optional[_Network] = None
+        self._entities: "OrderedDict[str, _Entity]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    @property
+    def node_count(self) -> int:
+        with self._lock:
+            return len(self._current())
+
+    def add_rule(self, rule_id: int, node: NodeBase, schema: Optional[RecordSchema] = None) -> None:
+        with self._lock:
+            self._rules[rule_id] = (node, schema)
+            self._network = None
+
+    def remove_rule(self, rule_id: int) -> bool:
+        with self._lock:
+            if self._rules.pop(rule_id, None) is None:
+                return False
+            self._network = None
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rules = {}
+            self._network = None
+
+    def _current(self) -> _Network:
+        # Callers hold the lock
+        if self._network is None:
+            self._network = _Network(self._rules)
+        return self._network
+
+    def _entity(self, entity_id: str, create: bool) -> Optional[_Entity]:
+        # Callers hold the lock
+        network = self._current()
+        entity = self._entities.get(entity_id)
+        if entity is None:
+            if not create:
+                return None
+            entity = self._entities[entity_id] = _Entity(network)
+            self.evaluated_nodes += len(network)
+            while len(self._entities) > max(1, self.max_entities):
+                self._entities.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._entities.move_to_end(entity_id)
+            if entity.network is not network:
+                entity.values = network.evaluate(entity.fields)
+                entity.network = network
+                self.evaluated_nodes += len(network)
+        return entity
+
+    def update(self, entity_id: str, changes: Dict[str, Any]) -> EntityUpdate:
+        # Applies a partial update (fields not mentioned keep their value;
+        # null clears one) and returns the rules whose outcome changed
+        with self._lock:
+            entity = self._entity(entity_id, create=True)
+            network = entity.network
+            fields = entity.fields
+            values = entity.values
+
+            changed_fields = []
+            leaves: List[int] = []
+            for field, value in changes.items():
+                if field in fields and constant_key(fields[field]) == constant_key(value):
+                    continue
+                fields[field] = value
+                changed_fields.append(field)
+                leaves.extend(network.field_leaves.get(field, ()))
+
+            flipped: List[RuleFlip] = []
+            queued = set()
+            pending: List[int] = []
+            root_rules = network.root_rules
+            parents = network.parents
+
+            def settle(node_id: int, value: Outcome) -> None:
+                previous = values[node_id]
+                if value == previous:
+                    return
+                values[node_id] = value
+                for rule_id in root_rules.get(node_id, ()):
+                    flipped.append(RuleFlip(rule_id, previous, value))
+                for parent in parents[node_id]:
+                    if parent not in queued:
+                        queued.add(parent)
+                        heapq.heappush(pending, parent)
+
+            # Comparisons first (they have no operands), then the groups
+            # above any that changed, in ascending id order
+            for node_id in leaves:
+                settle(node_id, _test(network.leaves[node_id], fields))
+            evaluated = len(leaves)
+            while pending:
+                node_id = heapq.heappop(pending)
+                settle(node_id, network.combine(node_id, values))
+                evaluated += 1
+            self.evaluated_nodes += evaluated
+            flipped.sort()
+            return EntityUpdate(changed_fields, flipped, evaluated)
+
+    def get(self, entity_id: str) -> Optional[Tuple[Dict[str, Any], Dict[int, Outcome]]]:
+        # The entity's fields and every rule's current outcome
+        with self._lock:
+            entity = self._entity(entity_id, create=False)
+            if entity is None:
+                return None
+            network = entity.network
+            return dict(entity.fields), {
+                rule_id: entity.values[root] for rule_id, root in network.roots.items()
+            }
+
+    def delete(self, entity_id: str) -> bool:
+        with self._lock:
+            return self._entities.pop(entity_id, None) is not None
@@ -1,7 +1,129 @@
-from typing import Dict, Any, List, Set
+import heapq
+from typing import Dict, Any, FrozenSet, Hashable, Iterable, List, Optional, Tuple
 from enum import Enum
 from .schemas import NodeBase
 from .parser import Operator, NodeType, NodeBase
+from .compact import constant_key
+from .workers import EvaluationPool, Outcome
+
+LOGICAL_OPERATORS = (Operator.AND.value, Operator.OR.value)
+
+class NodeTable:
+    # Hash-consing table used by combine_rules. Every structurally distinct
+    # subtree gets a small int id. AND/OR chains are flattened into n-ary
+    # nodes keyed by the frozenset of their child ids, so operand order and
+    # repeated operands do not matter and equal subtrees compare in O(1).
+    def __init__(self):
+        self._ids: Dict[Tuple, int] = {}
+        self._seen: Dict[int, int] = {}
+        self._built: Dict[int, NodeBase] = {}
+        self.operators: List[Optional[str]] = []
+        self.children: List[Tuple[int, ...]] = []
+        self.leaves: List[Optional[NodeBase]] = []
+
+    def __len__(self) -> int:
+        return len(self.operators)
+
+    def _intern(self, key: Tuple, operator: Optional[str], children: Tuple[int, ...], leaf: Optional[NodeBase]) -> int:
+        node_id = self._ids.get(key)
+        if node_id is None:
+            node_id = len(self.operators)
+            self._ids[key] = node_id
+            self.operators.append(operator)
+            self.children.append(children)
+            self.leaves.append(leaf)
+        return node_id
+
+    def leaf(self, node: NodeBase) -> int:
+        if node.type == NodeType.COMPARISON:
+            key = ("comparison", node.field, node.operator, constant_key(node.value))
+        elif node.type == NodeType.CONSTANT:
+            key = ("constant", bool(node.value))
+        else:
+            # Anything that is not a well-formed AND/OR or comparison is kept
+            # as is and only ever equal to itself
+            key = ("opaque", id(node))
+        return self._intern(key, None, (), node)
+
+    def terms(self, node_id: int, operator: str) -> Tuple[int, ...]:
+        # Operands of node_id when read as an `operator` chain
+        if self.operators[node_id] == operator:
+            return self.children[node_id]
+        return (node_id,)
+
+    def make(self, operator: str, children: List[int]) -> int:
+        flat: List[int] = []
+        seen = set()
+        for child in children:
+            for part in self.terms(child, operator):
+                if part not in seen:
+                    seen.add(part)
+                    flat.append(part)
+        if len(flat) == 1:
+            return flat[0]
+        return self._intern((operator, frozenset(flat)), operator, tuple(flat), None)
+
+    def add(self, root: NodeBase) -> int:
+        # Iterative postorder over whole same-operator chains, memoized on
+        # object identity since parsed trees are shared between rules
+        pending: List[Tuple[NodeBase, Optional[List[NodeBase]]]] = [(root, None)]
+        results: List[int] = []
+        while pending:
+            node, operands = pending.pop()
+            if operands is not None:
+                count = len(operands)
+                node_id = self.make(node.operator, results[-count:])
+                del results[-count:]
+                self._seen[id(node)] = node_id
+                results.append(node_id)
+                continue
+            node_id = self._seen.get(id(node))
+            if node_id is not None:
+                results.append(node_id)
+                continue
+            if node.type == NodeType.OPERATOR and node.operator in LOGICAL_OPERATORS \
+                    and node.left is not None and node.right is not None:
+                operands = []
+                stack = [node.right, node.left]
+                while stack:
+                    child = stack.pop()
+                    if child.type == NodeType.OPERATOR and child.operator == node.operator \
+                            and child.left is not None and child.right is not None:
+                        stack.append(child.right)
+                        stack.append(child.left)
+                    else:
+                        operands.append(child)
+                pending.append((node, operands))
+                pending.extend((child, None) for child in reversed(operands))
+                continue
+            node_id = self.leaf(node)
+            self._seen[id(node)] = node_id
+            results.append(node_id)
+        return results[0]
+
+    def build(self, root: int) -> NodeBase:
+        # Equal ids map to the same NodeBase, so shared subtrees stay shared
+        built = self._built
+        stack = [root]
+        while stack:
+            node_id = stack[-1]
+            if node_id in built:
+                stack.pop()
+                continue
+            operator = self.operators[node_id]
+            if operator is None:
+                built[node_id] = self.leaves[node_id]
+                stack.pop()
+                continue
+            missing = [child for child in self.children[node_id] if child not in built]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            built[node_id] = RuleEvaluator._create_balanced_tree(
+                [built[child] for child in self.children[node_id]], operator
+            )
+        return built[root]
 
 class RuleEvaluator:
     def evaluate_comparison(self, node: NodeBase, data: Dict[str, Any]) -> bool:
@@ -19,27 +141,71 @@ class RuleEvaluator:
             return field_value >= node.value
         elif node.operator == Operator.LTE:
             return field_value <= node.value
+        elif node.operator == Operator.IN:
+            return field_value in node.value
         else:
             raise ValueError(f"Invalid comparison operator: {node.operator}")
     
     def evaluate_rule(self, node: NodeBase, data: Dict[str, Any]) -> bool:
         if node.type == NodeType.OPERATOR:
-            left_result = self.evaluate_rule(node.left, data)
-            right_result = self.evaluate_rule(node.right, data)
-            
+            # The right side is only evaluated when it can change the outcome
             if node.operator == Operator.AND:
-                return left_result and right_result
+                return self.evaluate_rule(node.left, data) and self.evaluate_rule(node.right, data)
             elif node.operator == Operator.OR:
-                return left_result or right_result
+                return self.evaluate_rule(node.left, data) or self.evaluate_rule(node.right, data)
             else:
                 raise ValueError(f"Invalid logical operator: {node.operator}")
                 
         elif node.type == NodeType.COMPARISON:
             return self.evaluate_comparison(node, data)
         
+        elif node.type == NodeType.CONSTANT:
+            return bool(node.value)
+        
         raise ValueError(f"Invalid node type: {node.type}")
     
-    def combine_rules(self, rules: List[NodeBase], combine_operator: Operator = Operator.OR) -> NodeBase:
+    @staticmethod
+    def referenced_fields(node: NodeBase) -> FrozenSet[str]:
+        # Every field the rule can read, i.e. all that its result depends on
+        fields = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.type == NodeType.COMPARISON:
+                fields.add(current.field)
+            else:
+                if current.left is not None:
+                    stack.append(current.left)
+                if current.right is not None:
+                    stack.append(current.right)
+        return frozenset(fields)
+    
+    def evaluate_many(
+        self,
+        node: NodeBase,
+        records: Iterable[Dict[str, Any]],
+        pool: Optional[EvaluationPool] = None,
+        key: Optional[Hashable] = None
+    ) -> List[Outcome]:
+        # One outcome per record: the result, or the error message. With a
+        # pool the records are scored in worker processes; key identifies
+        # the rule version there (defaults to a digest of the rule).
+        if pool is not None:
+            return pool.evaluate_rule(node, records, key)
+        outcomes: List[Outcome] = []
+        for record in records:
+            try:
+                outcomes.append(self.evaluate_rule(node, record))
+            except Exception as e:
+                outcomes.append(str(e))
+        return outcomes
+    
+    def combine_rules(
+        self,
+        rules: List[NodeBase],
+        combine_operator: Operator = Operator.OR,
+        factor_depth: int = 32
+    ) -> NodeBase:
 
         if not rules:
             raise ValueError("No rules to combine")
@@ -47,94 +213,108 @@ class RuleEvaluator:
         if len(rules) == 1:
             return rules[0]
         
-        # Flatten nested operations of same type
-        flattened_rules = self._flatten_rules(rules, combine_operator)
-        
-        # Deduplicate identical conditions
-        unique_rules = self._deduplicate_rules(flattened_rules)
+        outer = Operator(combine_operator).value
+        if outer not in LOGICAL_OPERATORS:
+            raise ValueError(f"Invalid logical operator: {outer}")
+        inner = Operator.AND.value if outer == Operator.OR.value else Operator.OR.value
         
-        # Group common conditions
-        optimized_rules = self._group_common_conditions(unique_rules, combine_operator)
-        
-        # If we only have one rule after optimization, return it
-        if len(optimized_rules) == 1:
-            return optimized_rules[0]
-            
-        # Create balanced tree instead of linear chain
-        return self._create_balanced_tree(optimized_rules, combine_operator)
-    
-    def _flatten_rules(self, rules: List[NodeBase], operator: Operator) -> List[NodeBase]:
-        result = []
-        for rule in rules:
-            if (rule.type == NodeType.OPERATOR and 
-                rule.operator == operator.value):
-                # Recursively flatten nested operations
-                result.extend(self._flatten_rules([rule.left, rule.right], operator))
-            else:
-                result.append(rule)
-        return result
-    
-    def _deduplicate_rules(self, rules: List[NodeBase]) -> List[NodeBase]:
-        seen = set()
-        unique_rules = []
+        # Intern every rule; flattening, deduplication and commutative
+        # grouping all fall out of the table's keys
+        table = NodeTable()
+        root = table.make(outer, [table.add(rule) for rule in rules])
         
-        for rule in rules:
-            rule_str = self._node_to_string(rule)
-            if rule_str not in seen:
-                seen.add(rule_str)
-                unique_rules.append(rule)
+        # Factor out subexpressions shared between the combined rules
+        operands = self._factor_common_terms(table, list(table.terms(root, outer)), outer, inner, factor_depth)
         
-        return unique_rules
+        return table.build(table.make(outer, operands))
     
-    def _group_common_conditions(self, rules: List[NodeBase], operator: Operator) -> List[NodeBase]:
-        condition_map: Dict[str, List[NodeBase]] = {}
+    def _factor_common_terms(
+        self,
+        table: NodeTable,
+        operands: List[int],
+        outer: str,
+        inner: str,
+        depth: int
+    ) -> List[int]:
+        # Greedy common-subexpression factoring, most shared term first:
+        # (A AND B) OR (A AND C) -> A AND (B OR C), and A OR (A AND B) -> A.
+        # The residuals of each group are factored again up to `depth` levels.
+        terms = [table.terms(operand, inner) for operand in operands]
+        holders: Dict[int, List[int]] = {}
+        for index, operand_terms in enumerate(terms):
+            for term in operand_terms:
+                holders.setdefault(term, []).append(index)
+        counts = {term: len(indexes) for term, indexes in holders.items() if len(indexes) > 1}
+        if depth <= 0 or not counts:
+            return operands
         
-        # Group rules by common conditions
-        for rule in rules:
-            conditions = self._extract_conditions(rule)
-            key = frozenset(conditions)
-            condition_map.setdefault(str(key), []).append(rule)
-        
-        # Combine rules with common conditions
-        optimized_rules = []
-        for rules_group in condition_map.values():
-            if len(rules_group) > 1:
-                # Create optimized subtree for rules with common conditions
-                optimized_rules.append(self._create_balanced_tree(rules_group, operator))
+        heap = [(-count, holders[term][0], term) for term, count in counts.items()]
+        heapq.heapify(heap)
+        consumed = [False] * len(operands)
+        result: List[Optional[int]] = list(operands)
+        while heap:
+            count, first, term = heapq.heappop(heap)
+            current = counts[term]
+            if current < 2:
+                continue
+            if current != -count:
+                # Stale entry: other groups took some of this term's operands
+                heapq.heappush(heap, (-current, first, term))
+                continue
+            
+            members = [index for index in holders[term] if not consumed[index]]
+            for index in members:
+                consumed[index] = True
+                result[index] = None
+                for member_term in terms[index]:
+                    if member_term in counts:
+                        counts[member_term] -= 1
+            
+            residuals = []
+            for index in members:
+                rest = [member_term for member_term in terms[index] if member_term != term]
+                if not rest:
+                    # The bare term absorbs every operand that contains it
+                    residuals = None
+                    break
+                residuals.append(table.make(inner, rest))
+            if residuals is None:
+                result[members[0]] = term
             else:
-                optimized_rules.extend(rules_group)
+                residuals = self._factor_common_terms(table, residuals, outer, inner, depth - 1)
+                result[members[0]] = table.make(inner, [term, table.make(outer, residuals)])
         
-        return optimized_rules
+        return [operand for operand in result if operand is not None]
     
-    def _create_balanced_tree(self, rules: List[NodeBase], operator: Operator) -> NodeBase:
-        if len(rules) == 1:
-            return rules[0]
-        if len(rules) == 2:
+    @staticmethod
+    def _create_balanced_tree(
+        rules: List[NodeBase],
+        operator: Operator,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> NodeBase:
+        # Works on index ranges so no level copies the operand list
+        if end is None:
+            end = len(rules)
+        if end - start == 1:
+            return rules[start]
+        if end - start == 2:
             return NodeBase(
-                type=NodeType.OPERATOR,
-                operator=operator.value,
-                left=rules[0],
-                right=rules[1]
+                type=NodeType.OPERATOR.value,
+                operator=Operator(operator).value,
+                left=rules[start],
+                right=rules[start + 1]
             )
             
-        mid = len(rules) // 2
+        mid = (start + end) // 2
         return NodeBase(
-            type=NodeType.OPERATOR,
-            operator=operator.value,
-            left=self._create_balanced_tree(rules[:mid], operator),
-            right=self._create_balanced_tree(rules[mid:], operator)
+            type=NodeType.OPERATOR.value,
+            operator=Operator(operator).value,
+            left=RuleEvaluator._create_balanced_tree(rules, operator, start, mid),
+            right=RuleEvaluator._create_balanced_tree(rules, operator, mid, end)
         )
     
     def _node_to_string(self, node: NodeBase) -> str:
         if node.type == NodeType.OPERATOR:
             return f"({self._node_to_string(node.left)} {node.operator} {self._node_to_string(node.right)})"
         return f"{node.field} {node.operator} {node.value}"
-    
-    def _extract_conditions(self, node: NodeBase) -> Set[str]:
-        conditions = set()
-        if node.type == NodeType.OPERATOR:
-            conditions.update(self._extract_conditions(node.left))
-            conditions.update(self._extract_conditions(node.right))
-        else:
-            conditions.add(self._node_to_string(node))
-        return conditions
\ No newline at end of file
@@ -0,0 +1,183 @@
+from enum import Enum
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+from .parser import NodeType, Operator
+from .schemas import NodeBase
+
+class FieldType(str, Enum):
+    INT = "int"
+    FLOAT = "float"
+    STRING = "string"
+    BOOL = "bool"
+
+# Turns a raw value into the field's type; None stands for null or absent
+Coercer = Callable[[Any], Any]
+
+_ORDERING = frozenset((Operator.GT.value, Operator.LT.value, Operator.GTE.value, Operator.LTE.value))
+
+def _type_error(name: str, field_type: FieldType, value: Any) -> ValueError:
+    return ValueError(f"Field '{name}' expects {field_type.value}, got {value!r}")
+
+def _int_coercer(name: str) -> Coercer:
+    def coerce(value: Any) -> Any:
+        kind = type(value)
+        if kind is int or value is None:
+            return value
+        if kind is float and value.is_integer():
+            return int(value)
+        if kind is str:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        raise _type_error(name, FieldType.INT, value)
+    return coerce
+
+def _float_coercer(name: str) -> Coercer:
+    def coerce(value: Any) -> Any:
+        kind = type(value)
+        if kind is float or value is None:
+            return value
+        if kind is int:
+            return float(value)
+        if kind is str:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        raise _type_error(name, FieldType.FLOAT, value)
+    return coerce
+
+def _string_coercer(name: str) -> Coercer:
+    # Numbers are not turned into strings: '007' and 7 are different values
+    def coerce(value: Any) -> Any:
+        if type(value) is str or value is None:
+            return value
+        raise _type_error(name, FieldType.STRING, value)
+    return coerce
+
+_BOOL_STRINGS = {"true": True, "false": False}
+
+def _bool_coercer(name: str) -> Coercer:
+    def coerce(value: Any) -> Any:
+        if type(value) is bool or value is None:
+            return value
+        if type(value) is str and value.lower() in _BOOL_STRINGS:
+            return _BOOL_STRINGS[value.lower()]
+        raise _type_error(name, FieldType.BOOL, value)
+    return coerce
+
+PYTHON_TYPES: Dict[FieldType, type] = {
+    FieldType.INT: int,
+    FieldType.FLOAT: float,
+    FieldType.STRING: str,
+    FieldType.BOOL: bool,
+}
+
+_COERCERS: Dict[FieldType, Callable[[str], Coercer]] = {
+    FieldType.INT: _int_coercer,
+    FieldType.FLOAT: _float_coercer,
+    FieldType.STRING: _string_coercer,
+    FieldType.BOOL: _bool_coercer,
+}
+
+class FieldSpec:
+    __slots__ = ("name", "type", "python_type", "nullable", "enum", "coerce")
+
+    def __init__(self, name: str, field_type: FieldType, nullable: bool = False, enum: Optional[Iterable[Any]] = None):
+        self.name = name
+        self.type = FieldType(field_type)
+        self.python_type = PYTHON_TYPES[self.type]
+        self.nullable = nullable
+        base = _COERCERS[self.type](name)
+        self.enum: Optional[FrozenSet[Any]] = None
+        if enum is not None:
+            self.enum = frozenset(base(value) for value in enum)
+            if None in self.enum:
+                raise ValueError(f"Field '{name}': enum values cannot be null")
+        self.coerce: Coercer = base if self.enum is None else self._enum_coercer(base)
+
+    def _enum_coercer(self, base: Coercer) -> Coercer:
+        allowed = self.enum
+        message = f"Field '{self.name}' must be one of {sorted(allowed, key=repr)}"
+
+        def coerce(value: Any) -> Any:
+            value = base(value)
+            if value is not None and value not in allowed:
+                raise ValueError(f"{message}, got {value!r}")
+            return value
+        return coerce
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "type": self.type.value,
+            "nullable": self.nullable,
+            "enum": None if self.enum is None else sorted(self.enum, key=repr),
+        }
+
+class RecordSchema:
+    # Declared fields of the records a set of rules is evaluated against.
+    # Schemas are immutable once registered, so a rule version always sees
+    # the schema it was validated with.
+    def __init__(self, fields: Iterable[FieldSpec]):
+        self.fields: Tuple[FieldSpec, ...] = tuple(fields)
+        self.index: Dict[str, int] = {}
+        for position, spec in enumerate(self.fields):
+            if spec.name in self.index:
+                raise ValueError(f"Duplicate field: {spec.name}")
+            self.index[spec.name] = position
+
+    @classmethod
+    def from_json(cls, fields: Iterable[Dict[str, Any]]) -> "RecordSchema":
+        return cls(
+            FieldSpec(field["name"], field["type"], field.get("nullable", False), field.get("enum"))
+            for field in fields
+        )
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [spec.to_json() for spec in self.fields]
+
+    def field(self, name: str) -> FieldSpec:
+        position = self.index.get(name)
+        if position is None:
+            raise ValueError(f"Unknown field: {name}")
+        return self.fields[position]
+
+    def bind_constant(self, node: NodeBase) -> Any:
+        spec = self.field(node.field)
+        if spec.type == FieldType.BOOL and node.operator in _ORDERING:
+            raise ValueError(f"Operator {node.operator} is not supported for bool field '{spec.name}'")
+        if node.operator == Operator.IN.value:
+            return [spec.coerce(value) for value in node.value]
+        if spec.enum is not None and node.operator == Operator.EQ.value:
+            return spec.coerce(node.value)
+        return _COERCERS[spec.type](spec.name)(node.value)
+
+    def bind(self, root: NodeBase) -> NodeBase:
+        # Checks every comparison against the schema and returns a copy of
+        # the tree with constants converted to their field's type. Iterative
+        # post-order, so deep trees are fine.
+        built: Dict[int, NodeBase] = {}
+        stack: List[Tuple[NodeBase, bool]] = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if not expanded and id(node) in built:
+                continue
+            if node.type == NodeType.COMPARISON.value:
+                built[id(node)] = NodeBase(
+                    type=node.type, operator=node.operator, field=node.field, value=self.bind_constant(node)
+                )
+            elif node.type == NodeType.CONSTANT.value:
+                built[id(node)] = node
+            elif not expanded:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+            else:
+                built[id(node)] = NodeBase(
+                    type=node.type,
+                    operator=node.operator,
+                    left=built[id(node.left)],
+                    right=built[id(node.right)]
+                )
+        return built[id(root)]
@@ -0,0 +1,203 @@
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud, inputs, models
+
+logger = logging.getLogger(__name__)
+
+class HistoryMode:
+    SYNC = "sync"          # insert and commit inside the request
+    BUFFERED = "buffered"  # queue every row for the background writer
+    SAMPLED = "sampled"    # queue a random fraction of rows
+    OFF = "off"            # keep no history
+
+HISTORY_MODES = (HistoryMode.SYNC, HistoryMode.BUFFERED, HistoryMode.SAMPLED, HistoryMode.OFF)
+
+_STOP = object()
+
+class _IdBlocks:
+    # Evaluation ids reserved block_size at a time from an allocator shared
+    # by several processes (SharedRegistry.allocate_ids), so that buffered
+    # writers in different workers never hand out the same id
+    def __init__(self, allocate: Callable[[int, int], int], first_free: int, block_size: int = 1000):
+        self._allocate = allocate
+        self._block_size = block_size
+        self._next = allocate(first_free, block_size)
+        self._end = self._next + block_size
+
+    def __iter__(self) -> Iterator[int]:
+        return self
+
+    def __next__(self) -> int:
+        if self._next == self._end:
+            self._next = self._allocate(0, self._block_size)
+            self._end = self._next + self._block_size
+        value = self._next
+        self._next += 1
+        return value
+
+class EvaluationWriter:
+    # Owns the write path for rule_evaluations. In buffered and sampled mode
+    # ids are allocated in-process from a sequence seeded with MAX(id), so the
+    # request gets its evaluation id immediately, and a dedicated thread
+    # flushes queued rows with one executemany per batch_size rows or
+    # flush_interval_ms, whichever comes first. Inputs are hashed and packed
+    # on that thread too. With allocate_ids (several workers writing to the
+    # same database) the sequence is reserved in blocks from that allocator.
+    def __init__(
+        self,
+        engine: Engine,
+        mode: str = HistoryMode.SYNC,
+        batch_size: int = 500,
+        flush_interval_ms: int = 50,
+        sample_rate: float = 0.1,
+        queue_size: int = 100000,
+        allocate_ids: Optional[Callable[[int, int], int]] = None
+    ):
+        if mode not in HISTORY_MODES:
+            raise ValueError(f"Invalid history mode: {mode}")
+        self.engine = engine
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000
+        self.sample_rate = sample_rate
+        self.allocate_ids = allocate_ids
+        self.written = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._ids: Optional[Iterator[int]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def buffered(self) -> bool:
+        return self.mode in (HistoryMode.BUFFERED, HistoryMode.SAMPLED)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if not self.buffered or self._thread is not None:
+            return
+        with self.engine.connect() as conn:
+            # Archived rows keep their ids, so both tables are checked
+            last_id = max(
+                conn.execute(select(func.max(models.RuleEvaluation.id))).scalar() or 0,
+                conn.execute(select(func.max(models.ArchivedRuleEvaluation.id))).scalar() or 0
+            )
+        if self.allocate_ids is not None:
+            self._ids = _IdBlocks(self.allocate_ids, last_id + 1)
+        else:
+            self._ids = itertools.count(last_id + 1)
+        self._thread = threading.Thread(target=self._run, name="evaluation-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Drains everything queued so far before returning
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def flush(self) -> None:
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    async def record(
+        self,
+        db: AsyncSession,
+        rule_id: int,
+        input_data: dict,
+        result: bool,
+        rule_version: Optional[int] = None
+    ) -> Optional[int]:
+        return (await self.record_many(db, rule_id, [(input_data, result)], rule_version))[0]
+
+    async def record_many(
+        self,
+        db: AsyncSession,
+        rule_id: int,
+        evaluations: List[Tuple[dict, bool]],
+        rule_version: Optional[int] = None
+    ) -> List[Optional[int]]:
+        if self.mode == HistoryMode.SYNC:
+            return await crud.AsyncRuleRepository.create_evaluations(db, rule_id, evaluations, rule_version)
+        if self.mode == HistoryMode.OFF or self._ids is None:
+            return [None] * len(evaluations)
+
+        ids: List[Optional[int]] = []
+        evaluated_at = datetime.now()
+        for input_data, result in evaluations:
+            if self.mode == HistoryMode.SAMPLED and random.random() >= self.sample_rate:
+                ids.append(None)
+                continue
+            evaluation_id = next(self._ids)
+            # Never block the event loop: when the writer is that far behind
+            # the row is dropped (and counted) rather than waited for
+            try:
+                self._queue.put_nowait({
+                    "id": evaluation_id,
+                    "rule_id": rule_id,
+                    "rule_version": rule_version,
+                    "input_data": input_data,
+                    "result": result,
+                    "evaluated_at": evaluated_at
+                })
+            except queue.Full:
+                self.dropped += 1
+                ids.append(None)
+                continue
+            ids.append(evaluation_id)
+        return ids
+
+    def _run(self) -> None:
+        pending: List[Dict[str, Any]] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, dict):
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.batch_size:
+                    continue
+
+            self._write(pending)
+            pending = []
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        try:
+            hashes, stored = inputs.encode_many(row.pop("input_data") for row in rows)
+            for row, input_hash in zip(rows, hashes):
+                row["input_hash"] = input_hash
+            with self.engine.begin() as conn:
+                conn.execute(inputs.insert_inputs(conn.dialect.name), stored)
+                conn.execute(models.RuleEvaluation.__table__.insert(), rows)
+            self.written += len(rows)
+        except Exception:
+            self.dropped += len(rows)
+            logger.exception("Failed to write %d rule evaluations", len(rows))
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple
+from sqlalchemy import Insert
+from sqlalchemy.dialects import postgresql, sqlite
+from . import models
+
+# Evaluation inputs are content-addressed: the key is a 16-byte BLAKE2b
+# digest of the canonical JSON (sorted keys, no whitespace) and the stored
+# data is that JSON, zlib-compressed when that makes it smaller. A zlib
+# stream starts with 'x', which no JSON text does, so no flag is needed.
+
+# Shorter texts are stored as they are; compressing them rarely pays off
+COMPRESS_MIN_BYTES = 64
+
+def canonical(data: Any) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def digest(text: bytes) -> bytes:
+    return hashlib.blake2b(text, digest_size=16).digest()
+
+def pack(text: bytes) -> bytes:
+    if len(text) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(text)
+        if len(packed) < len(text):
+            return packed
+    return text
+
+def encode(data: Any) -> Tuple[bytes, bytes]:
+    text = canonical(data)
+    return digest(text), pack(text)
+
+def decode_text(blob: bytes) -> str:
+    return (zlib.decompress(blob) if blob[:1] == b"x" else blob).decode("utf-8")
+
+def decode(blob: bytes) -> Any:
+    return json.loads(decode_text(blob))
+
+def encode_many(records: Iterable[Any]) -> Tuple[List[bytes], List[Dict[str, bytes]]]:
+    # Digests in record order, plus one evaluation_inputs row per distinct
+    # input; the rows are sorted by hash so that concurrent batches insert
+    # shared keys in the same order
+    hashes: List[bytes] = []
+    stored: Dict[bytes, bytes] = {}
+    for data in records:
+        text = canonical(data)
+        key = digest(text)
+        hashes.append(key)
+        if key not in stored:
+            stored[key] = pack(text)
+    return hashes, [{"hash": key, "data": stored[key]} for key in sorted(stored)]
+
+def insert_inputs(dialect: str) -> Insert:
+    # Inputs already stored are skipped
+    table = models.EvaluationInput.__table__
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=[table.c.hash])
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=[table.c.hash])
+    return table.insert().prefix_with("IGNORE")
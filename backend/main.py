@@ -1,15 +1,109 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import json
+import os
+import time
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from datetime import datetime, timedelta
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from . import crud, schemas, parser, evaluator, models
-from .database import get_db, create_tables
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, Tuple
+from . import crud, schemas, parser, evaluator, models, compiler, config, vectorized, matcher, history, compact, cache, workers, streaming, pagination, memo, metrics, fields, optimizer, dag, retention, entities, registry, rollups
+from .database import AsyncSessionLocal, async_engine, engine, get_async_db, create_tables
+
+def index_rule(rule: cache.CachedRule) -> None:
+    entity_network.add_rule(rule.id, rule.ast, rule.schema)
+    try:
+        rule_index.add_rule(rule.id, rule.ast, rule.schema)
+    except ValueError:
+        rule_index.remove_rule(rule.id)
+
+def forget_rule(rule_id: int) -> None:
+    rule_cache.invalidate(rule_id)
+    rule_index.remove_rule(rule_id)
+    entity_network.remove_rule(rule_id)
+
+def load_rules(db_schemas: List[models.RuleSchema], rules: List[models.Rule]) -> None:
+    # One bulk load; every active version is compiled before serving
+    for db_schema in db_schemas:
+        schema_cache.put(db_schema)
+    rule_index.clear()
+    entity_network.clear()
+    for rule in rule_cache.warm(rules):
+        index_rule(rule)
+
+def rule_saved(db_rule: models.Rule, ast: schemas.NodeBase) -> None:
+    index_rule(rule_cache.put(db_rule, ast))
+    if shared_registry is not None:
+        shared_registry.publish(registry.rule_record(db_rule))
+
+def sync_registry() -> None:
+    # Applies the changes other workers published since the last call
+    changes = shared_registry.poll()
+    if changes is None:
+        return
+    records, reset = changes
+    if reset:
+        latest: Dict[int, registry.RegistryRecord] = {}
+        for record in records:
+            if record.kind == registry.RULE:
+                latest[record.object_id] = record
+            elif record.kind == registry.DELETE:
+                latest.pop(record.object_id, None)
+        load_rules(
+            [registry.to_schema(record) for record in records if record.kind == registry.SCHEMA],
+            [registry.to_rule(record) for record in latest.values()]
+        )
+        return
+    for record in records:
+        if record.kind == registry.SCHEMA:
+            schema_cache.put(registry.to_schema(record))
+        elif record.kind == registry.RULE:
+            index_rule(rule_cache.put(registry.to_rule(record)))
+        else:
+            forget_rule(record.object_id)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_tables()
+    if shared_registry is None:
+        create_tables()
+        async with AsyncSessionLocal() as db:
+            load_rules(
+                await crud.AsyncRuleRepository.get_all_schemas(db),
+                await crud.AsyncRuleRepository.get_all_rules(db)
+            )
+    else:
+        # The first worker to start creates the tables and seeds the
+        # registry from the database; the others load the same definitions
+        # from the registry without touching the database
+        with shared_registry.locked():
+            if not shared_registry.attach():
+                create_tables()
+                async with AsyncSessionLocal() as db:
+                    db_schemas = await crud.AsyncRuleRepository.get_all_schemas(db)
+                    rules = await crud.AsyncRuleRepository.get_all_rules(db)
+                shared_registry.seed(
+                    [registry.schema_record(db_schema) for db_schema in db_schemas]
+                    + [registry.rule_record(rule) for rule in rules]
+                )
+        sync_registry()
+    history_writer.start()
+    history_compactor.start()
+    rollup_writer.start()
+    if config.ROLLUP_BACKFILL:
+        rollup_backfill.start()
     yield
+    rollup_backfill.stop()
+    rollup_writer.stop()
+    history_compactor.stop()
+    history_writer.stop()
+    if evaluation_pool is not None:
+        evaluation_pool.shutdown()
+    if shared_registry is not None:
+        shared_registry.close()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Rule Engine API",
@@ -24,35 +118,227 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
 
+# Metrics and the profiler are per process; with several workers every
+# sample carries the worker's pid so scrapes of different workers are
+# separate series (sum them by worker to get the server's totals)
+request_metrics = metrics.Metrics(
+    enabled=config.METRICS_ENABLED,
+    max_rule_labels=config.METRICS_MAX_RULE_LABELS,
+    profile_sample_rate=config.PROFILE_SAMPLE_RATE,
+    labels={"worker": str(os.getpid())} if config.SHARED_REGISTRY_PATH else None
+)
+app.add_middleware(metrics.MetricsMiddleware, metrics=request_metrics)
+
+# With several uvicorn workers, rule and schema changes reach the other
+# workers through the shared registry
+shared_registry = registry.SharedRegistry(
+    config.SHARED_REGISTRY_PATH, capacity=config.SHARED_REGISTRY_BYTES
+) if config.SHARED_REGISTRY_PATH else None
+if shared_registry is not None:
+    app.add_middleware(registry.RegistrySyncMiddleware, sync=sync_registry)
+
 # Initialize parser and evaluator
 rule_parser = parser.RuleParser()
 rule_evaluator = evaluator.RuleEvaluator()
+vectorized_evaluator = vectorized.VectorizedEvaluator()
+rule_index = dag.DecisionDag(
+    max_nodes=config.DAG_MAX_NODES
+) if config.MATCH_ENGINE == "dag" else matcher.RuleIndex()
+entity_network = entities.EntityNetwork(max_entities=config.ENTITY_CACHE_SIZE)
+history_writer = history.EvaluationWriter(
+    engine,
+    mode=config.HISTORY_MODE,
+    batch_size=config.HISTORY_BATCH_SIZE,
+    flush_interval_ms=config.HISTORY_FLUSH_INTERVAL_MS,
+    sample_rate=config.HISTORY_SAMPLE_RATE,
+    queue_size=config.HISTORY_QUEUE_SIZE,
+    allocate_ids=shared_registry.allocate_ids if shared_registry is not None else None
+)
+history_compactor = retention.HistoryCompactor(
+    engine,
+    archive_after_days=config.HISTORY_ARCHIVE_AFTER_DAYS,
+    retention_days=config.HISTORY_RETENTION_DAYS,
+    interval_seconds=config.HISTORY_COMPACTION_INTERVAL_SECONDS,
+    batch_size=config.HISTORY_COMPACTION_BATCH_SIZE,
+    exclusive=(lambda: shared_registry.exclusive("compaction")) if shared_registry is not None else None
+)
+rollup_writer = rollups.RollupWriter(
+    engine,
+    enabled=config.ROLLUPS_ENABLED,
+    flush_interval_ms=config.ROLLUP_FLUSH_INTERVAL_MS,
+    minute_retention_days=config.ROLLUP_MINUTE_RETENTION_DAYS
+)
+rollup_backfill = rollups.RollupBackfill(
+    engine,
+    minute_retention_days=config.ROLLUP_MINUTE_RETENTION_DAYS,
+    chunk_size=config.ROLLUP_BACKFILL_CHUNK_SIZE,
+    exclusive=(lambda: shared_registry.exclusive("rollup-backfill")) if shared_registry is not None else None
+)
+compiled_rules = compiler.CompiledRuleCache(
+    adaptive=config.ADAPTIVE_EVALUATION,
+    sample_every=config.ADAPTIVE_SAMPLE_EVERY,
+    replan_every=config.ADAPTIVE_REPLAN_EVERY
+)
+schema_cache = cache.SchemaCache()
+rule_cache = cache.RuleCache(compiled_rules, schema_cache, max_size=config.RULE_CACHE_SIZE)
+result_cache = memo.ResultCache(
+    max_size=config.RESULT_CACHE_SIZE,
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+    skip_history=config.RESULT_CACHE_SKIP_HISTORY
+)
+# Worker processes are spawned on the first large batch
+evaluation_pool = workers.EvaluationPool(
+    workers=config.EVAL_WORKERS,
+    chunk_size=config.EVAL_CHUNK_SIZE,
+    max_pending=config.EVAL_MAX_PENDING_CHUNKS or None,
+    cache_size=config.EVAL_WORKER_RULE_CACHE_SIZE
+) if config.EVAL_WORKERS > 0 else None
+
+def collect_runtime_metrics() -> List[metrics.Sample]:
+    # Read at scrape time from the components that already keep these
+    samples = [
+        ("rule_engine_rule_cache_entries", "gauge", "Rules held in the rule cache.", [({}, len(rule_cache))]),
+        ("rule_engine_rule_cache_requests_total", "counter", "Rule cache lookups.", [
+            ({"result": "hit"}, rule_cache.hits), ({"result": "miss"}, rule_cache.misses)
+        ]),
+        ("rule_engine_result_cache_entries", "gauge", "Memoized results.", [({}, len(result_cache))]),
+        ("rule_engine_result_cache_requests_total", "counter", "Result cache lookups.", [
+            ({"result": "hit"}, result_cache.hits), ({"result": "miss"}, result_cache.misses)
+        ]),
+        ("rule_engine_result_cache_removals_total", "counter", "Result cache entries dropped.", [
+            ({"reason": "evicted"}, result_cache.evictions), ({"reason": "expired"}, result_cache.expirations)
+        ]),
+        ("rule_engine_indexed_rules", "gauge", "Rules in the match index.", [({}, len(rule_index))]),
+        ("rule_engine_entities", "gauge", "Entities held for incremental re-evaluation.", [
+            ({}, len(entity_network))
+        ]),
+        ("rule_engine_entity_nodes_evaluated_total", "counter", "Rule nodes re-evaluated for entity updates.", [
+            ({}, entity_network.evaluated_nodes)
+        ]),
+        ("rule_engine_history_queue_depth", "gauge", "Evaluations waiting for the history writer.", [
+            ({}, history_writer.queue_depth)
+        ]),
+        ("rule_engine_history_rows_total", "counter", "Buffered history rows.", [
+            ({"state": "written"}, history_writer.written), ({"state": "dropped"}, history_writer.dropped)
+        ]),
+        ("rule_engine_rollup_evaluations_total", "counter", "Evaluations added to the stats rollups.", [
+            ({"state": "written"}, rollup_writer.written), ({"state": "dropped"}, rollup_writer.dropped),
+            ({"state": "backfilled"}, rollup_backfill.rows)
+        ]),
+        ("rule_engine_history_compacted_total", "counter", "Rows and inputs handled by history compaction.", [
+            ({"action": action}, count) for action, count in history_compactor.totals.items()
+        ]),
+    ]
+    pool = async_engine.pool
+    if hasattr(pool, "checkedout"):
+        samples.append(("rule_engine_db_pool_connections", "gauge", "Database pool connections.", [
+            ({"state": "checked_out"}, pool.checkedout()),
+            ({"state": "idle"}, pool.checkedin()),
+            ({"state": "overflow"}, max(0, pool.overflow())),
+        ]))
+        samples.append(("rule_engine_db_pool_size", "gauge", "Configured database pool size.", [({}, pool.size())]))
+    if isinstance(rule_index, dag.DecisionDag):
+        samples.append(("rule_engine_dag_nodes", "gauge", "Nodes in the match decision diagram.", [
+            ({}, rule_index.node_count)
+        ]))
+        samples.append(("rule_engine_dag_fallback", "gauge", "1 while matching falls back to rule trees.", [
+            ({}, int(rule_index.exploded or not rule_index.current))
+        ]))
+    if evaluation_pool is not None:
+        samples.append(("rule_engine_eval_pool_in_flight_chunks", "gauge", "Chunks queued or running in the worker pool.", [
+            ({}, evaluation_pool.in_flight)
+        ]))
+    if shared_registry is not None:
+        samples.append(("rule_engine_shared_registry_generation", "gauge", "Registry changes applied by this worker.", [
+            ({}, shared_registry.generation)
+        ]))
+        samples.append(("rule_engine_shared_registry_bytes", "gauge", "Size of the shared registry file.", [
+            ({}, shared_registry.size)
+        ]))
+    return samples
+
+request_metrics.registry.add_collector(collect_runtime_metrics)
+
+async def rule_schema(db: AsyncSession, schema_id: Optional[int]):
+    if schema_id is None:
+        return None
+    schema = await schema_cache.fetch(db, schema_id)
+    if schema is None:
+        raise ValueError(f"Schema {schema_id} not found")
+    return schema
+
+def optimize_rule(ast: schemas.NodeBase, schema: Optional[fields.RecordSchema]) -> schemas.NodeBase:
+    if not config.OPTIMIZE_RULES:
+        return ast
+    with request_metrics.stage("optimize"):
+        return optimizer.optimize_rule(ast, schema)[0]
+
+@app.post("/api/schemas/", response_model=schemas.RuleSchema)
+async def create_schema(schema: schemas.RuleSchemaCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        # Normalized (enum values converted to the field type) before saving
+        record_schema = fields.RecordSchema.from_json(field.model_dump() for field in schema.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_schema = await crud.AsyncRuleRepository.create_schema(db, schema.name, record_schema.to_json())
+    schema_cache.put(db_schema)
+    if shared_registry is not None:
+        shared_registry.publish(registry.schema_record(db_schema))
+    return db_schema
+
+@app.get("/api/schemas/", response_model=List[schemas.RuleSchema])
+async def get_schemas(db: AsyncSession = Depends(get_async_db)):
+    return await crud.AsyncRuleRepository.get_all_schemas(db)
+
+@app.get("/api/schemas/{schema_id}", response_model=schemas.RuleSchema)
+async def get_schema(schema_id: int, db: AsyncSession = Depends(get_async_db)):
+    found = await crud.AsyncRuleRepository.get_schemas_by_ids(db, [schema_id])
+    if not found:
+        raise HTTPException(status_code=404, detail="Schema not found")
+    return found[0]
 
 @app.post("/api/rules/", response_model=schemas.Rule)
-async def create_rule(rule: schemas.RuleCreate, db: Session = Depends(get_db)):
+async def create_rule(rule: schemas.RuleCreate, db: AsyncSession = Depends(get_async_db)):
     try:
-        # Parse rule string to AST
-        ast = rule_parser.create_rule(rule.rule_string)
+        # Parse rule string to AST, checked against the rule's schema if any
+        with request_metrics.stage("parse"):
+            schema = await rule_schema(db, rule.schema_id)
+            ast = rule_parser.create_rule(rule.rule_string, schema)
+        ast = optimize_rule(ast, schema)
         # Create rule in database
-        db_rule = crud.RuleRepository.create_rule(db, rule, ast.dict())
+        with request_metrics.stage("persist"):
+            db_rule = await crud.AsyncRuleRepository.create_rule(
+                db, rule, ast.dict(), compact.encode_rule(ast)
+            )
+        rule_saved(db_rule, ast)
         return db_rule
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/rules/", response_model=List[schemas.Rule])
 async def get_rules(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    rules = crud.RuleRepository.get_rules(db, skip=skip, limit=limit)
+    # A full page carries the cursor for the next one in X-Next-Cursor
+    try:
+        after_id = pagination.decode_rule_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rules = await crud.AsyncRuleRepository.get_rules(db, skip=skip, limit=limit, after_id=after_id)
+    if rules and len(rules) == limit:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_rule_cursor(rules[-1].id)
     return rules
 
 @app.get("/api/rules/{rule_id}", response_model=schemas.Rule)
-async def get_rule(rule_id: int, db: Session = Depends(get_db)):
-    rule = crud.RuleRepository.get_rule(db, rule_id)
+async def get_rule(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    rule = await rule_cache.get(db, rule_id)
     if rule is None:
         raise HTTPException(status_code=404, detail="Rule not found")
     return rule
@@ -61,114 +347,637 @@ async def get_rule(rule_id: int, db: Session = Depends(get_db)):
 async def update_rule(
     rule_id: int, 
     rule: schemas.RuleCreate, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Parse updated rule string to AST
-        ast = rule_parser.create_rule(rule.rule_string)
+        with request_metrics.stage("parse"):
+            schema = await rule_schema(db, rule.schema_id)
+            ast = rule_parser.create_rule(rule.rule_string, schema)
+        ast = optimize_rule(ast, schema)
         # Update rule in database
-        db_rule = crud.RuleRepository.update_rule(db, rule_id, rule, ast.dict())
+        with request_metrics.stage("persist"):
+            db_rule = await crud.AsyncRuleRepository.update_rule(
+                db, rule_id, rule, ast.dict(), compact.encode_rule(ast)
+            )
         if db_rule is None:
             raise HTTPException(status_code=404, detail="Rule not found")
+        # The new version is compiled and then swapped in; evaluations in
+        # flight keep the snapshot they started with
+        rule_saved(db_rule, ast)
         return db_rule
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/api/rules/{rule_id}")
-async def delete_rule(rule_id: int, db: Session = Depends(get_db)):
-    success = crud.RuleRepository.delete_rule(db, rule_id)
+async def delete_rule(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    success = await crud.AsyncRuleRepository.delete_rule(db, rule_id)
     if not success:
         raise HTTPException(status_code=404, detail="Rule not found")
+    forget_rule(rule_id)
+    # Waits for a rollup flush in flight, so off the event loop
+    await asyncio.to_thread(rollup_writer.forget, rule_id)
+    if shared_registry is not None:
+        shared_registry.publish(registry.RegistryRecord(registry.DELETE, rule_id, None, None))
     return {"message": "Rule deleted successfully"}
 
+def version_response(rule_version: models.RuleVersion, active_version: int) -> Dict[str, Any]:
+    return {
+        "rule_id": rule_version.rule_id,
+        "version": rule_version.version,
+        "rule_string": rule_version.rule_string,
+        "ast_json": rule_version.ast_json,
+        "created_at": rule_version.created_at,
+        "active": rule_version.version == active_version
+    }
+
+@app.get("/api/rules/{rule_id}/versions", response_model=List[schemas.RuleVersion])
+async def get_rule_versions(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    versions = await crud.AsyncRuleRepository.get_rule_versions(db, rule_id)
+    return [version_response(version, rule.version) for version in versions]
+
+@app.get("/api/rules/{rule_id}/versions/{version}", response_model=schemas.RuleVersion)
+async def get_rule_version(rule_id: int, version: int, db: AsyncSession = Depends(get_async_db)):
+    rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    rule_version = await crud.AsyncRuleRepository.get_rule_version(db, rule_id, version)
+    if rule_version is None:
+        raise HTTPException(status_code=404, detail="Rule version not found")
+    return version_response(rule_version, rule.version)
+
+@app.post("/api/rules/match", response_model=schemas.RuleMatchResult)
+async def match_rules(data: Dict[str, Any]):
+    with request_metrics.stage("evaluate"):
+        matched, errors = rule_index.match(data)
+    return {
+        "matched_rule_ids": matched,
+        "errors": [{"rule_id": rule_id, "error": error} for rule_id, error in errors.items()],
+        "rules": len(rule_index),
+        "predicates": rule_index.predicate_count
+    }
+
+def rule_outcome(outcome: workers.Outcome) -> Optional[bool]:
+    return None if isinstance(outcome, str) else outcome
+
+@app.patch("/api/entities/{entity_id}", response_model=schemas.EntityUpdateResult)
+async def update_entity(entity_id: str, changes: Dict[str, Any]):
+    # Partial update of a long-lived entity; only the rule nodes depending
+    # on changed fields are re-evaluated, and rules whose outcome changed
+    # are returned
+    with request_metrics.stage("evaluate"):
+        update = entity_network.update(entity_id, changes)
+    return {
+        "entity_id": entity_id,
+        "changed_fields": update.changed_fields,
+        "flipped": [
+            {
+                "rule_id": flip.rule_id,
+                "previous": rule_outcome(flip.previous),
+                "result": rule_outcome(flip.current),
+                "error": flip.current if isinstance(flip.current, str) else None
+            }
+            for flip in update.flipped
+        ],
+        "evaluated_nodes": update.evaluated_nodes,
+        "nodes": entity_network.node_count
+    }
+
+@app.get("/api/entities/{entity_id}", response_model=schemas.EntityState)
+async def get_entity(entity_id: str):
+    state = entity_network.get(entity_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Entity not found")
+    entity_fields, outcomes = state
+    return {
+        "entity_id": entity_id,
+        "fields": entity_fields,
+        "matched_rule_ids": sorted(rule_id for rule_id, outcome in outcomes.items() if outcome is True),
+        "errors": [
+            {"rule_id": rule_id, "error": outcome}
+            for rule_id, outcome in sorted(outcomes.items()) if isinstance(outcome, str)
+        ]
+    }
+
+@app.delete("/api/entities/{entity_id}")
+async def delete_entity(entity_id: str):
+    if not entity_network.delete(entity_id):
+        raise HTTPException(status_code=404, detail="Entity not found")
+    return {"message": "Entity deleted successfully"}
+
 @app.post("/api/rules/{rule_id}/evaluate")
 async def evaluate_rule(
     rule_id: int, 
     data: Dict[str, Any], 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    rule = crud.RuleRepository.get_rule(db, rule_id)
+    with request_metrics.stage("load"):
+        rule = await rule_cache.get(db, rule_id)
     if rule is None:
         raise HTTPException(status_code=404, detail="Rule not found")
         
     try:
-        # Convert stored AST back to NodeBase
-        ast = schemas.NodeBase.model_validate(rule.ast_json)
-        # Evaluate rule
-        result = rule_evaluator.evaluate_rule(ast, data)
-        
-        # Store evaluation result
-        evaluation = crud.RuleRepository.create_evaluation(
-            db=db,
-            rule_id=rule_id,
-            input_data=data,
-            result=result
+        # Compiled form is cached until the rule changes, and results until
+        # the rule changes or the fields it reads take new values
+        with request_metrics.stage("validate"):
+            compiled_rule = rule_cache.compile(rule)
+            read_fields = rule.fields
+        with request_metrics.stage("evaluate"):
+            started = time.perf_counter()
+            try:
+                result, hit = result_cache.evaluate(rule.key, read_fields, compiled_rule, data)
+            except Exception:
+                request_metrics.count_evaluations(errors=1)
+                rollup_writer.record(rule_id, rule.version, error_count=1, seconds=time.perf_counter() - started)
+                raise
+        request_metrics.count_evaluations(true=int(result), false=int(not result))
+        rollup_writer.record(
+            rule_id, rule.version, true_count=int(result), false_count=int(not result),
+            seconds=time.perf_counter() - started
         )
         
+        # Store evaluation result; buffered modes return before the write
+        if hit and result_cache.skip_history:
+            evaluation_id = None
+        else:
+            with request_metrics.stage("persist"):
+                evaluation_id = await history_writer.record(db, rule_id, data, result, rule.version)
+        
         return {
             "rule_id": rule_id,
+            "rule_version": rule.version,
             "result": result,
-            "evaluation_id": evaluation.id
+            "evaluation_id": evaluation_id
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+def parse_batch_records(body: bytes, content_type: str) -> List[Tuple[Any, Optional[str]]]:
+    # Returns (record, error) pairs so malformed NDJSON lines fail individually
+    if content_type.split(";")[0].strip() in NDJSON_CONTENT_TYPES:
+        records = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append((json.loads(line), None))
+            except ValueError as e:
+                records.append((None, f"Invalid JSON: {e}"))
+        return records
+
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of records")
+    return [(record, None) for record in payload]
+
+@app.post("/api/rules/{rule_id}/evaluate/batch", response_model=schemas.RuleBatchEvaluation)
+async def evaluate_rule_batch(
+    rule_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    with request_metrics.stage("load"):
+        rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    body = await request.body()
+    with request_metrics.stage("parse"):
+        records = parse_batch_records(body, request.headers.get("content-type", ""))
+    valid = [
+        record for record, error in records
+        if error is None and isinstance(record, dict)
+    ]
+
+    # Large batches are scored in the worker pool, off the event loop
+    started = time.perf_counter()
+    if evaluation_pool is not None and len(valid) >= config.EVAL_PARALLEL_MIN_RECORDS:
+        with request_metrics.stage("evaluate"):
+            outcomes = await asyncio.to_thread(
+                lambda: list(evaluation_pool.evaluate(
+                    rule.key, workers.RuleSource.of(rule.ast_json, rule.ast_blob, rule.schema), valid
+                ))
+            )
+        hits = [False] * len(outcomes)
+    else:
+        with request_metrics.stage("validate"):
+            compiled_rule = rule_cache.compile(rule)
+            read_fields = rule.fields
+        with request_metrics.stage("evaluate"):
+            outcomes, hits = result_cache.evaluate_many(rule.key, read_fields, compiled_rule, valid)
+    elapsed = time.perf_counter() - started
+
+    results = []
+    evaluated = []
+    recorded = []
+    outcome_iter = iter(zip(outcomes, hits))
+    for index, (record, error) in enumerate(records):
+        if error is None and not isinstance(record, dict):
+            error = "Record must be a JSON object"
+        if error is None:
+            outcome, hit = next(outcome_iter)
+            if isinstance(outcome, bool):
+                item = {"index": index, "result": outcome, "evaluation_id": None}
+                evaluated.append((record, outcome))
+                results.append(item)
+                if not (hit and result_cache.skip_history):
+                    recorded.append(((record, outcome), item))
+                continue
+            error = outcome
+        results.append({"index": index, "error": error})
+
+    true_count = sum(1 for _, outcome in evaluated if outcome)
+    request_metrics.count_evaluations(
+        true=true_count, false=len(evaluated) - true_count, errors=len(results) - len(evaluated)
+    )
+    # Records that failed before evaluation (bad JSON) count as errors too
+    rollup_writer.record(
+        rule_id, rule.version, true_count=true_count, false_count=len(evaluated) - true_count,
+        error_count=len(results) - len(evaluated), seconds=elapsed / max(1, len(valid))
+    )
+    with request_metrics.stage("persist"):
+        evaluation_ids = await history_writer.record_many(db, rule_id, [pair for pair, _ in recorded], rule.version)
+    for (_, item), evaluation_id in zip(recorded, evaluation_ids):
+        item["evaluation_id"] = evaluation_id
+
+    return {
+        "rule_id": rule_id,
+        "rule_version": rule.version,
+        "total": len(results),
+        "errors": len(results) - len(evaluated),
+        "results": results
+    }
+
+@app.post("/api/rules/{rule_id}/evaluate/stream")
+async def evaluate_rule_stream(
+    rule_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    with request_metrics.stage("load"):
+        rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    with request_metrics.stage("validate"):
+        compiled_rule = rule_cache.compile(rule)
+        read_fields = rule.fields
+
+    async def results():
+        # Each received chunk is parsed, evaluated, recorded and answered
+        # before the next one is read, so memory does not grow with the
+        # upload. The request's own session is closed once streaming
+        # starts, so history gets a session of its own.
+        total = 0
+        errors = 0
+        async with AsyncSessionLocal() as session:
+            try:
+                async for lines in streaming.ndjson_lines(request.stream(), config.STREAM_MAX_LINE_BYTES):
+                    items = []
+                    evaluated = []
+                    recorded = []
+                    # Per chunk; includes decoding each line
+                    started = time.perf_counter()
+                    for line in lines:
+                        if line is not None and not line.strip():
+                            continue
+                        item = {"index": total}
+                        total += 1
+                        items.append(item)
+                        if line is None:
+                            item["error"] = f"Line exceeds {config.STREAM_MAX_LINE_BYTES} bytes"
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError as e:
+                            item["error"] = f"Invalid JSON: {e}"
+                            continue
+                        if not isinstance(record, dict):
+                            item["error"] = "Record must be a JSON object"
+                            continue
+                        try:
+                            item["result"], hit = result_cache.evaluate(rule.key, read_fields, compiled_rule, record)
+                        except Exception as e:
+                            item["error"] = str(e)
+                            continue
+                        item["evaluation_id"] = None
+                        evaluated.append((record, item))
+                        if not (hit and result_cache.skip_history):
+                            recorded.append((record, item))
+
+                    elapsed = time.perf_counter() - started
+                    request_metrics.observe_stage("evaluate", elapsed)
+                    true_count = sum(1 for _, item in evaluated if item["result"])
+                    request_metrics.count_evaluations(
+                        true=true_count, false=len(evaluated) - true_count, errors=len(items) - len(evaluated)
+                    )
+                    rollup_writer.record(
+                        rule_id, rule.version, true_count=true_count, false_count=len(evaluated) - true_count,
+                        error_count=len(items) - len(evaluated), seconds=elapsed / max(1, len(items))
+                    )
+                    with request_metrics.stage("persist"):
+                        evaluation_ids = await history_writer.record_many(
+                            session, rule_id, [(record, item["result"]) for record, item in recorded], rule.version
+                        )
+                    for (_, item), evaluation_id in zip(recorded, evaluation_ids):
+                        item["evaluation_id"] = evaluation_id
+                    errors += len(items) - len(evaluated)
+                    if items:
+                        yield "".join(json.dumps(item) + "\n" for item in items)
+            except ClientDisconnect:
+                return
+        yield json.dumps({"done": True, "rule_version": rule.version, "total": total, "errors": errors}) + "\n"
+
+    return streaming.DuplexStreamingResponse(results(), media_type="application/x-ndjson")
+
+async def read_columnar_payload(request: Request) -> Dict[str, List[Any]]:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "multipart/form-data":
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Expected a CSV upload in the 'file' field")
+        return vectorized.read_csv_columns((await upload.read()).decode("utf-8"))
+    if content_type == "text/csv":
+        return vectorized.read_csv_columns((await request.body()).decode("utf-8"))
+
+    try:
+        payload = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    columns = payload.get("columns", payload) if isinstance(payload, dict) else None
+    if not isinstance(columns, dict) or not all(isinstance(v, list) for v in columns.values()):
+        raise HTTPException(status_code=400, detail="Expected an object mapping field names to value arrays")
+    return columns
+
+@app.post("/api/rules/{rule_id}/evaluate/columnar", response_model=schemas.ColumnarEvaluation)
+async def evaluate_rule_columnar(
+    rule_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    with request_metrics.stage("load"):
+        rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    try:
+        with request_metrics.stage("parse"):
+            columns = await read_columnar_payload(request)
+        with request_metrics.stage("validate"):
+            ast = rule.ast
+        with request_metrics.stage("evaluate"):
+            if rule.schema is None:
+                values, errors, messages = vectorized_evaluator.evaluate(ast, columns)
+            else:
+                values, errors, messages = vectorized_evaluator.evaluate_rows(rule.compiled, columns)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Offline scoring: results are returned but not written to the history
+    results = values.tolist()
+    row_errors = []
+    if errors is not None:
+        for index in errors.nonzero()[0].tolist():
+            results[index] = None
+            row_errors.append({"index": index, "error": messages[index]})
+    true_count = int(values.sum())
+    request_metrics.count_evaluations(
+        true=true_count, false=len(results) - true_count - len(row_errors), errors=len(row_errors)
+    )
+
+    return {
+        "rule_id": rule_id,
+        "rows": len(results),
+        "true_count": true_count,
+        "results": results,
+        "errors": row_errors
+    }
+
+@app.get("/api/rules/{rule_id}/plan", response_model=schemas.RulePlan)
+async def get_rule_plan(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    plan = compiled_rules.plan(rule.id, rule.version, rule.ast_json, rule.ast_blob, rule.schema)
+    return {
+        "rule_id": rule.id,
+        "adaptive": compiled_rules.adaptive,
+        "plan": plan.render(),
+        "calls": plan.calls,
+        "samples": plan.samples,
+        "nodes": plan.stats()
+    }
+
+@app.get("/api/rules/{rule_id}/analyze", response_model=schemas.RuleAnalysis)
+async def analyze_rule(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    # The stored tree is already optimized, so start again from the rule string
+    try:
+        original = rule_parser.create_rule(rule.rule_string, rule.schema)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    optimized, findings = optimizer.optimize_rule(original, rule.schema)
+    return {
+        "rule_id": rule.id,
+        "rule_version": rule.version,
+        "original": compiler.render_node(original),
+        "optimized": compiler.render_node(optimized),
+        "ast": optimized.model_dump(),
+        "nodes_before": optimizer.count_nodes(original),
+        "nodes_after": optimizer.count_nodes(optimized),
+        "findings": [finding._asdict() for finding in findings]
+    }
+
+@app.get("/api/cache/stats", response_model=schemas.CacheStats)
+async def get_cache_stats():
+    return {
+        "results": result_cache.stats(),
+        "rules": {
+            "size": len(rule_cache),
+            "max_size": rule_cache.max_size,
+            "hits": rule_cache.hits,
+            "misses": rule_cache.misses
+        }
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(request_metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def profile_report() -> Dict[str, Any]:
+    profiler = request_metrics.profiler
+    return {"sample_rate": profiler.sample_rate, "requests": profiler.requests, "report": profiler.report()}
+
+@app.get("/api/profile", response_model=schemas.ProfileReport)
+async def get_profile():
+    return profile_report()
+
+@app.put("/api/profile", response_model=schemas.ProfileReport)
+async def update_profile(settings: schemas.ProfileSettings):
+    # Takes effect for the next request; reset drops what was collected
+    if settings.reset:
+        request_metrics.profiler.reset()
+    request_metrics.profiler.sample_rate = settings.sample_rate
+    return profile_report()
+
 @app.get("/api/rules/{rule_id}/evaluations", response_model=List[schemas.RuleEvaluation])
 async def get_rule_evaluations(
     rule_id: int, 
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    rule = crud.RuleRepository.get_rule(db, rule_id)
+    rule = await rule_cache.get(db, rule_id)
     if rule is None:
         raise HTTPException(status_code=404, detail="Rule not found")
+    try:
+        after = pagination.decode_evaluation_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
         
-    evaluations = crud.RuleRepository.get_rule_evaluations(
-        db, rule_id, skip=skip, limit=limit
+    evaluations = await crud.AsyncRuleRepository.get_rule_evaluations(
+        db, rule_id, skip=skip, limit=limit, after=after, since=since, until=until
     )
+    if evaluations and len(evaluations) == limit:
+        last = evaluations[-1]
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_evaluation_cursor(last.evaluated_at, last.id)
     return evaluations
 
+@app.get("/api/rules/{rule_id}/stats", response_model=schemas.RuleStats)
+async def get_rule_stats(
+    rule_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    granularity: str = "hour",
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Answered from the rollups, one row per bucket and rule version, so
+    # the cost depends on the range and not on the size of the history
+    rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    width = rollups.GRANULARITIES.get(granularity)
+    if width is None:
+        raise HTTPException(status_code=400, detail=f"Invalid granularity: {granularity}")
+    end = rollups.local_time(end) if end is not None else datetime.now()
+    start = rollups.bucket_start(rollups.local_time(start) if start is not None else end - rollups.DEFAULT_SPANS[width], width)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    if (end - start) / timedelta(seconds=width) > config.ROLLUP_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400, detail=f"Range spans more than {config.ROLLUP_MAX_BUCKETS} {granularity} buckets"
+        )
+    totals, versions, buckets = rollups.summarize(
+        await crud.AsyncRuleRepository.get_rule_rollups(db, rule_id, width, start, end)
+    )
+    return {
+        "rule_id": rule_id,
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "totals": totals,
+        "versions": versions,
+        "buckets": buckets
+    }
+
+@app.get("/api/rules/{rule_id}/evaluations/export")
+async def export_rule_evaluations(
+    rule_id: int,
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    if format not in streaming.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    rule = await rule_cache.get(db, rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    async def rows():
+        # Server-side cursor fetching EXPORT_BATCH_SIZE plain rows at a
+        # time; no ORM objects or pydantic models are built
+        async with async_engine.connect() as conn:
+            result = await conn.stream(
+                crud.evaluation_export_query(rule_id, since, until)
+                .execution_options(yield_per=config.EXPORT_BATCH_SIZE)
+            )
+            async for partition in result.partitions():
+                yield partition
+
+    return StreamingResponse(
+        streaming.export_evaluations(rows(), format),
+        media_type=streaming.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="rule-{rule_id}-evaluations.{format}"'}
+    )
+
 @app.post("/api/rules/combine")
 async def combine_rules(
     request: schemas.RuleCombineRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Get all rules
-    rules = []
+    # Get all rules: cache hits plus one IN (...) query for the rest
+    with request_metrics.stage("load"):
+        cached_rules = await rule_cache.get_many(db, request.rule_ids)
     for rule_id in request.rule_ids:
-        rule = crud.RuleRepository.get_rule(db, rule_id)
-        if rule is None:
+        if rule_id not in cached_rules:
             raise HTTPException(
                 status_code=404, 
                 detail=f"Rule with id {rule_id} not found"
             )
-        rules.append(schemas.NodeBase.model_validate(rule.ast_json))
+    rules = [cached_rules[rule_id].ast for rule_id in request.rule_ids]
+    # Stored trees are bound to their schema (constants already coerced),
+    # so only rules sharing one schema can be compiled together
+    schema_ids = {cached_rules[rule_id].schema_id for rule_id in request.rule_ids}
+    if len(schema_ids) > 1:
+        raise HTTPException(status_code=400, detail="Rules with different schemas cannot be combined")
+    schema_id = schema_ids.pop() if schema_ids else None
     
     try:
         # Combine rules
-        combined_ast = rule_evaluator.combine_rules(rules)
+        with request_metrics.stage("combine"):
+            combined_ast = rule_evaluator.combine_rules(rules)
+        combined_ast = optimize_rule(combined_ast, await rule_schema(db, schema_id))
         
         if request.save_rule:
             # For saving, we'll use a simplified rule string representation
-            rule_strings = [
-                crud.RuleRepository.get_rule(db, rule_id).rule_string 
-                for rule_id in request.rule_ids
-            ]
+            rule_strings = [cached_rules[rule_id].rule_string for rule_id in request.rule_ids]
             combined_rule_string = f"({' OR '.join(rule_strings)})"
             
             # Save as new rule
             new_rule = schemas.RuleCreate(
                 name=request.name or f"Combined Rule ({','.join(map(str, request.rule_ids))})",
                 description=request.description or f"Combination of rules: {request.rule_ids}",
-                rule_string=combined_rule_string
+                rule_string=combined_rule_string,
+                schema_id=schema_id
             )
             
-            db_rule = crud.RuleRepository.create_rule(
-                db=db,
-                rule=new_rule,
-                ast_json=combined_ast.model_dump()
-            )
+            with request_metrics.stage("persist"):
+                db_rule = await crud.AsyncRuleRepository.create_rule(
+                    db=db,
+                    rule=new_rule,
+                    ast_json=combined_ast.model_dump(),
+                    ast_blob=compact.encode_rule(combined_ast)
+                )
+            rule_saved(db_rule, combined_ast)
             
             return {
                 "rule_id": db_rule.id,
@@ -0,0 +1,257 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from .schemas import NodeBase
+from .parser import Operator, NodeType
+from .fields import RecordSchema
+from .compiler import (
+    COMPARATORS, LOGICAL_OPERATORS, CompiledFn, RuleCompiler, flatten_logical, compile_constant, compile_error,
+    compile_group
+)
+
+PredicateKey = Tuple[str, str, Hashable]
+
+_ERROR = object()
+_threshold = itemgetter(0)
+
+def _kind(value: Any) -> Optional[str]:
+    # Range thresholds are only ordered among mutually comparable values
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return None
+
+def _hashable(value: Any) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+class _FieldIndex:
+    def __init__(self):
+        # value -> predicate ids for '='
+        self.eq: Dict[Any, List[int]] = {}
+        # (operator, kind) -> [(threshold, predicate id)] sorted by threshold
+        self.ranges: Dict[Tuple[str, str], List[Tuple[Any, int]]] = {}
+        # predicates whose constant cannot be indexed, tested directly
+        self.direct: List[int] = []
+        self.predicates: List[int] = []
+
+    def is_empty(self) -> bool:
+        return not self.predicates
+
+class RuleIndex:
+    # Matches one record against every indexed rule. Each distinct
+    # (field, operator, value) comparison is evaluated once per record:
+    # '=' through a hash lookup and </<=/>/>= through bisect over sorted
+    # thresholds. Each rule's AND/OR structure is then resolved over the
+    # shared predicate results with RuleEvaluator's short-circuit semantics.
+    # Rules bound to a schema coerce record values before comparing, so they
+    # are not indexed and run as their typed compiled tree instead.
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._compiler = RuleCompiler()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._predicate_ids: Dict[PredicateKey, int] = {}
+        self._predicates: List[Optional[Tuple[str, str, Any]]] = []
+        self._refcounts: List[int] = []
+        self._free: List[int] = []
+        self._fields: Dict[str, _FieldIndex] = {}
+        self._rules: Dict[int, Tuple[CompiledFn, List[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    @property
+    def predicate_count(self) -> int:
+        return len(self._predicate_ids)
+
+    def add_rule(self, rule_id: int, node: NodeBase, schema: Optional[RecordSchema] = None) -> None:
+        with self._lock:
+            self.remove_rule(rule_id)
+            predicate_ids: List[int] = []
+            if schema is None:
+                structure = self._compile(node, predicate_ids)
+            else:
+                structure = self._typed(self._compiler.compile_typed(node, schema))
+            self._rules[rule_id] = (structure, predicate_ids)
+
+    def remove_rule(self, rule_id: int) -> bool:
+        with self._lock:
+            entry = self._rules.pop(rule_id, None)
+            if entry is None:
+                return False
+            for predicate_id in entry[1]:
+                self._release(predicate_id)
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _compile(self, node: NodeBase, predicate_ids: List[int]) -> CompiledFn:
+        if node.type == NodeType.OPERATOR:
+            if node.operator not in LOGICAL_OPERATORS:
+                return compile_error(f"Invalid logical operator: {node.operator}")
+            children = [self._compile(child, predicate_ids) for child in flatten_logical(node)]
+            return compile_group(node.operator, children)
+        elif node.type == NodeType.COMPARISON:
+            if node.operator == Operator.IN:
+                # One hash-indexed '=' predicate per member
+                children = [
+                    self._predicate(node.field, Operator.EQ.value, value, predicate_ids)
+                    for value in node.value
+                ]
+                if not children:
+                    return compile_constant(False)
+                return children[0] if len(children) == 1 else compile_group(Operator.OR.value, children)
+            if node.operator not in COMPARATORS:
+                return compile_error(f"Invalid comparison operator: {node.operator}")
+            return self._predicate(node.field, node.operator, node.value, predicate_ids)
+        elif node.type == NodeType.CONSTANT:
+            return compile_constant(node.value)
+        return compile_error(f"Invalid node type: {node.type}")
+
+    @staticmethod
+    def _typed(compiled: CompiledFn) -> CompiledFn:
+        def structure(context: Tuple[List[Any], Dict[str, Any]]) -> bool:
+            return compiled(context[1])
+        return structure
+
+    def _predicate(self, field: str, operator: str, value: Any, predicate_ids: List[int]) -> CompiledFn:
+        predicate_id = self._acquire(field, operator, value)
+        predicate_ids.append(predicate_id)
+        explain = self._explain
+
+        def predicate(context: Tuple[List[Any], Dict[str, Any]]) -> bool:
+            value = context[0][predicate_id]
+            if value is _ERROR:
+                raise explain(predicate_id, context[1])
+            return value
+
+        return predicate
+
+    def _acquire(self, field: str, operator: str, value: Any) -> int:
+        key = (field, operator, value if _hashable(value) else repr(value))
+        predicate_id = self._predicate_ids.get(key)
+        if predicate_id is not None:
+            self._refcounts[predicate_id] += 1
+            return predicate_id
+
+        if self._free:
+            predicate_id = self._free.pop()
+            self._predicates[predicate_id] = (field, operator, value)
+            self._refcounts[predicate_id] = 1
+        else:
+            predicate_id = len(self._predicates)
+            self._predicates.append((field, operator, value))
+            self._refcounts.append(1)
+        self._predicate_ids[key] = predicate_id
+
+        index = self._fields.setdefault(field, _FieldIndex())
+        index.predicates.append(predicate_id)
+        kind = _kind(value)
+        if operator == Operator.EQ and _hashable(value):
+            index.eq.setdefault(value, []).append(predicate_id)
+        elif operator != Operator.EQ and kind is not None and value == value:
+            insort(index.ranges.setdefault((operator, kind), []), (value, predicate_id), key=_threshold)
+        else:
+            index.direct.append(predicate_id)
+        return predicate_id
+
+    def _release(self, predicate_id: int) -> None:
+        self._refcounts[predicate_id] -= 1
+        if self._refcounts[predicate_id]:
+            return
+
+        field, operator, value = self._predicates[predicate_id]
+        del self._predicate_ids[(field, operator, value if _hashable(value) else repr(value))]
+        index = self._fields[field]
+        index.predicates.remove(predicate_id)
+        kind = _kind(value)
+        if operator == Operator.EQ and _hashable(value):
+            bucket = index.eq[value]
+            bucket.remove(predicate_id)
+            if not bucket:
+                del index.eq[value]
+        elif operator != Operator.EQ and kind is not None and value == value:
+            entries = index.ranges[(operator, kind)]
+            entries.remove((value, predicate_id))
+            if not entries:
+                del index.ranges[(operator, kind)]
+        else:
+            index.direct.remove(predicate_id)
+        if index.is_empty():
+            del self._fields[field]
+
+        self._predicates[predicate_id] = None
+        self._free.append(predicate_id)
+
+    def _explain(self, predicate_id: int, data: Dict[str, Any]) -> Exception:
+        # Rebuilds the exception the row evaluator would have raised
+        field, operator, value = self._predicates[predicate_id]
+        if data.get(field) is None:
+            return ValueError(f"Field '{field}' not found in data")
+        try:
+            COMPARATORS[operator](data[field], value)
+        except TypeError as e:
+            return e
+        return ValueError(f"Could not evaluate '{field} {operator} {value}'")
+
+    def evaluate_predicates(self, data: Dict[str, Any]) -> List[Any]:
+        truth: List[Any] = [False] * len(self._predicates)
+        for field, index in self._fields.items():
+            value = data.get(field)
+            if value is None:
+                for predicate_id in index.predicates:
+                    truth[predicate_id] = _ERROR
+                continue
+
+            if index.eq and _hashable(value):
+                for predicate_id in index.eq.get(value, ()):
+                    truth[predicate_id] = True
+
+            kind = _kind(value)
+            for (operator, threshold_kind), entries in index.ranges.items():
+                if kind != threshold_kind:
+                    for _, predicate_id in entries:
+                        truth[predicate_id] = _ERROR
+                    continue
+                if value != value:
+                    continue  # NaN compares false against every threshold
+                if operator == Operator.GT:
+                    matched = entries[:bisect_left(entries, value, key=_threshold)]
+                elif operator == Operator.GTE:
+                    matched = entries[:bisect_right(entries, value, key=_threshold)]
+                elif operator == Operator.LT:
+                    matched = entries[bisect_right(entries, value, key=_threshold):]
+                else:
+                    matched = entries[bisect_left(entries, value, key=_threshold):]
+                for _, predicate_id in matched:
+                    truth[predicate_id] = True
+
+            for predicate_id in index.direct:
+                _, operator, constant = self._predicates[predicate_id]
+                try:
+                    truth[predicate_id] = bool(COMPARATORS[operator](value, constant))
+                except TypeError:
+                    truth[predicate_id] = _ERROR
+        return truth
+
+    def match(self, data: Dict[str, Any]) -> Tuple[List[int], Dict[int, str]]:
+        with self._lock:
+            context = (self.evaluate_predicates(data), data)
+            matched = []
+            errors = {}
+            for rule_id, (structure, _) in self._rules.items():
+                try:
+                    if structure(context):
+                        matched.append(rule_id)
+                except Exception as e:
+                    errors[rule_id] = str(e)
+            return matched, errors
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+from .compact import constant_key
+from .compiler import CompiledFn
+from .workers import Outcome
+
+# Stands in for an absent field in cache keys; distinct from an explicit null
+_MISSING = ("missing",)
+
+class ResultCache:
+    # Memoizes rule results by rule version plus the values of only the
+    # fields the rule reads, so payloads that differ elsewhere share an
+    # entry. Values are type-tagged (1, 1.0 and True stay distinct). Only
+    # successful results are cached; errors are re-evaluated each time so
+    # their messages stay exact. Bounded by max_size (LRU) and ttl_seconds.
+    def __init__(self, max_size: int = 100000, ttl_seconds: float = 300.0, skip_history: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.skip_history = skip_history
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[Hashable, Tuple[bool, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(rule_key: Hashable, fields: Tuple[str, ...], data: Dict[str, Any]) -> Hashable:
+        return (rule_key, tuple(
+            constant_key(data[field]) if field in data else _MISSING for field in fields
+        ))
+
+    def get(self, key: Hashable):
+        # Returns the cached result, or None on a miss
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, result: bool) -> None:
+        with self._lock:
+            self._entries[key] = (result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def evaluate(
+        self,
+        rule_key: Hashable,
+        fields: Tuple[str, ...],
+        compiled: CompiledFn,
+        data: Dict[str, Any]
+    ) -> Tuple[bool, bool]:
+        # (result, hit); evaluation errors propagate as usual
+        if not self.enabled:
+            return compiled(data), False
+        try:
+            key = self.key(rule_key, fields, data)
+        except TypeError:
+            # Not hashable even after tagging; evaluate without caching
+            return compiled(data), False
+        result = self.get(key)
+        if result is not None:
+            return result, True
+        result = compiled(data)
+        self.put(key, result)
+        return result, False
+
+    def evaluate_many(
+        self,
+        rule_key: Hashable,
+        fields: Tuple[str, ...],
+        compiled: CompiledFn,
+        records: Iterable[Dict[str, Any]]
+    ) -> Tuple[List[Outcome], List[bool]]:
+        # Outcomes as in workers.evaluate_records, plus a hit flag per record
+        outcomes: List[Outcome] = []
+        hits: List[bool] = []
+        for record in records:
+            try:
+                result, hit = self.evaluate(rule_key, fields, compiled, record)
+            except Exception as e:
+                result, hit = str(e), False
+            outcomes.append(result)
+            hits.append(hit)
+        return outcomes, hits
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
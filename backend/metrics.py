@@ -0,0 +1,315 @@
+import cProfile
+import contextvars
+import io
+import math
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond cache hits up to slow batch requests
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+OTHER_LABEL = "other"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Histogram:
+    # A family of fixed-bucket histograms keyed by label values. observe()
+    # is a bisect and three additions under a lock; nothing is allocated
+    # after the first observation of a label set.
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        # Per series: one count per bucket plus +Inf, then sum and count
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self, extra: str = "") -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for label_values, series in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, extra, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values, extra)
+            lines.append(f"{self.name}_sum{labels} {_format_number(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_number(series[-1])}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self, extra: str = "") -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for label_values, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values, extra)} {_format_number(value)}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+# A collector returns (name, type, help, [(labels, value), ...]) samples
+# computed at scrape time, for state that other components already track
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+class Registry:
+    # labels are added to every sample, e.g. to tell the workers of one
+    # server apart
+    def __init__(self, labels: Optional[Dict[str, str]] = None):
+        self.metrics: List[Any] = []
+        self.collectors: List[Callable[[], List[Sample]]] = []
+        self.extra = ",".join(f'{name}="{_escape(value)}"' for name, value in (labels or {}).items())
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Sample]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.collect(self.extra))
+        for collector in self.collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()), self.extra)} {_format_number(float(value))}")
+        return "\n".join(lines) + "\n"
+
+class RequestContext:
+    # Per-request state shared by the middleware and stage() timers
+    __slots__ = ("scope", "stages")
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+        self.stages: Dict[str, float] = {}
+
+    @property
+    def endpoint(self) -> str:
+        # Route template once routing has happened, so ids do not explode
+        # the label space; unmatched paths share one label
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    @property
+    def rule_id(self) -> Optional[str]:
+        rule_id = self.scope.get("path_params", {}).get("rule_id")
+        return None if rule_id is None else str(rule_id)
+
+_current: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar("request_metrics", default=None)
+
+class Profiler:
+    # Runs cProfile around a random fraction of requests and accumulates
+    # the results. The profiler hooks the whole thread, so at most one
+    # request is profiled at a time and other requests interleaved on the
+    # event loop meanwhile are attributed to it as well.
+    def __init__(self, sample_rate: float = 0.0):
+        self.sample_rate = sample_rate
+        self.requests = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) owns the hook
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile) -> None:
+        profile.disable()
+        self._active.release()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.requests += 1
+
+    def report(self, sort: str = "cumulative", limit: int = 50) -> str:
+        with self._lock:
+            if self._stats is None:
+                return ""
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+            return out.getvalue()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = None
+            self.requests = 0
+
+class Metrics:
+    # Request and stage timings. Stages (parse, load, validate, evaluate,
+    # persist) are timed per endpoint and per rule id; rule ids beyond
+    # max_rule_labels are reported as "other".
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_rule_labels: int = 1000,
+        profile_sample_rate: float = 0.0,
+        labels: Optional[Dict[str, str]] = None
+    ):
+        self.enabled = enabled
+        self.max_rule_labels = max_rule_labels
+        self.registry = Registry(labels)
+        self.profiler = Profiler(profile_sample_rate)
+        self.requests = self.registry.register(Histogram(
+            "rule_engine_request_duration_seconds", "HTTP request latency.", ("method", "endpoint", "status")
+        ))
+        self.stages = self.registry.register(Histogram(
+            "rule_engine_stage_duration_seconds", "Time spent per request stage.", ("endpoint", "stage")
+        ))
+        self.rule_stages = self.registry.register(Histogram(
+            "rule_engine_rule_stage_duration_seconds", "Time spent per request stage, by rule.", ("rule_id", "stage")
+        ))
+        self.evaluations = self.registry.register(Counter(
+            "rule_engine_evaluations_total", "Records evaluated, by outcome.", ("endpoint", "outcome")
+        ))
+        self._rule_labels: set = set()
+
+    def _rule_label(self, rule_id: str) -> str:
+        if rule_id in self._rule_labels:
+            return rule_id
+        if len(self._rule_labels) >= self.max_rule_labels:
+            return OTHER_LABEL
+        self._rule_labels.add(rule_id)
+        return rule_id
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        context = _current.get()
+        if context is None:
+            return
+        context.stages[stage] = context.stages.get(stage, 0.0) + seconds
+        self.stages.observe(seconds, context.endpoint, stage)
+        rule_id = context.rule_id
+        if rule_id is not None:
+            self.rule_stages.observe(seconds, self._rule_label(rule_id), stage)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if not self.enabled or _current.get() is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - start)
+
+    def count_evaluations(self, true: int = 0, false: int = 0, errors: int = 0) -> None:
+        context = _current.get()
+        if not self.enabled or context is None:
+            return
+        endpoint = context.endpoint
+        for outcome, count in (("true", true), ("false", false), ("error", errors)):
+            if count:
+                self.evaluations.inc(count, endpoint, outcome)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+    def clear(self) -> None:
+        for metric in self.registry.metrics:
+            metric.clear()
+        self._rule_labels.clear()
+
+class MetricsMiddleware:
+    # Pure ASGI middleware (no extra task per request, unlike
+    # BaseHTTPMiddleware), so the context it sets is the one the endpoint
+    # and its stage() timers see. Streaming responses are timed until the
+    # last body chunk is sent.
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        context = RequestContext(scope)
+        token = _current.set(context)
+        profile = self.metrics.profiler.start()
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                self.metrics.profiler.stop(profile)
+            _current.reset(token)
+            self.metrics.requests.observe(elapsed, scope["method"], context.endpoint, str(status))
@@ -1,8 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, ForeignKey, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
 
+class RuleSchema(Base):
+    __tablename__ = "rule_schemas"
+    
+    # Field declarations ({name, type, nullable, enum}); never modified
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    fields = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
 class Rule(Base):
     __tablename__ = "rules"
     
@@ -11,18 +20,102 @@ class Rule(Base):
     description = Column(String)
     rule_string = Column(String, nullable=False)
     ast_json = Column(JSON, nullable=False)
+    # Compact binary encoding of ast_json (see compact.py), None if not encodable
+    ast_blob = Column(LargeBinary)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    schema_id = Column(Integer, ForeignKey("rule_schemas.id"))
+    # Active version; the columns above mirror rule_versions at this version
+    version = Column(Integer, nullable=False, default=1)
     
     evaluations = relationship("RuleEvaluation", back_populates="rule")
 
+class RuleVersion(Base):
+    __tablename__ = "rule_versions"
+    
+    # Written once per create/update and never modified
+    id = Column(Integer, primary_key=True, index=True)
+    rule_id = Column(Integer, ForeignKey("rules.id"), nullable=False)
+    version = Column(Integer, nullable=False)
+    rule_string = Column(String, nullable=False)
+    ast_json = Column(JSON, nullable=False)
+    ast_blob = Column(LargeBinary)
+    schema_id = Column(Integer, ForeignKey("rule_schemas.id"))
+    created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index("idx_rule_versions_rule_version", "rule_id", "version", unique=True),
+    )
+
+class EvaluationInput(Base):
+    __tablename__ = "evaluation_inputs"
+    
+    # One row per distinct evaluation input, keyed by a digest of its
+    # canonical JSON (see inputs.py); never modified
+    hash = Column(LargeBinary, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+
 class RuleEvaluation(Base):
     __tablename__ = "rule_evaluations"
     
     id = Column(Integer, primary_key=True, index=True)
     rule_id = Column(Integer, ForeignKey("rules.id"))
-    input_data = Column(JSON, nullable=False)
+    input_hash = Column(LargeBinary)
+    # Only set on rows written before inputs were stored by hash, until
+    # compaction moves them to evaluation_inputs
+    input_data = Column(JSON)
     result = Column(Boolean, nullable=False)
     evaluated_at = Column(DateTime, default=datetime.now)
+    # Version of the rule that produced the result (None for older rows)
+    rule_version = Column(Integer)
+    
+    rule = relationship("Rule", back_populates="evaluations")
+    
+    # History listings, time windows and exports scan one rule in
+    # (evaluated_at, id) order
+    __table_args__ = (
+        Index("idx_rule_evaluations_rule_time", "rule_id", "evaluated_at", "id"),
+    )
+
+class ArchivedRuleEvaluation(Base):
+    __tablename__ = "rule_evaluations_archive"
+    
+    # Evaluations moved out of rule_evaluations by compaction once they are
+    # older than HISTORY_ARCHIVE_AFTER_DAYS; ids are kept, and reads treat
+    # both tables as one history
+    id = Column(Integer, primary_key=True)
+    rule_id = Column(Integer, ForeignKey("rules.id"))
+    input_hash = Column(LargeBinary, nullable=False)
+    result = Column(Boolean, nullable=False)
+    evaluated_at = Column(DateTime)
+    rule_version = Column(Integer)
+    
+    __table_args__ = (
+        Index("idx_rule_evaluations_archive_rule_time", "rule_id", "evaluated_at", "id"),
+    )
+
+class RuleEvaluationRollup(Base):
+    __tablename__ = "rule_evaluation_rollups"
+    
+    # Evaluation counts of one rule version over one minute (granularity
+    # 60) or hour (3600), maintained by rollups.RollupWriter and
+    # rollups.RollupBackfill. rule_version is 0 for history rows recorded
+    # without one. latency is an encoded rollups.LatencySketch.
+    rule_id = Column(Integer, primary_key=True)
+    granularity = Column(Integer, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    rule_version = Column(Integer, primary_key=True)
+    evaluations = Column(Integer, nullable=False, default=0)
+    true_count = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    latency = Column(LargeBinary)
+
+class RuleRollupBackfill(Base):
+    __tablename__ = "rule_evaluation_rollup_backfill"
     
-    rule = relationship("Rule", back_populates="evaluations")
\ No newline at end of file
+    # Progress of the rollup backfill for one rule: history evaluated before
+    # `until` (when rollups were first written) and at or after `position`
+    # has been added to the rollups. The row with rule_id 0 records `until`.
+    rule_id = Column(Integer, primary_key=True)
+    until = Column(DateTime, nullable=False)
+    position = Column(DateTime, nullable=False)
@@ -0,0 +1,403 @@
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+from .schemas import NodeBase
+from .parser import Operator, NodeType
+from .compact import constant_key
+from .compiler import LOGICAL_OPERATORS, flatten_logical, render_node
+from .evaluator import RuleEvaluator
+from .fields import RecordSchema
+
+# operator -> whether the bound is inclusive
+_LOWER = {Operator.GT.value: False, Operator.GTE.value: True}
+_UPPER = {Operator.LT.value: False, Operator.LTE.value: True}
+_MEMBERSHIP = (Operator.EQ.value, Operator.IN.value)
+
+# (value, inclusive, the comparison it came from or None if synthesized)
+Bound = Tuple[Any, bool, Optional[NodeBase]]
+
+class Finding(NamedTuple):
+    # kind: contradiction, tautology, redundant, merged or unreachable
+    kind: str
+    expression: str
+    message: str
+
+def _kind(value: Any) -> Optional[str]:
+    # Bounds are only merged among mutually ordered constants (not bools or NaN)
+    if type(value) in (int, float) and value == value:
+        return "number"
+    if type(value) is str:
+        return "string"
+    return None
+
+def _members(node: NodeBase) -> List[Any]:
+    return node.value if node.operator == Operator.IN else [node.value]
+
+def _contains(values: List[Any], value: Any) -> bool:
+    # Equality, not hashing, so the result matches what '=' would do
+    return any(value == member for member in values)
+
+def _unique(values: List[Any]) -> List[Any]:
+    unique: List[Any] = []
+    for value in values:
+        if not _contains(unique, value):
+            unique.append(value)
+    return unique
+
+def _above(value: Any, bound: Bound) -> bool:
+    return value > bound[0] or (bound[1] and value == bound[0])
+
+def _below(value: Any, bound: Bound) -> bool:
+    return value < bound[0] or (bound[1] and value == bound[0])
+
+def _constant(value: bool) -> NodeBase:
+    return NodeBase(type=NodeType.CONSTANT.value, value=value)
+
+def _truth(node: NodeBase) -> Optional[bool]:
+    return bool(node.value) if node.type == NodeType.CONSTANT else None
+
+def _comparison(field: str, operator: str, value: Any) -> NodeBase:
+    return NodeBase(type=NodeType.COMPARISON.value, operator=operator, field=field, value=value)
+
+def _membership(field: str, values: List[Any]) -> NodeBase:
+    if len(values) == 1:
+        return _comparison(field, Operator.EQ.value, values[0])
+    return _comparison(field, Operator.IN.value, list(values))
+
+def _is_group(node: NodeBase, operator: Optional[str] = None) -> bool:
+    return node.type == NodeType.OPERATOR and node.operator in LOGICAL_OPERATORS \
+        and node.left is not None and node.right is not None \
+        and (operator is None or node.operator == operator)
+
+def _render(nodes: List[NodeBase], operator: str) -> str:
+    if len(nodes) == 1:
+        return render_node(nodes[0])
+    return f"({f' {operator} '.join(render_node(node) for node in nodes)})"
+
+def count_nodes(node: NodeBase) -> int:
+    count = 0
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        count += 1
+        if current.left is not None:
+            stack.append(current.left)
+        if current.right is not None:
+            stack.append(current.right)
+    return count
+
+class RuleOptimizer:
+    # Simplifies a rule tree before it is stored. Within each flattened
+    # AND/OR group: duplicate operands are dropped, comparisons on the same
+    # field are merged into at most one lower bound, one upper bound and one
+    # '='/IN test, groups decided by a constant operand are folded, and
+    # operands absorbed by a sibling (A AND (A OR B)) are removed. Every
+    # change is recorded in findings.
+    #
+    # Folding only changes results for records that would have failed the
+    # original rule (missing fields, incomparable types): those now get the
+    # folded result instead of an error.
+    def __init__(self, schema: Optional[RecordSchema] = None):
+        # Null fails every comparison on a nullable field, so covering the
+        # whole range of such a field is not a tautology
+        self.nullable = frozenset(
+            spec.name for spec in schema.fields if spec.nullable
+        ) if schema is not None else frozenset()
+        self.findings: List[Finding] = []
+        # id -> (node, key); the node is held so its id is not reused
+        self._keys: Dict[int, Tuple[NodeBase, Hashable]] = {}
+
+    def optimize(self, node: NodeBase) -> NodeBase:
+        return self._visit(node)
+
+    def _report(self, kind: str, expression: str, message: str) -> None:
+        self.findings.append(Finding(kind, expression, message))
+
+    def _key(self, node: NodeBase) -> Hashable:
+        # Structural identity: operand order within a group does not matter
+        entry = self._keys.get(id(node))
+        if entry is not None:
+            return entry[1]
+        if _is_group(node):
+            key = (node.operator, frozenset(self._key(child) for child in flatten_logical(node)))
+        elif node.type == NodeType.COMPARISON and node.operator == Operator.IN and isinstance(node.value, list):
+            key = ("in", node.field, frozenset(constant_key(value) for value in node.value))
+        elif node.type == NodeType.COMPARISON:
+            key = ("comparison", node.field, node.operator, constant_key(node.value))
+        elif node.type == NodeType.CONSTANT:
+            key = ("constant", bool(node.value))
+        else:
+            key = ("opaque", id(node))
+        self._keys[id(node)] = (node, key)
+        return key
+
+    def _visit(self, node: NodeBase) -> NodeBase:
+        if _is_group(node):
+            return self._group(node)
+        if node.type == NodeType.COMPARISON and node.operator == Operator.IN and isinstance(node.value, list):
+            values = _unique(node.value)
+            if not values:
+                self._report("contradiction", render_node(node), "empty set can never match")
+                return _constant(False)
+            if len(values) == 1 or len(values) != len(node.value):
+                return _membership(node.field, values)
+        return node
+
+    def _group(self, node: NodeBase) -> NodeBase:
+        operator = node.operator
+        # The constant that decides the group on its own (FALSE for AND,
+        # TRUE for OR); the other one is the identity
+        decisive = operator == Operator.OR
+        operands = flatten_logical(node)
+
+        children: List[NodeBase] = []
+        for operand in operands:
+            child = self._visit(operand)
+            truth = _truth(child)
+            if truth is not None and truth != decisive:
+                if decisive:
+                    self._report("unreachable", render_node(operand), "branch can never be true")
+                else:
+                    self._report("redundant", render_node(operand), "operand is always true")
+            elif _is_group(child, operator):
+                children.extend(flatten_logical(child))
+            else:
+                children.append(child)
+
+        children = self._deduplicate(children)
+        children = self._merge_fields(children, operator)
+
+        for index, child in enumerate(children):
+            if _truth(child) == decisive:
+                for other, sibling in enumerate(children):
+                    if other != index:
+                        self._report(
+                            "unreachable", render_node(sibling),
+                            f"never affects the result: the {operator} is always {str(decisive).upper()}"
+                        )
+                return _constant(decisive)
+
+        children = self._absorb(children, operator)
+        if not children:
+            return _constant(not decisive)
+        if len(children) == 1:
+            return children[0]
+        if len(children) == len(operands) and all(child is operand for child, operand in zip(children, operands)):
+            return node
+        return RuleEvaluator._create_balanced_tree(children, operator)
+
+    def _deduplicate(self, children: List[NodeBase]) -> List[NodeBase]:
+        seen = set()
+        unique = []
+        for child in children:
+            key = self._key(child)
+            if key in seen:
+                self._report("redundant", render_node(child), "duplicate operand")
+                continue
+            seen.add(key)
+            unique.append(child)
+        return unique
+
+    def _merge_fields(self, children: List[NodeBase], operator: str) -> List[NodeBase]:
+        by_field: Dict[str, List[int]] = {}
+        for index, child in enumerate(children):
+            if child.type == NodeType.COMPARISON and isinstance(child.field, str) \
+                    and (child.operator in _LOWER or child.operator in _UPPER or child.operator in _MEMBERSHIP):
+                by_field.setdefault(child.field, []).append(index)
+
+        replaced: Dict[int, List[NodeBase]] = {}
+        for field, field_indexes in by_field.items():
+            for indexes in self._merge_groups(children, field_indexes, operator):
+                nodes = [children[index] for index in indexes]
+                if len(nodes) < 2 or not self._mergeable(nodes):
+                    continue
+                if operator == Operator.AND:
+                    merged = self._merge_and(field, nodes)
+                else:
+                    merged = self._merge_or(field, nodes)
+                # Kept comparisons stay in their original order
+                order = {id(node): position for position, node in enumerate(nodes)}
+                merged.sort(key=lambda node: order.get(id(node), len(nodes)))
+                self._report_merge(nodes, merged, operator)
+                for index in indexes:
+                    replaced[index] = []
+                replaced[indexes[0]] = merged
+
+        if not replaced:
+            return children
+        result: List[NodeBase] = []
+        for index, child in enumerate(children):
+            result.extend(replaced.get(index, (child,)))
+        return result
+
+    @staticmethod
+    def _merge_groups(children: List[NodeBase], indexes: List[int], operator: str) -> List[List[int]]:
+        # The merged comparisons take the place of the first one. '='/IN
+        # never fail on a value of another type but bounds do, so in an OR
+        # whose first comparison on the field is '='/IN the bounds cannot
+        # move ahead of the operands in between: the two kinds are merged
+        # separately, each at its own first position.
+        if operator == Operator.OR and children[indexes[0]].operator in _MEMBERSHIP:
+            bounds = [index for index in indexes if children[index].operator not in _MEMBERSHIP]
+            if bounds:
+                return [[index for index in indexes if children[index].operator in _MEMBERSHIP], bounds]
+        return [indexes]
+
+    @staticmethod
+    def _mergeable(nodes: List[NodeBase]) -> bool:
+        ranged = False
+        kinds = set()
+        for node in nodes:
+            if node.operator == Operator.IN and not isinstance(node.value, list):
+                return False
+            if node.operator in _LOWER or node.operator in _UPPER:
+                ranged = True
+            kinds.update(_kind(value) for value in _members(node))
+        # '='/IN alone only need equality; bounds need one ordered kind
+        return not ranged or (len(kinds) == 1 and None not in kinds)
+
+    def _report_merge(self, nodes: List[NodeBase], merged: List[NodeBase], operator: str) -> None:
+        if len(merged) == 1 and _truth(merged[0]) is not None:
+            return  # reported as a contradiction or tautology
+        originals = {id(node) for node in nodes}
+        if any(id(node) not in originals for node in merged):
+            self._report("merged", _render(nodes, operator), f"simplified to {_render(merged, operator)}")
+            return
+        kept = {id(node) for node in merged}
+        reason = "implied by" if operator == Operator.AND else "covered by"
+        for node in nodes:
+            if id(node) not in kept:
+                self._report("redundant", render_node(node), f"{reason} {_render(merged, operator)}")
+
+    def _merge_and(self, field: str, nodes: List[NodeBase]) -> List[NodeBase]:
+        # Tightest bounds, intersection of the allowed values
+        lower: Optional[Bound] = None
+        upper: Optional[Bound] = None
+        allowed: Optional[List[Any]] = None
+        source: Optional[NodeBase] = None
+        for node in nodes:
+            if node.operator in _LOWER:
+                bound = (node.value, _LOWER[node.operator], node)
+                if lower is None or bound[0] > lower[0] or (bound[0] == lower[0] and not bound[1]):
+                    lower = bound
+            elif node.operator in _UPPER:
+                bound = (node.value, _UPPER[node.operator], node)
+                if upper is None or bound[0] < upper[0] or (bound[0] == upper[0] and not bound[1]):
+                    upper = bound
+            elif allowed is None:
+                allowed, source = _members(node), node
+            else:
+                allowed, source = [value for value in allowed if _contains(_members(node), value)], None
+
+        if allowed is not None:
+            values = [
+                value for value in allowed
+                if (lower is None or _above(value, lower)) and (upper is None or _below(value, upper))
+            ]
+            if not values:
+                return [self._contradiction(nodes)]
+            if source is not None and len(values) == len(allowed):
+                return [source]
+            return [_membership(field, values)]
+
+        if lower is not None and upper is not None:
+            if lower[0] > upper[0] or (lower[0] == upper[0] and not (lower[1] and upper[1])):
+                return [self._contradiction(nodes)]
+            if lower[0] == upper[0]:
+                return [_comparison(field, Operator.EQ.value, lower[0])]
+        return [bound[2] for bound in (lower, upper) if bound is not None]
+
+    def _merge_or(self, field: str, nodes: List[NodeBase]) -> List[NodeBase]:
+        # Loosest bounds, union of the allowed values minus those a bound covers
+        lower: Optional[Bound] = None
+        upper: Optional[Bound] = None
+        values: List[Any] = []
+        sources: List[NodeBase] = []
+        for node in nodes:
+            if node.operator in _LOWER:
+                bound = (node.value, _LOWER[node.operator], node)
+                if lower is None or bound[0] < lower[0] or (bound[0] == lower[0] and bound[1]):
+                    lower = bound
+            elif node.operator in _UPPER:
+                bound = (node.value, _UPPER[node.operator], node)
+                if upper is None or bound[0] > upper[0] or (bound[0] == upper[0] and bound[1]):
+                    upper = bound
+            else:
+                sources.append(node)
+                values.extend(value for value in _members(node) if not _contains(values, value))
+
+        remaining = []
+        for value in values:
+            if (lower is not None and _above(value, lower)) or (upper is not None and _below(value, upper)):
+                continue
+            # x > 5 OR x = 5 is x >= 5
+            if lower is not None and value == lower[0]:
+                lower = (value, True, None)
+            elif upper is not None and value == upper[0]:
+                upper = (value, True, None)
+            else:
+                remaining.append(value)
+
+        # NaN fails every comparison, so only string ranges can cover every value
+        if lower is not None and upper is not None and field not in self.nullable and _kind(lower[0]) == "string" \
+                and (lower[0] < upper[0] or (lower[0] == upper[0] and (lower[1] or upper[1]))):
+            self._report("tautology", _render(nodes, Operator.OR.value), "always true")
+            return [_constant(True)]
+
+        merged = []
+        if lower is not None:
+            merged.append(lower[2] or _comparison(field, Operator.GTE.value if lower[1] else Operator.GT.value, lower[0]))
+        if upper is not None:
+            merged.append(upper[2] or _comparison(field, Operator.LTE.value if upper[1] else Operator.LT.value, upper[0]))
+        if remaining:
+            if len(sources) == 1 and len(remaining) == len(_members(sources[0])):
+                merged.append(sources[0])
+            else:
+                merged.append(_membership(field, remaining))
+        return merged
+
+    def _contradiction(self, nodes: List[NodeBase]) -> NodeBase:
+        self._report("contradiction", _render(nodes, Operator.AND.value), "can never be true")
+        return _constant(False)
+
+    def _absorb(self, children: List[NodeBase], operator: str) -> List[NodeBase]:
+        # A AND (A OR B) is A, and A OR (A AND B) is A. Operands run left to
+        # right and a missing field raises, so the group is only dropped when
+        # that cannot turn a result into an error: if A comes first (the
+        # group is only reached once A has not decided), or if A is the
+        # group's first operand, in which case A moves to the group's place
+        # (the group evaluated A first anyway). An A after the group's own
+        # first operand may never have been evaluated, so that group stays.
+        inner = Operator.OR.value if operator == Operator.AND else Operator.AND.value
+        if not any(_is_group(child, inner) for child in children):
+            return children
+        slots: List[Optional[NodeBase]] = list(children)
+        keys = [self._key(child) for child in children]
+        for index, child in enumerate(children):
+            if slots[index] is not child or not _is_group(child, inner):
+                continue
+            operands = flatten_logical(child)
+            operand_keys = {self._key(operand) for operand in operands}
+            absorber = next(
+                (slots[other] for other in range(index) if slots[other] is not None and keys[other] in operand_keys),
+                None
+            )
+            moved = None
+            if absorber is None:
+                first = self._key(operands[0])
+                moved = next(
+                    (other for other in range(index + 1, len(slots)) if slots[other] is not None and keys[other] == first),
+                    None
+                )
+                if moved is None:
+                    continue
+                absorber = slots[moved]
+            self._report("redundant", render_node(child), f"absorbed by {render_node(absorber)}")
+            if moved is None:
+                slots[index] = None
+            else:
+                slots[index], keys[index] = absorber, keys[moved]
+                slots[moved] = None
+        return [slot for slot in slots if slot is not None]
+
+def optimize_rule(node: NodeBase, schema: Optional[RecordSchema] = None) -> Tuple[NodeBase, List[Finding]]:
+    optimizer = RuleOptimizer(schema)
+    return optimizer.optimize(node), optimizer.findings
@@ -0,0 +1,42 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Cursors are opaque to clients: base64url of the last row's sort key
+
+def _encode(payload: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def _decode(cursor: str) -> list:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, list):
+        raise ValueError("Invalid cursor")
+    return payload
+
+def encode_rule_cursor(rule_id: int) -> str:
+    return _encode([rule_id])
+
+def decode_rule_cursor(cursor: str) -> int:
+    payload = _decode(cursor)
+    if len(payload) != 1 or not isinstance(payload[0], int):
+        raise ValueError("Invalid cursor")
+    return payload[0]
+
+def encode_evaluation_cursor(evaluated_at: Optional[datetime], evaluation_id: int) -> str:
+    return _encode([evaluated_at.isoformat() if evaluated_at else None, evaluation_id])
+
+def decode_evaluation_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    payload = _decode(cursor)
+    if len(payload) != 2 or not isinstance(payload[1], int):
+        raise ValueError("Invalid cursor")
+    try:
+        evaluated_at = datetime.fromisoformat(payload[0]) if payload[0] is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    return evaluated_at, payload[1]
@@ -1,11 +1,18 @@
 from enum import Enum
-from typing import List, Tuple, Optional, Any
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Tuple
 from .schemas import NodeBase
 import re
+import threading
+
+if TYPE_CHECKING:
+    from .fields import RecordSchema
 
 class NodeType(str, Enum):
     OPERATOR = "operator"
     COMPARISON = "comparison"
+    # Produced by the optimizer only; not part of the rule language
+    CONSTANT = "constant"
 
 class Operator(str, Enum):
     AND = "AND"
@@ -15,93 +22,203 @@ class Operator(str, Enum):
     EQ = "="
     GTE = ">="
     LTE = "<="
-    
+    # Set membership (value is a list), produced by the optimizer
+    IN = "IN"
+
+class TokenType(str, Enum):
+    COMPARATOR = "comparator"
+    KEYWORD = "keyword"
+    OPEN = "open"
+    CLOSE = "close"
+    STRING = "string"
+    # Field names and unquoted values
+    WORD = "word"
+    # A lone quote: an unterminated string literal
+    QUOTE = "quote"
+
+class Token(NamedTuple):
+    type: TokenType
+    text: str
+    # Character offset in the rule string
+    position: int
+
+# One group per token type, in _GROUP_TYPES order; AND/OR are keywords only
+# as whole words. finditer skips what matches no group, and every non-space
+# character starts some alternative (a lone quote is the last one), so only
+# whitespace is skipped.
+TOKEN_PATTERN = re.compile(
+    r"(>=|<=|[<>=])|(\()|(\))|('[^']*')|((?:AND|OR)(?![^\s()'<>=]))|([^\s()'<>=]+)|(')"
+)
+_GROUP_TYPES = (
+    None,
+    TokenType.COMPARATOR,
+    TokenType.OPEN,
+    TokenType.CLOSE,
+    TokenType.STRING,
+    TokenType.KEYWORD,
+    TokenType.WORD,
+    TokenType.QUOTE
+)
+COMPARATORS = frozenset((
+    Operator.GT.value, Operator.LT.value, Operator.EQ.value, Operator.GTE.value, Operator.LTE.value
+))
+OPERANDS = frozenset((TokenType.STRING, TokenType.WORD))
+
+_OPERATOR_NODE = NodeType.OPERATOR.value
+_COMPARISON_NODE = NodeType.COMPARISON.value
+_AND = Operator.AND.value
+_OR = Operator.OR.value
+
+class _Frame:
+    # One parenthesis level: finished OR terms and the AND run being built
+    __slots__ = ("or_terms", "and_terms", "open_position")
+
+    def __init__(self, open_position: int):
+        self.or_terms: List[NodeBase] = []
+        self.and_terms: List[NodeBase] = []
+        self.open_position = open_position
+
+def _balanced(nodes: List[NodeBase], operator: str, start: int = 0, end: Optional[int] = None) -> NodeBase:
+    # Same operand order as a left-to-right chain, but log(n) deep
+    if end is None:
+        end = len(nodes)
+    if end - start == 1:
+        return nodes[start]
+    mid = (start + end) // 2
+    return NodeBase(
+        type=_OPERATOR_NODE,
+        operator=operator,
+        left=_balanced(nodes, operator, start, mid),
+        right=_balanced(nodes, operator, mid, end)
+    )
+
 class RuleParser:
-    def __init__(self):
+    def __init__(self, cache_size: int = 4096):
         self.operators = {op.value for op in Operator}
-        
-    def tokenize(self, rule_string: str) -> List[str]:
-        # Replace parentheses with spaces around them
-        for char in '()':
-            rule_string = rule_string.replace(char, f' {char} ')
-            
-        # Handle string literals properly
-        tokens = []
-        current_token = ''
-        in_string = False
-        
-        for char in rule_string:
-            if char == "'":
-                in_string = not in_string
-                current_token += char
-            elif char.isspace() and not in_string:
-                if current_token:
-                    tokens.append(current_token)
-                    current_token = ''
-            else:
-                current_token += char
-                
-        if current_token:
-            tokens.append(current_token)
-            
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, ...], NodeBase]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tokenize(self, rule_string: str) -> List[Token]:
+        # Single pass with one precompiled pattern
+        tokens = [
+            Token(_GROUP_TYPES[match.lastindex], match.group(), match.start())
+            for match in TOKEN_PATTERN.finditer(rule_string)
+        ]
+        # String literals take quotes in pairs, so a lone one leaves an odd count
+        if rule_string.count("'") % 2:
+            position = next(token.position for token in tokens if token.type is TokenType.QUOTE)
+            raise ValueError(f"Unterminated string literal at position {position}")
         return tokens
-    
-    def parse_comparison(self, tokens: List[str], index: int) -> Tuple[NodeBase, int]:
-        field = tokens[index]
-        operator = tokens[index + 1]
-        value = tokens[index + 2]
-        
-        # Handle string literals
-        if value.startswith("'") and value.endswith("'"):
-            value = value[1:-1]  # Remove quotes
-        else:
-            # Try to convert to number
+
+    def parse_value(self, token: Token):
+        # Quoted literals are strings; otherwise try int, then float
+        if token.type == TokenType.STRING:
+            return token.text[1:-1]
+        try:
+            return int(token.text)
+        except ValueError:
             try:
-                value = int(value)
+                return float(token.text)
             except ValueError:
-                try:
-                    value = float(value)
-                except ValueError:
-                    pass
-        
+                return token.text
+
+    def parse_comparison(self, tokens: List[Token], index: int) -> Tuple[NodeBase, int]:
+        if index + 2 >= len(tokens):
+            raise ValueError("Unexpected end of expression")
+        field, operator, value = tokens[index], tokens[index + 1], tokens[index + 2]
+        if operator.type != TokenType.COMPARATOR:
+            raise ValueError(
+                f"Expected a comparison operator after {field.text!r} at position {operator.position}, "
+                f"got {operator.text!r}"
+            )
+        if value.type not in OPERANDS:
+            raise ValueError(
+                f"Expected a value after {field.text!r} {operator.text} at position {value.position}, "
+                f"got {value.text!r}"
+            )
+
         return NodeBase(
-            type=NodeType.COMPARISON,
-            operator=operator,
-            field=field,
-            value=value
+            type=_COMPARISON_NODE,
+            operator=operator.text,
+            field=field.text,
+            value=self.parse_value(value)
         ), index + 3
-    
-    def parse_expression(self, tokens: List[str], index: int = 0) -> Tuple[NodeBase, int]:
-        if tokens[index] == '(':
-            left_node, index = self.parse_expression(tokens, index + 1)
-            
-            if index >= len(tokens):
-                raise ValueError("Unexpected end of expression")
-            
-            operator = tokens[index]
-            if operator not in self.operators:
-                raise ValueError(f"Invalid operator: {operator}")
-            
+
+    def parse_expression(self, tokens: List[Token], index: int = 0) -> Tuple[NodeBase, int]:
+        # Iterative precedence parsing: AND binds tighter than OR, chains
+        # need no parentheses and nesting depth is bounded only by memory.
+        # Each '(' pushes a frame instead of recursing.
+        frames = [_Frame(-1)]
+        expect_operand = True
+        while index < len(tokens):
+            token = tokens[index]
+            if expect_operand:
+                if token.type == TokenType.OPEN:
+                    frames.append(_Frame(token.position))
+                    index += 1
+                elif token.type not in OPERANDS:
+                    raise ValueError(f"Expected a comparison or '(' at position {token.position}, got {token.text!r}")
+                else:
+                    node, index = self.parse_comparison(tokens, index)
+                    frames[-1].and_terms.append(node)
+                    expect_operand = False
+                continue
+
+            if token.type == TokenType.KEYWORD and token.text == _AND:
+                expect_operand = True
+            elif token.type == TokenType.KEYWORD and token.text == _OR:
+                frame = frames[-1]
+                frame.or_terms.append(_balanced(frame.and_terms, _AND))
+                frame.and_terms = []
+                expect_operand = True
+            elif token.type == TokenType.CLOSE:
+                if len(frames) == 1:
+                    break
+                node = self._close(frames.pop())
+                frames[-1].and_terms.append(node)
+            else:
+                raise ValueError(f"Invalid operator at position {token.position}: {token.text}")
             index += 1
-            right_node, index = self.parse_expression(tokens, index)
-            
-            if index >= len(tokens) or tokens[index] != ')':
-                raise ValueError("Missing closing parenthesis")
-            
-            return NodeBase(
-                type=NodeType.OPERATOR,
-                operator=operator,
-                left=left_node,
-                right=right_node
-            ), index + 1
-        else:
-            return self.parse_comparison(tokens, index)
-    
-    def create_rule(self, rule_string: str) -> NodeBase:
+
+        if expect_operand:
+            raise ValueError("Unexpected end of expression")
+        if len(frames) > 1:
+            raise ValueError(f"Missing closing parenthesis for '(' at position {frames[-1].open_position}")
+        return self._close(frames[0]), index
+
+    @staticmethod
+    def _close(frame: _Frame) -> NodeBase:
+        if not frame.or_terms and len(frame.and_terms) == 1:
+            return frame.and_terms[0]
+        frame.or_terms.append(_balanced(frame.and_terms, _AND))
+        return _balanced(frame.or_terms, _OR)
+
+    def create_rule(self, rule_string: str, schema: Optional["RecordSchema"] = None) -> NodeBase:
+        # Parsed trees are cached by their token sequence (so whitespace
+        # differences share an entry) and shared between callers, so they
+        # must be treated as read-only. With a schema, fields and constants
+        # are checked and constants converted to the declared types.
         tokens = self.tokenize(rule_string)
+        key = tuple(token.text for token in tokens)
+        with self._lock:
+            node = self._cache.get(key)
+            if node is not None:
+                self._cache.move_to_end(key)
+        if node is None:
+            node = self._parse(tokens, key)
+        return node if schema is None else schema.bind(node)
+
+    def _parse(self, tokens: List[Token], key: Tuple[str, ...]) -> NodeBase:
+
         node, index = self.parse_expression(tokens)
-        
+
         if index < len(tokens):
-            raise ValueError("Unexpected tokens after expression")
-            
-        return node
\ No newline at end of file
+            raise ValueError(f"Unexpected tokens after expression at position {tokens[index].position}")
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[key] = node
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return node
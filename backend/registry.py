@@ -0,0 +1,310 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from . import models
+
+# Layout of the registry file: a fixed header followed by an append-only
+# log of records. The header holds a magic number, the pid of the process
+# that owns this set of workers (their parent), a generation counter bumped
+# by every write, the end offset of the log, a flag set once the file has
+# been replaced by a compacted copy, and the next free evaluation id.
+_MAGIC = b"RULEREG1"
+_HEADER = struct.Struct("<8sqQQQQ")
+_GENERATION = struct.Struct("<Q")
+_GENERATION_AT = 16
+_DATA_START = 64
+# generation, writer pid (0 for snapshots), kind, object id, JSON and blob sizes
+_RECORD = struct.Struct("<QqBqII")
+
+RULE = 1
+DELETE = 2
+SCHEMA = 3
+
+class RegistryRecord(NamedTuple):
+    kind: int
+    object_id: int
+    data: Optional[Dict[str, Any]]
+    blob: Optional[bytes]
+
+def _timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+def _datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+def rule_record(rule: models.Rule) -> RegistryRecord:
+    return RegistryRecord(RULE, rule.id, {
+        "name": rule.name,
+        "description": rule.description,
+        "rule_string": rule.rule_string,
+        "ast_json": rule.ast_json,
+        "created_at": _timestamp(rule.created_at),
+        "updated_at": _timestamp(rule.updated_at),
+        "version": rule.version,
+        "schema_id": rule.schema_id,
+    }, rule.ast_blob)
+
+def schema_record(db_schema: models.RuleSchema) -> RegistryRecord:
+    return RegistryRecord(SCHEMA, db_schema.id, {
+        "name": db_schema.name,
+        "fields": db_schema.fields,
+        "created_at": _timestamp(db_schema.created_at),
+    }, None)
+
+def to_rule(record: RegistryRecord) -> models.Rule:
+    # Transient row (never added to a session) to build cache snapshots from
+    data = record.data
+    return models.Rule(
+        id=record.object_id,
+        name=data["name"],
+        description=data["description"],
+        rule_string=data["rule_string"],
+        ast_json=data["ast_json"],
+        ast_blob=record.blob,
+        created_at=_datetime(data["created_at"]),
+        updated_at=_datetime(data["updated_at"]),
+        version=data["version"],
+        schema_id=data["schema_id"],
+    )
+
+def to_schema(record: RegistryRecord) -> models.RuleSchema:
+    data = record.data
+    return models.RuleSchema(
+        id=record.object_id, name=data["name"], fields=data["fields"], created_at=_datetime(data["created_at"])
+    )
+
+def _encode(record: RegistryRecord, generation: int, pid: int) -> bytes:
+    data = json.dumps(record.data, separators=(",", ":")).encode("utf-8") if record.data is not None else b""
+    blob = record.blob or b""
+    return _RECORD.pack(generation, pid, record.kind, record.object_id, len(data), len(blob)) + data + blob
+
+class SharedRegistry:
+    # Rule definitions shared by the worker processes of one server through
+    # a memory-mapped file (put it on tmpfs, e.g. /dev/shm). Every worker
+    # maps the same pages, so the registry costs its size once however many
+    # workers there are.
+    #
+    # Writers append a record (rule version, deletion or schema) under an
+    # exclusive flock and then bump the generation counter. Readers compare
+    # the counter with the last one they saw, a single 8-byte read, and on a
+    # change replay only the records appended since. When the log is full
+    # the writer rewrites it as a snapshot of the latest record per object
+    # into a new file and flags the old one, which makes readers re-map and
+    # reload everything from the snapshot.
+    #
+    # The file is tied to the parent process (the uvicorn master): workers
+    # of a later server start find a different owner and seed it anew.
+    def __init__(self, path: str, capacity: int = 64 * 2**20):
+        self.path = path
+        self.capacity = max(capacity, 4096)
+        self._owner = os.getppid()
+        self._pid = os.getpid()
+        self._map: Optional[mmap.mmap] = None
+        self._offset = _DATA_START
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def size(self) -> int:
+        return len(self._map) if self._map is not None else 0
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        # Serializes writers across processes (and threads of this one)
+        with self._lock:
+            fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def exclusive(self, name: str) -> Iterator[bool]:
+        # Non-blocking: yields False if another process holds `name`
+        fd = os.open(f"{self.path}.{name}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+            else:
+                yield True
+        finally:
+            os.close(fd)
+
+    def _header(self) -> Tuple[bytes, int, int, int, int, int]:
+        return _HEADER.unpack_from(self._map, 0)
+
+    def _set_header(self, generation: int, end: int, next_id: int) -> None:
+        # The end offset is written before the generation readers check
+        magic, owner, current, _, rotated, _ = self._header()
+        _HEADER.pack_into(self._map, 0, magic, owner, current, end, rotated, next_id)
+        _GENERATION.pack_into(self._map, _GENERATION_AT, generation)
+
+    def _map_file(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            size = os.fstat(fd).st_size
+            if size < _DATA_START:
+                return False
+            mapped = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        if self._map is not None:
+            self._map.close()
+        self._map = mapped
+        return True
+
+    def attach(self) -> bool:
+        # Maps the current file; False if there is none for this server.
+        # Call with the lock held, and seed() when this returns False.
+        while self._map_file():
+            magic, owner, _, _, rotated, _ = self._header()
+            if magic != _MAGIC or owner != self._owner:
+                return False
+            if not rotated:
+                self._offset = _DATA_START
+                self._generation = 0
+                return True
+        return False
+
+    def seed(self, records: Iterable[RegistryRecord], next_id: int = 0) -> None:
+        # Replaces the registry with these records; call with the lock held
+        self._replace([_encode(record, 1, 0) for record in records], 1, next_id)
+        self._offset = _DATA_START
+        self._generation = 0
+
+    def _replace(self, encoded: List[bytes], generation: int, next_id: int) -> None:
+        size = sum(len(record) for record in encoded)
+        capacity = self.capacity
+        while _DATA_START + 2 * size > capacity:
+            capacity *= 2
+        path = f"{self.path}.{self._pid}.tmp"
+        with open(path, "wb") as out:
+            out.write(_HEADER.pack(_MAGIC, self._owner, generation, _DATA_START + size, 0, next_id))
+            out.seek(_DATA_START)
+            for record in encoded:
+                out.write(record)
+            out.truncate(capacity)
+        os.replace(path, self.path)
+        old = self._map
+        self._map = None
+        if old is not None:
+            # Readers still mapping the old file reload from the new one
+            _, _, old_generation, end, _, _ = _HEADER.unpack_from(old, 0)
+            _HEADER.pack_into(old, 0, _MAGIC, self._owner, old_generation, end, 1, next_id)
+            _GENERATION.pack_into(old, _GENERATION_AT, old_generation + 1)
+            old.close()
+        self._map_file()
+
+    def _records(self, start: int, end: int, skip_own: bool) -> List[Tuple[int, RegistryRecord]]:
+        found = []
+        offset = start
+        view = self._map
+        while offset < end:
+            generation, pid, kind, object_id, data_size, blob_size = _RECORD.unpack_from(view, offset)
+            offset += _RECORD.size
+            data = json.loads(view[offset:offset + data_size]) if data_size else None
+            offset += data_size
+            blob = view[offset:offset + blob_size] if blob_size else None
+            offset += blob_size
+            if not (skip_own and pid == self._pid):
+                found.append((generation, RegistryRecord(kind, object_id, data, blob)))
+        return found
+
+    def publish(self, record: RegistryRecord) -> None:
+        if self._map is None:
+            return
+        with self.locked():
+            self._follow()
+            _, _, generation, end, _, next_id = self._header()
+            encoded = _encode(record, generation + 1, self._pid)
+            if end + len(encoded) <= len(self._map):
+                self._map[end:end + len(encoded)] = encoded
+                self._set_header(generation + 1, end + len(encoded), next_id)
+                return
+            # Full: keep the latest record per object, then append this one
+            latest: Dict[Tuple[int, int], RegistryRecord] = {}
+            for _, existing in self._records(_DATA_START, end, skip_own=False):
+                latest[(SCHEMA if existing.kind == SCHEMA else RULE, existing.object_id)] = existing
+            latest[(SCHEMA if record.kind == SCHEMA else RULE, record.object_id)] = record
+            self._replace(
+                [_encode(kept, generation + 1, 0) for kept in latest.values() if kept.kind != DELETE],
+                generation + 1,
+                next_id
+            )
+            # Records of other workers not seen yet are only in the snapshot
+            self._offset = _DATA_START
+            self._generation = 0
+
+    def _follow(self) -> bool:
+        # Re-maps after the file was replaced; True if it was. The offset
+        # pointed into the old file, so the next poll reloads the snapshot.
+        replaced = False
+        while self._header()[4]:
+            replaced = True
+            if not self._map_file():
+                break
+        if replaced:
+            self._offset = _DATA_START
+            self._generation = 0
+        return replaced
+
+    def poll(self) -> Optional[Tuple[List[RegistryRecord], bool]]:
+        # (records appended by other workers since the last poll, reset).
+        # With reset the records are a complete snapshot that replaces all
+        # earlier state. None when nothing changed.
+        view = self._map
+        if view is None or _GENERATION.unpack_from(view, _GENERATION_AT)[0] == self._generation:
+            return None
+        with self._lock:
+            self._follow()
+            reset = self._offset == _DATA_START
+            generation = _GENERATION.unpack_from(self._map, _GENERATION_AT)[0]
+            end = self._header()[3]
+            records = [record for _, record in self._records(self._offset, end, skip_own=not reset)]
+            self._offset = end
+            self._generation = generation
+            return records, reset
+
+    def allocate_ids(self, first_free: int, count: int) -> int:
+        # Reserves `count` consecutive evaluation ids, none below first_free,
+        # and returns the first
+        with self.locked():
+            self._follow()
+            _, _, generation, end, _, next_id = self._header()
+            start = max(next_id, first_free)
+            self._set_header(generation, end, start + count)
+            return start
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class RegistrySyncMiddleware:
+    # Applies registry changes before each request, so a change made through
+    # any worker is seen by the next request on every worker. Pure ASGI,
+    # like MetricsMiddleware; the check is one read of the mapped counter.
+    def __init__(self, app: Callable[..., Awaitable[None]], sync: Callable[[], None]):
+        self.app = app
+        self.sync = sync
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.sync()
+        await self.app(scope, receive, send)
@@ -0,0 +1,166 @@
+import logging
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import Callable, ContextManager, Dict, Optional
+from sqlalchemy import ColumnElement, Table, bindparam, delete, func, insert, null, select, text, union, update
+from sqlalchemy.engine import Engine
+from . import inputs, models
+
+logger = logging.getLogger(__name__)
+
+_LIVE = models.RuleEvaluation.__table__
+_ARCHIVE = models.ArchivedRuleEvaluation.__table__
+_INPUTS = models.EvaluationInput.__table__
+_ARCHIVED_COLUMNS = ("id", "rule_id", "input_hash", "result", "evaluated_at", "rule_version")
+
+class HistoryCompactor:
+    # Background maintenance of the evaluation history, run every
+    # interval_seconds on a thread of its own:
+    #   1. rows with an inline input_data (written before inputs were stored
+    #      by hash) get their input moved to evaluation_inputs;
+    #   2. rows older than archive_after_days move to the archive table;
+    #   3. rows older than retention_days are deleted from both tables, and
+    #      inputs no longer referenced by any row are dropped.
+    # Each step works in id order, batch_size rows per transaction, so
+    # writers are never blocked for long.
+    def __init__(
+        self,
+        engine: Engine,
+        archive_after_days: int = 30,
+        retention_days: int = 0,
+        interval_seconds: int = 3600,
+        batch_size: int = 5000,
+        exclusive: Optional[Callable[[], ContextManager[bool]]] = None
+    ):
+        self.engine = engine
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, batch_size)
+        # Yields whether this process may run a pass; with several workers
+        # only one of them compacts at a time
+        self.exclusive = exclusive or (lambda: nullcontext(True))
+        self.totals = {"migrated": 0, "archived": 0, "deleted": 0, "inputs_deleted": 0}
+        self.last_run: Optional[datetime] = None
+        # New rows never carry inline inputs, so one complete pass is enough
+        self._migrated = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Waits for a pass in progress to finish its current batch
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                with self.exclusive() as acquired:
+                    if acquired:
+                        self.run_once()
+            except Exception:
+                logger.exception("Evaluation history compaction failed")
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        now = now or datetime.now()
+        counts = {"migrated": 0, "archived": 0, "deleted": 0, "inputs_deleted": 0}
+        if not self._migrated:
+            counts["migrated"] = self._migrate()
+            self._migrated = not self._stop.is_set()
+        if self.archive_after_days > 0:
+            counts["archived"] = self._archive(now - timedelta(days=self.archive_after_days))
+        if self.retention_days > 0:
+            cutoff = now - timedelta(days=self.retention_days)
+            counts["deleted"] = self._expire(_LIVE, cutoff) + self._expire(_ARCHIVE, cutoff)
+            # Inputs can only become unreferenced when rows are deleted
+            if counts["deleted"]:
+                counts["inputs_deleted"] = self._collect_inputs()
+        for name, count in counts.items():
+            self.totals[name] += count
+        self.last_run = now
+        return counts
+
+    def _batch_end(self, table: Table, condition: ColumnElement) -> Optional[int]:
+        # Largest id among the next batch_size matching rows. It is read
+        # outside the write transaction, whose first statement then takes
+        # the write lock; rows matching a cutoff in the past are never added
+        # concurrently, so the id range still selects the same rows.
+        with self.engine.connect() as conn:
+            batch = select(table.c.id).where(condition).order_by(table.c.id).limit(self.batch_size).subquery()
+            return conn.execute(select(func.max(batch.c.id))).scalar()
+
+    def _migrate(self) -> int:
+        migrated = 0
+        while not self._stop.is_set():
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    select(_LIVE.c.id, _LIVE.c.input_data)
+                    .where(_LIVE.c.input_hash.is_(None))
+                    .order_by(_LIVE.c.id)
+                    .limit(self.batch_size)
+                ).all()
+            if not rows:
+                break
+            hashes, stored = inputs.encode_many(row.input_data for row in rows)
+            with self.engine.begin() as conn:
+                conn.execute(inputs.insert_inputs(conn.dialect.name), stored)
+                conn.execute(
+                    update(_LIVE)
+                    .where(_LIVE.c.id == bindparam("row_id"), _LIVE.c.input_hash.is_(None))
+                    .values(input_hash=bindparam("row_hash"), input_data=null()),
+                    [{"row_id": row.id, "row_hash": row_hash} for row, row_hash in zip(rows, hashes)]
+                )
+            migrated += len(rows)
+        return migrated
+
+    def _archive(self, cutoff: datetime) -> int:
+        archived = 0
+        condition = (_LIVE.c.evaluated_at < cutoff) & _LIVE.c.input_hash.is_not(None)
+        while not self._stop.is_set():
+            last_id = self._batch_end(_LIVE, condition)
+            if last_id is None:
+                break
+            batch = condition & (_LIVE.c.id <= last_id)
+            with self.engine.begin() as conn:
+                conn.execute(
+                    insert(_ARCHIVE).from_select(
+                        _ARCHIVED_COLUMNS, select(*(_LIVE.c[name] for name in _ARCHIVED_COLUMNS)).where(batch)
+                    )
+                )
+                archived += conn.execute(delete(_LIVE).where(batch)).rowcount
+        return archived
+
+    def _expire(self, table: Table, cutoff: datetime) -> int:
+        deleted = 0
+        condition = table.c.evaluated_at < cutoff
+        while not self._stop.is_set():
+            last_id = self._batch_end(table, condition)
+            if last_id is None:
+                break
+            with self.engine.begin() as conn:
+                deleted += conn.execute(delete(table).where(condition & (table.c.id <= last_id))).rowcount
+        return deleted
+
+    def _collect_inputs(self) -> int:
+        referenced = union(
+            select(_LIVE.c.input_hash).where(_LIVE.c.input_hash.is_not(None)),
+            select(_ARCHIVE.c.input_hash)
+        )
+        with self.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                # Writers insert an input before the row referencing it;
+                # without the lock a concurrent batch could reuse an input
+                # this statement is about to delete
+                conn.execute(text("LOCK TABLE evaluation_inputs IN SHARE ROW EXCLUSIVE MODE"))
+            return conn.execute(delete(_INPUTS).where(_INPUTS.c.hash.not_in(referenced))).rowcount
@@ -0,0 +1,442 @@
+import logging
+import math
+import struct
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Insert, Row, bindparam, delete, func, insert, select, union, union_all, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from . import models
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+GRANULARITIES = {"minute": MINUTE, "hour": HOUR}
+# Range answered when the request gives no start
+DEFAULT_SPANS = {MINUTE: timedelta(hours=1), HOUR: timedelta(days=1)}
+QUANTILES = (("latency_p50", 0.5), ("latency_p90", 0.9), ("latency_p99", 0.99))
+
+_TABLE = models.RuleEvaluationRollup.__table__
+_BACKFILL = models.RuleRollupBackfill.__table__
+_LIVE = models.RuleEvaluation.__table__
+_ARCHIVE = models.ArchivedRuleEvaluation.__table__
+_RULES = models.Rule.__table__
+_COUNTS = ("evaluations", "true_count", "error_count")
+_KEY_COLUMNS = ("rule_id", "granularity", "bucket_start", "rule_version")
+# Backfill row (no rule has id 0) holding when rollups were first written
+_SINCE = 0
+
+# (rule_id, granularity, bucket_start, rule_version)
+RollupKey = Tuple[int, int, datetime, int]
+
+def bucket_start(moment: datetime, width: int) -> datetime:
+    if width == HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+def local_time(moment: datetime) -> datetime:
+    # Evaluation timestamps are naive local times (datetime.now())
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo is not None else moment
+
+class LatencySketch:
+    # Mergeable latency histogram with logarithmic buckets, as in DDSketch:
+    # bucket i counts values in (GAMMA**(i-1), GAMMA**i], so a quantile is
+    # returned within RELATIVE_ACCURACY of the true value however many
+    # values were added. Encoded as (index, count) pairs; evaluation
+    # latencies from 0.1us to 10s span about 450 buckets at most.
+    RELATIVE_ACCURACY = 0.02
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    MIN_SECONDS = 1e-7
+    _LOG_GAMMA = math.log(GAMMA)
+    _PAIR = struct.Struct("<hQ")
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.counts: Dict[int, int] = counts or {}
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, seconds: float, count: int = 1) -> None:
+        index = math.ceil(math.log(max(seconds, self.MIN_SECONDS)) / self._LOG_GAMMA)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other: "LatencySketch") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                break
+        return 2 * self.GAMMA ** index / (self.GAMMA + 1)
+
+    def encode(self) -> bytes:
+        return b"".join(self._PAIR.pack(index, count) for index, count in sorted(self.counts.items()))
+
+    @classmethod
+    def decode(cls, blob: Optional[bytes]) -> "LatencySketch":
+        return cls({index: count for index, count in cls._PAIR.iter_unpack(blob)} if blob else None)
+
+class RollupCounts:
+    __slots__ = ("evaluations", "true_count", "error_count", "latency")
+
+    def __init__(self, evaluations: int = 0, true_count: int = 0, error_count: int = 0, latency: Optional[LatencySketch] = None):
+        self.evaluations = evaluations
+        self.true_count = true_count
+        self.error_count = error_count
+        self.latency = latency or LatencySketch()
+
+    def add(self, other: "RollupCounts") -> None:
+        self.evaluations += other.evaluations
+        self.true_count += other.true_count
+        self.error_count += other.error_count
+        self.latency.merge(other.latency)
+
+    def summary(self) -> Dict[str, Any]:
+        # The pass rate is over the evaluations that returned a result;
+        # latencies are only known for evaluations counted live
+        results = self.evaluations - self.error_count
+        summary = {
+            "evaluations": self.evaluations,
+            "true_count": self.true_count,
+            "error_count": self.error_count,
+            "pass_rate": self.true_count / results if results else None,
+        }
+        for name, q in QUANTILES:
+            summary[name] = self.latency.quantile(q)
+        return summary
+
+def _upsert(dialect: str) -> Insert:
+    # Counts of an existing bucket are added to, so concurrent writers
+    # (several workers, or a worker and the backfill) never lose updates
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(_TABLE)
+        return stmt.on_conflict_do_update(
+            index_elements=list(_TABLE.primary_key.columns),
+            set_={name: _TABLE.c[name] + stmt.excluded[name] for name in _COUNTS}
+        )
+    stmt = mysql.insert(_TABLE)
+    return stmt.on_duplicate_key_update({name: _TABLE.c[name] + stmt.inserted[name] for name in _COUNTS})
+
+def add_rollups(conn: Connection, deltas: Dict[RollupKey, RollupCounts]) -> None:
+    # Adds the deltas to their buckets in the caller's transaction: counts
+    # with one upsert per bucket, then latency sketches, which are read and
+    # rewritten while the upsert still holds the rows (and, on SQLite, the
+    # write lock). Buckets are written in key order.
+    if not deltas:
+        return
+    keys = sorted(deltas)
+    conn.execute(_upsert(conn.dialect.name), [
+        dict(
+            zip(_KEY_COLUMNS, key),
+            evaluations=deltas[key].evaluations,
+            true_count=deltas[key].true_count,
+            error_count=deltas[key].error_count,
+            latency=b""
+        )
+        for key in keys
+    ])
+    timed = [key for key in keys if deltas[key].latency.counts]
+    if not timed:
+        return
+    existing = {
+        tuple(row[:-1]): row.latency
+        for row in conn.execute(
+            select(*(_TABLE.c[name] for name in _KEY_COLUMNS), _TABLE.c.latency)
+            .where(
+                _TABLE.c.rule_id.in_({key[0] for key in timed}),
+                _TABLE.c.bucket_start.between(min(key[2] for key in timed), max(key[2] for key in timed))
+            )
+        )
+    }
+    merged = []
+    for key in timed:
+        sketch = LatencySketch.decode(existing.get(key))
+        sketch.merge(deltas[key].latency)
+        merged.append(dict(zip((f"key_{name}" for name in _KEY_COLUMNS), key), merged=sketch.encode()))
+    conn.execute(
+        update(_TABLE)
+        .where(*(_TABLE.c[name] == bindparam(f"key_{name}") for name in _KEY_COLUMNS))
+        .values(latency=bindparam("merged")),
+        merged
+    )
+
+def summarize(rows: Iterable[Row]) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    # (totals, totals per rule version, buckets) over rollup rows
+    total = RollupCounts()
+    versions: Dict[int, RollupCounts] = {}
+    buckets = []
+    for row in rows:
+        counts = RollupCounts(row.evaluations, row.true_count, row.error_count, LatencySketch.decode(row.latency))
+        buckets.append({"start": row.bucket_start, "rule_version": row.rule_version or None, **counts.summary()})
+        total.add(counts)
+        versions.setdefault(row.rule_version, RollupCounts()).add(counts)
+    return total.summary(), [
+        {"rule_version": rule_version or None, **counts.summary()} for rule_version, counts in sorted(versions.items())
+    ], buckets
+
+class RollupWriter:
+    # Maintains rule_evaluation_rollups on the evaluation path: record()
+    # adds to per-minute counts held in memory, and a background thread
+    # adds them to the minute and hour buckets every flush_interval_ms,
+    # so stats lag evaluations by about that much. Minute buckets older
+    # than minute_retention_days are dropped (0 keeps them); hour buckets
+    # are kept.
+    def __init__(
+        self,
+        engine: Engine,
+        enabled: bool = True,
+        flush_interval_ms: int = 1000,
+        minute_retention_days: int = 7
+    ):
+        self.engine = engine
+        self.enabled = enabled
+        self.flush_interval = max(1, flush_interval_ms) / 1000
+        self.minute_retention_days = minute_retention_days
+        self.written = 0
+        self.dropped = 0
+        self._pending: Dict[Tuple[int, int, datetime], RollupCounts] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._purged_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._record_start(datetime.now())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rollup-writer", daemon=True)
+        self._thread.start()
+
+    def _record_start(self, moment: datetime) -> None:
+        # Only the first start counts: history from before it is what the
+        # backfill adds, everything after is counted here
+        try:
+            with self.engine.begin() as conn:
+                if conn.execute(select(_BACKFILL.c.rule_id).where(_BACKFILL.c.rule_id == _SINCE)).first() is None:
+                    conn.execute(insert(_BACKFILL).values(rule_id=_SINCE, until=moment, position=moment))
+        except IntegrityError:
+            # Another worker recorded it first
+            pass
+
+    def stop(self) -> None:
+        # Flushes everything recorded so far before returning
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def record(
+        self,
+        rule_id: int,
+        rule_version: Optional[int],
+        true_count: int = 0,
+        false_count: int = 0,
+        error_count: int = 0,
+        seconds: float = 0.0
+    ) -> None:
+        # seconds is the time taken per evaluation (for a batch, its average)
+        evaluations = true_count + false_count + error_count
+        if self._thread is None or not evaluations:
+            return
+        key = (rule_id, rule_version or 0, bucket_start(datetime.now(), MINUTE))
+        with self._lock:
+            counts = self._pending.get(key)
+            if counts is None:
+                counts = self._pending[key] = RollupCounts()
+            counts.evaluations += evaluations
+            counts.true_count += true_count
+            counts.error_count += error_count
+            counts.latency.add(seconds, evaluations)
+
+    def forget(self, rule_id: int) -> None:
+        # Called once the rule is deleted: drops its counts not flushed yet,
+        # then waits for a flush in flight and removes whatever rows it
+        # wrote for the rule after the delete
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == rule_id]:
+                del self._pending[key]
+        with self._flush_lock:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(delete(_TABLE).where(_TABLE.c.rule_id == rule_id))
+            except Exception:
+                logger.exception("Failed to remove rollups of deleted rule %d", rule_id)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            deltas: Dict[RollupKey, RollupCounts] = {}
+            for (rule_id, rule_version, minute), counts in pending.items():
+                for width in (MINUTE, HOUR):
+                    key = (rule_id, width, bucket_start(minute, width), rule_version)
+                    if key not in deltas:
+                        deltas[key] = RollupCounts()
+                    deltas[key].add(counts)
+            evaluations = sum(counts.evaluations for counts in pending.values())
+            try:
+                with self.engine.begin() as conn:
+                    # Counts recorded by evaluations that finished after
+                    # their rule was deleted are skipped
+                    existing = set(conn.scalars(
+                        select(_RULES.c.id).where(_RULES.c.id.in_({key[0] for key in deltas}))
+                    ))
+                    add_rollups(conn, {key: counts for key, counts in deltas.items() if key[0] in existing})
+                self.written += evaluations
+            except Exception:
+                self.dropped += evaluations
+                logger.exception("Failed to write rollups for %d evaluations", evaluations)
+
+    def purge(self, now: Optional[datetime] = None) -> int:
+        if self.minute_retention_days <= 0:
+            return 0
+        cutoff = (now or datetime.now()) - timedelta(days=self.minute_retention_days)
+        with self.engine.begin() as conn:
+            return conn.execute(
+                delete(_TABLE).where(_TABLE.c.granularity == MINUTE, _TABLE.c.bucket_start < cutoff)
+            ).rowcount
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - self._purged_at >= HOUR:
+                self._purged_at = time.monotonic()
+                try:
+                    self.purge()
+                except Exception:
+                    logger.exception("Failed to purge minute rollups")
+        self.flush()
+
+class RollupBackfill:
+    # Builds rollups from the evaluation history (live and archived rows)
+    # recorded before the first RollupWriter started counting. Each rule is read one
+    # hour at a time, newest first, streaming chunk_size rows at a time;
+    # every hour is added in one transaction together with the rule's
+    # progress in rule_evaluation_rollup_backfill, so an interrupted run
+    # resumes where it stopped and no evaluation is counted twice.
+    # History rows carry no errors or latencies, and sampled or skipped
+    # evaluations have no rows, so backfilled buckets hold results only.
+    def __init__(
+        self,
+        engine: Engine,
+        minute_retention_days: int = 7,
+        chunk_size: int = 10000,
+        exclusive: Optional[Callable[[], ContextManager[bool]]] = None
+    ):
+        self.engine = engine
+        self.minute_retention_days = minute_retention_days
+        self.chunk_size = max(1, chunk_size)
+        # Yields whether this process may run the backfill; with several
+        # workers only one of them does
+        self.exclusive = exclusive or (lambda: nullcontext(True))
+        self.rows = 0
+        self.done = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rollup-backfill", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Waits for the hour being added to commit
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        try:
+            with self.exclusive() as acquired:
+                if acquired:
+                    self.run()
+        except Exception:
+            logger.exception("Rollup backfill failed")
+
+    def run(self) -> int:
+        with self.engine.connect() as conn:
+            until = conn.execute(select(_BACKFILL.c.until).where(_BACKFILL.c.rule_id == _SINCE)).scalar()
+            if until is None:
+                # Rollups were never written; there is nothing to add to
+                return 0
+            rule_ids = conn.execute(union(select(_LIVE.c.rule_id), select(_ARCHIVE.c.rule_id))).scalars().all()
+        rows = 0
+        for rule_id in rule_ids:
+            if self._stop.is_set():
+                return rows
+            if rule_id is not None:
+                rows += self._backfill_rule(rule_id, until)
+        self.done = not self._stop.is_set()
+        return rows
+
+    def _backfill_rule(self, rule_id: int, until: datetime) -> int:
+        with self.engine.begin() as conn:
+            position = conn.execute(select(_BACKFILL.c.position).where(_BACKFILL.c.rule_id == rule_id)).scalar()
+            if position is None:
+                position = until
+                conn.execute(insert(_BACKFILL).values(rule_id=rule_id, until=until, position=until))
+        minute_cutoff = (
+            datetime.now() - timedelta(days=self.minute_retention_days) if self.minute_retention_days > 0 else None
+        )
+        rows = 0
+        while not self._stop.is_set():
+            with self.engine.connect() as conn:
+                latest = [
+                    conn.execute(
+                        select(func.max(table.c.evaluated_at))
+                        .where(table.c.rule_id == rule_id, table.c.evaluated_at < position)
+                    ).scalar()
+                    for table in (_LIVE, _ARCHIVE)
+                ]
+                latest = [moment for moment in latest if moment is not None]
+                if not latest:
+                    break
+                hour = bucket_start(max(latest), HOUR)
+                history = union_all(*(
+                    select(table.c.rule_version, table.c.evaluated_at, table.c.result)
+                    .where(table.c.rule_id == rule_id, table.c.evaluated_at >= hour, table.c.evaluated_at < position)
+                    for table in (_LIVE, _ARCHIVE)
+                ))
+                deltas: Dict[RollupKey, RollupCounts] = {}
+                result = conn.execution_options(yield_per=self.chunk_size).execute(history)
+                for chunk in result.partitions():
+                    for rule_version, evaluated_at, passed in chunk:
+                        for width in (MINUTE, HOUR):
+                            start = bucket_start(evaluated_at, width)
+                            if width == MINUTE and minute_cutoff is not None and start < minute_cutoff:
+                                continue
+                            key = (rule_id, width, start, rule_version or 0)
+                            counts = deltas.get(key)
+                            if counts is None:
+                                counts = deltas[key] = RollupCounts()
+                            counts.evaluations += 1
+                            counts.true_count += bool(passed)
+                    rows += len(chunk)
+            with self.engine.begin() as conn:
+                add_rollups(conn, deltas)
+                conn.execute(update(_BACKFILL).where(_BACKFILL.c.rule_id == rule_id).values(position=hour))
+            position = hour
+        self.rows += rows
+        return rows
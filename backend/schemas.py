@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
 
 class NodeBase(BaseModel):
     type: str
@@ -23,6 +23,7 @@ class RuleBase(BaseModel):
     name: str
     description: Optional[str] = None
     rule_string: str
+    schema_id: Optional[int] = None
 
 class RuleCreate(RuleBase):
     pass
@@ -32,6 +33,24 @@ class Rule(RuleBase):
     ast_json: Dict
     created_at: datetime
     updated_at: datetime
+    version: int
+
+    class Config:
+        orm_mode = True
+
+class FieldDefinition(BaseModel):
+    name: str
+    type: Literal["int", "float", "string", "bool"]
+    nullable: bool = False
+    enum: Optional[List[Any]] = None
+
+class RuleSchemaCreate(BaseModel):
+    name: str
+    fields: List[FieldDefinition]
+
+class RuleSchema(RuleSchemaCreate):
+    id: int
+    created_at: datetime
 
     class Config:
         orm_mode = True
@@ -45,8 +64,162 @@ class RuleEvaluation(BaseModel):
     input_data: Dict[str, Any]
     result: bool
     evaluated_at: datetime
+    rule_version: Optional[int] = None
+
+    class Config:
+        orm_mode = True
+
+class RuleVersion(BaseModel):
+    rule_id: int
+    version: int
+    rule_string: str
+    ast_json: Dict
+    schema_id: Optional[int] = None
+    created_at: datetime
+    active: bool = False
 
     class Config:
         orm_mode = True
 
+class RuleStatsTotals(BaseModel):
+    evaluations: int
+    true_count: int
+    error_count: int
+    # Over evaluations that returned a result; latencies (seconds) are None
+    # for buckets built from history only
+    pass_rate: Optional[float] = None
+    latency_p50: Optional[float] = None
+    latency_p90: Optional[float] = None
+    latency_p99: Optional[float] = None
+
+class RuleVersionStats(RuleStatsTotals):
+    rule_version: Optional[int] = None
+
+class RuleStatsBucket(RuleVersionStats):
+    start: datetime
+
+class RuleStats(BaseModel):
+    rule_id: int
+    granularity: str
+    start: datetime
+    end: datetime
+    totals: RuleStatsTotals
+    versions: List[RuleVersionStats]
+    buckets: List[RuleStatsBucket]
+
+class RuleFinding(BaseModel):
+    kind: str
+    expression: str
+    message: str
+
+class RuleAnalysis(BaseModel):
+    rule_id: int
+    rule_version: int
+    original: str
+    optimized: str
+    ast: Dict
+    nodes_before: int
+    nodes_after: int
+    findings: List[RuleFinding]
+
+class BatchEvaluationResult(BaseModel):
+    index: int
+    result: Optional[bool] = None
+    evaluation_id: Optional[int] = None
+    error: Optional[str] = None
+
+class RuleBatchEvaluation(BaseModel):
+    rule_id: int
+    rule_version: Optional[int] = None
+    total: int
+    errors: int
+    results: List[BatchEvaluationResult]
+
+class ColumnarRowError(BaseModel):
+    index: int
+    error: str
+
+class ColumnarEvaluation(BaseModel):
+    rule_id: int
+    rows: int
+    true_count: int
+    results: List[Optional[bool]]
+    errors: List[ColumnarRowError]
+
+class RuleMatchError(BaseModel):
+    rule_id: int
+    error: str
+
+class RuleMatchResult(BaseModel):
+    matched_rule_ids: List[int]
+    errors: List[RuleMatchError]
+    rules: int
+    predicates: int
+
+class EntityRuleFlip(BaseModel):
+    rule_id: int
+    # None when the rule failed (see error)
+    previous: Optional[bool] = None
+    result: Optional[bool] = None
+    error: Optional[str] = None
+
+class EntityUpdateResult(BaseModel):
+    entity_id: str
+    changed_fields: List[str]
+    flipped: List[EntityRuleFlip]
+    evaluated_nodes: int
+    nodes: int
+
+class EntityState(BaseModel):
+    entity_id: str
+    fields: Dict[str, Any]
+    matched_rule_ids: List[int]
+    errors: List[RuleMatchError]
+
+class PlanNodeStats(BaseModel):
+    node_id: int
+    expression: str
+    cost: int
+    evaluations: int
+    passes: int
+    pass_rate: Optional[float] = None
+    children: List[int]
+
+class RulePlan(BaseModel):
+    rule_id: int
+    adaptive: bool
+    plan: str
+    calls: int
+    samples: int
+    nodes: List[PlanNodeStats]
+
+class ResultCacheStats(BaseModel):
+    enabled: bool
+    size: int
+    max_size: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+
+class RuleCacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+
+class CacheStats(BaseModel):
+    results: ResultCacheStats
+    rules: RuleCacheStats
+
+class ProfileSettings(BaseModel):
+    sample_rate: float = Field(ge=0.0, le=1.0)
+    reset: bool = False
+
+class ProfileReport(BaseModel):
+    sample_rate: float
+    requests: int
+    report: str
+
 NodeBase.model_rebuild()
\ No newline at end of file
@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, List, Optional, Sequence
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from . import inputs
+
+class DuplexStreamingResponse(StreamingResponse):
+    # StreamingResponse normally reads receive() in parallel to notice
+    # disconnects, which would consume request body messages that the
+    # response body is still reading through request.stream(). Here the
+    # request stream itself reports the disconnect (ClientDisconnect).
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[List[Optional[bytes]]]:
+    # Yields the complete lines of each incoming chunk, carrying a partial
+    # line over to the next one. At most max_line_bytes of a line are
+    # buffered: a longer line is reported once as None and the rest of it
+    # is skipped, so memory stays bounded whatever the input size.
+    buffer = bytearray()
+    skipping = False
+    async for chunk in chunks:
+        lines: List[Optional[bytes]] = []
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                break
+            if skipping:
+                skipping = False
+            elif buffer:
+                buffer += chunk[start:end]
+                lines.append(bytes(buffer) if len(buffer) <= max_line_bytes else None)
+                buffer.clear()
+            else:
+                lines.append(chunk[start:end] if end - start <= max_line_bytes else None)
+            start = end + 1
+        if not skipping and start < len(chunk):
+            buffer += chunk[start:]
+            if len(buffer) > max_line_bytes:
+                lines.append(None)
+                buffer.clear()
+                skipping = True
+        if lines:
+            yield lines
+    if buffer:
+        yield [bytes(buffer)]
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = ("id", "rule_id", "rule_version", "result", "evaluated_at", "input_data")
+
+def _timestamp(value: Any) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+def _input_json(row: Sequence[Any]) -> str:
+    # Stored inputs come as packed bytes, inline ones as JSON text
+    return inputs.decode_text(row[6]) if row[6] is not None else row[5]
+
+async def export_evaluations(partitions: AsyncIterator[Sequence[Any]], export_format: str) -> AsyncIterator[str]:
+    # Rows are (id, rule_id, rule_version, result, evaluated_at, input_data,
+    # data); the input JSON text is passed through without re-parsing. One
+    # output chunk per fetched partition.
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        async for rows in partitions:
+            writer.writerows(
+                (row[0], row[1], row[2], "true" if row[3] else "false", _timestamp(row[4]), _input_json(row))
+                for row in rows
+            )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+
+    async for rows in partitions:
+        yield "".join(
+            f'{{"id": {row[0]}, "rule_id": {row[1]}, "rule_version": {json.dumps(row[2])}, '
+            f'"result": {"true" if row[3] else "false"}, '
+            f'"evaluated_at": {json.dumps(_timestamp(row[4]))}, "input_data": {_input_json(row)}}}\n'
+            for row in rows
+        )
@@ -0,0 +1,244 @@
+import csv
+import io
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from .schemas import NodeBase
+from .parser import Operator, NodeType
+from .compiler import COMPARATORS, LOGICAL_OPERATORS, flatten_logical
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is only needed for columnar scoring
+    np = None
+
+# (values, errors, messages): a boolean result column, a boolean mask of rows
+# whose evaluation raised and the per-row error message. errors and messages
+# are None while no row in the column has failed.
+ColumnResult = Tuple[Any, Optional[Any], Optional[Any]]
+
+# Python types that numpy stores without changing how they compare
+_UNIFORM_KINDS = {bool: "bool", int: "number", float: "number", str: "str"}
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("Columnar evaluation requires numpy to be installed")
+
+def coerce_cell(text: str) -> Any:
+    # Same literal rules as RuleParser.parse_comparison; empty cells are missing
+    if text == "":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+def read_csv_columns(text: str) -> Dict[str, List[Any]]:
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if header is None:
+        return {}
+    columns: Dict[str, List[Any]] = {name: [] for name in header}
+    names = list(columns)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(names):
+            raise ValueError(f"Expected {len(names)} values per row, got {len(row)}")
+        for name, cell in zip(names, row):
+            columns[name].append(coerce_cell(cell))
+    return columns
+
+class VectorizedEvaluator:
+    # Evaluates a rule over whole columns at once. Each comparison is a single
+    # array operation and AND/OR are np.logical_and/np.logical_or. Missing
+    # values and type errors are tracked per row with the same short-circuit
+    # semantics as RuleEvaluator.evaluate_rule, so a row errors here exactly
+    # when the row evaluator would raise for it.
+    def evaluate(self, node: NodeBase, columns: Dict[str, Sequence[Any]]) -> ColumnResult:
+        require_numpy()
+        arrays = {name: self._as_array(values) for name, values in columns.items()}
+        lengths = {len(values) for values in arrays.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+        size = lengths.pop() if lengths else 0
+        return self._evaluate(node, arrays, size, {})
+
+    def evaluate_rows(self, compiled: Callable[[Dict[str, Any]], bool], columns: Dict[str, Sequence[Any]]) -> ColumnResult:
+        # Row by row with a compiled rule, for rules bound to a schema: their
+        # comparisons coerce each value to the field's type first
+        require_numpy()
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+        size = lengths.pop() if lengths else 0
+        names = list(columns)
+        values = np.zeros(size, dtype=bool)
+        errors = None
+        messages = None
+        for i, row in enumerate(zip(*columns.values())):
+            try:
+                values[i] = compiled(dict(zip(names, row)))
+            except Exception as e:
+                if errors is None:
+                    errors = np.zeros(size, dtype=bool)
+                    messages = np.empty(size, dtype=object)
+                errors[i] = True
+                messages[i] = str(e)
+        return values, errors, messages
+
+    @staticmethod
+    def _as_array(values: Sequence[Any]) -> Any:
+        if isinstance(values, np.ndarray):
+            return values
+        # Only a column of one kind of value gets a typed array. np.asarray
+        # would turn [1, 'a'] into strings and compare them unlike the row
+        # evaluator, so anything else (mixed kinds, None, lists) stays object.
+        kinds = {_UNIFORM_KINDS.get(type(value)) for value in values}
+        if len(kinds) == 1 and None not in kinds:
+            array = np.asarray(values)
+            if array.ndim == 1 and array.dtype != object:
+                return array
+        array = np.empty(len(values), dtype=object)
+        array[:] = list(values)
+        return array
+
+    def _evaluate(self, node: NodeBase, arrays: Dict[str, Any], size: int, missing: Dict[str, Any]) -> ColumnResult:
+        if node.type == NodeType.OPERATOR:
+            if node.operator not in LOGICAL_OPERATORS:
+                return self._fail(size, f"Invalid logical operator: {node.operator}")
+            children = flatten_logical(node)
+            result = self._evaluate(children[0], arrays, size, missing)
+            for child in children[1:]:
+                right = self._evaluate(child, arrays, size, missing)
+                if node.operator == Operator.AND:
+                    result = self._and(result, right)
+                else:
+                    result = self._or(result, right)
+            return result
+        elif node.type == NodeType.COMPARISON:
+            return self._compare(node, arrays, size, missing)
+        elif node.type == NodeType.CONSTANT:
+            return np.full(size, bool(node.value)), None, None
+        return self._fail(size, f"Invalid node type: {node.type}")
+
+    @staticmethod
+    def _fail(size: int, message: str) -> ColumnResult:
+        messages = np.empty(size, dtype=object)
+        messages[:] = message
+        return np.zeros(size, dtype=bool), np.ones(size, dtype=bool), messages
+
+    @staticmethod
+    def _missing_mask(column: Any) -> Optional[Any]:
+        if column.dtype != object:
+            return None
+        mask = np.fromiter((value is None for value in column), dtype=bool, count=len(column))
+        return mask if mask.any() else None
+
+    @staticmethod
+    def _is_member(values: Any, constants: List[Any]) -> Any:
+        if not isinstance(values, np.ndarray):
+            return values in constants
+        if values.dtype.kind in "iuf" and all(type(constant) in (int, float) for constant in constants):
+            return np.isin(values, constants)
+        return np.fromiter((value in constants for value in values), dtype=bool, count=len(values))
+
+    def _compare(self, node: NodeBase, arrays: Dict[str, Any], size: int, missing: Dict[str, Any]) -> ColumnResult:
+        compare = self._is_member if node.operator == Operator.IN else COMPARATORS.get(node.operator)
+        if compare is None:
+            return self._fail(size, f"Invalid comparison operator: {node.operator}")
+
+        column = arrays.get(node.field)
+        if column is None:
+            return self._fail(size, f"Field '{node.field}' not found in data")
+
+        if node.field not in missing:
+            missing[node.field] = self._missing_mask(column)
+        absent = missing[node.field]
+
+        values = np.zeros(size, dtype=bool)
+        errors = None
+        messages = None
+        present = column if absent is None else column[~absent]
+        try:
+            compared = np.asarray(compare(present, node.value), dtype=bool)
+        except TypeError:
+            compared = None
+
+        if compared is None or compared.shape != present.shape:
+            # Mixed or incomparable types: fall back to per-element comparison,
+            # on Python values so errors read as they do from /evaluate
+            compared = np.zeros(len(present), dtype=bool)
+            failed = np.zeros(len(present), dtype=bool)
+            failures = np.empty(len(present), dtype=object)
+            for i, value in enumerate(present.tolist()):
+                try:
+                    compared[i] = compare(value, node.value)
+                except TypeError as e:
+                    failed[i] = True
+                    failures[i] = str(e)
+            if failed.any():
+                errors = np.zeros(size, dtype=bool)
+                messages = np.empty(size, dtype=object)
+                if absent is None:
+                    errors[:] = failed
+                    messages[:] = failures
+                else:
+                    errors[~absent] = failed
+                    messages[~absent] = failures
+
+        if absent is None:
+            values[:] = compared
+        else:
+            values[~absent] = compared
+            if errors is None:
+                errors = np.zeros(size, dtype=bool)
+                messages = np.empty(size, dtype=object)
+            errors |= absent
+            messages[absent] = f"Field '{node.field}' not found in data"
+
+        if errors is not None:
+            values &= ~errors
+        return values, errors, messages
+
+    @staticmethod
+    def _and(left: ColumnResult, right: ColumnResult) -> ColumnResult:
+        left_values, left_errors, left_messages = left
+        right_values, right_errors, right_messages = right
+        # The right side only matters (and can only fail) where the left is true
+        values = np.logical_and(left_values, right_values)
+        if right_errors is not None:
+            reached = np.logical_and(left_values, right_errors)
+            if reached.any():
+                values &= ~reached
+                if left_errors is None:
+                    left_errors = reached
+                    left_messages = np.empty(len(values), dtype=object)
+                else:
+                    left_errors = left_errors | reached
+                    left_messages = left_messages.copy()
+                left_messages[reached] = right_messages[reached]
+        return values, left_errors, left_messages
+
+    @staticmethod
+    def _or(left: ColumnResult, right: ColumnResult) -> ColumnResult:
+        left_values, left_errors, left_messages = left
+        right_values, right_errors, right_messages = right
+        values = np.logical_or(left_values, right_values)
+        if left_errors is not None:
+            values &= ~left_errors
+        if right_errors is not None:
+            reached = ~left_values & right_errors
+            if left_errors is not None:
+                reached &= ~left_errors
+            if reached.any():
+                values &= ~reached
+                if left_errors is None:
+                    left_errors = reached
+                    left_messages = np.empty(len(values), dtype=object)
+                else:
+                    left_errors = left_errors | reached
+                    left_messages = left_messages.copy()
+                left_messages[reached] = right_messages[reached]
+        return values, left_errors, left_messages
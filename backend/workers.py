@@ -0,0 +1,188 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from .compact import decode_rule, encode_rule
+from .compiler import CompiledFn, RuleCompiler, load_node
+from .fields import RecordSchema
+from .schemas import NodeBase
+
+# Per record: the boolean result, or the error message if evaluation raised
+Outcome = Union[bool, str]
+
+class RuleSource(NamedTuple):
+    # What a worker compiles from; the compact blob is preferred since it is
+    # small to pickle and skips pydantic validation
+    ast_json: Optional[dict]
+    ast_blob: Optional[bytes]
+    # Field declarations (RecordSchema.to_json()) for typed rules
+    schema: Optional[List[dict]] = None
+
+    @classmethod
+    def of(cls, ast_json: Optional[dict], ast_blob: Optional[bytes], schema: Optional[RecordSchema] = None) -> "RuleSource":
+        return cls(None if ast_blob is not None else ast_json, ast_blob, None if schema is None else schema.to_json())
+
+    @classmethod
+    def from_node(cls, node: NodeBase) -> "RuleSource":
+        blob = encode_rule(node)
+        return cls(None if blob is not None else node.model_dump(), blob)
+
+    def digest(self) -> str:
+        data = self.ast_blob if self.ast_blob is not None else json.dumps(self.ast_json, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(data).hexdigest()
+
+# Worker-process state: compiled rules by (rule id, version)
+_worker_rules: "OrderedDict[Hashable, CompiledFn]" = OrderedDict()
+_worker_cache_size = 256
+_worker_compiler: Optional[RuleCompiler] = None
+
+def _init_worker(cache_size: int) -> None:
+    global _worker_cache_size, _worker_compiler
+    _worker_cache_size = cache_size
+    _worker_compiler = RuleCompiler()
+
+def _evaluate_chunk(key: Hashable, source: Optional[RuleSource], records: List[Dict[str, Any]]) -> Optional[List[Outcome]]:
+    # Returns None when the rule is not cached here and no source was sent
+    compiled = _worker_rules.get(key)
+    if compiled is None:
+        if source is None:
+            return None
+        if source.schema is not None:
+            compiled = _worker_compiler.compile_typed(
+                load_node(source.ast_json, source.ast_blob), RecordSchema.from_json(source.schema)
+            )
+        elif source.ast_blob is not None:
+            compiled = _worker_compiler.compile_compact(decode_rule(source.ast_blob))
+        else:
+            compiled = _worker_compiler.compile(NodeBase.model_validate(source.ast_json))
+        _worker_rules[key] = compiled
+        if len(_worker_rules) > _worker_cache_size:
+            _worker_rules.popitem(last=False)
+    else:
+        _worker_rules.move_to_end(key)
+    return evaluate_records(compiled, records)
+
+def evaluate_records(compiled: CompiledFn, records: Iterable[Dict[str, Any]]) -> List[Outcome]:
+    outcomes: List[Outcome] = []
+    append = outcomes.append
+    for record in records:
+        try:
+            append(compiled(record))
+        except Exception as e:
+            append(str(e))
+    return outcomes
+
+def _chunked(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class EvaluationPool:
+    # Scores records for one rule across worker processes. Records are sent
+    # in chunks of chunk_size; at most max_pending chunks are in flight
+    # across all callers, and further submissions block until one finishes.
+    # A rule is compiled once per worker and cached there under its key
+    # (rule id and version): its source rides along with the first chunks
+    # of a key only, and a worker that still lacks it asks for it again.
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        chunk_size: int = 1000,
+        max_pending: Optional[int] = None,
+        cache_size: int = 256
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self.max_pending = max_pending or 2 * self.workers
+        self.cache_size = cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._shipped: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        # Chunks submitted and not finished yet, across all callers
+        return self._in_flight
+
+    def start(self) -> None:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs an event loop and the
+                # history writer thread is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.cache_size,)
+                )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._shipped.clear()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _source_for(self, key: Hashable, source: RuleSource) -> Optional[RuleSource]:
+        with self._lock:
+            shipped = self._shipped.get(key, 0)
+            if shipped >= self.workers:
+                return None
+            self._shipped[key] = shipped + 1
+            self._shipped.move_to_end(key)
+            if len(self._shipped) > self.cache_size:
+                self._shipped.popitem(last=False)
+            return source
+
+    def _submit(self, key: Hashable, source: Optional[RuleSource], chunk: List[Dict[str, Any]]) -> Future:
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(_evaluate_chunk, key, source, chunk)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def evaluate(self, key: Hashable, source: RuleSource, records: Iterable[Dict[str, Any]]) -> Iterator[Outcome]:
+        # Yields one outcome per record, in input order
+        self.start()
+        pending: Deque[Tuple[Future, List[Dict[str, Any]]]] = deque()
+        chunks = _chunked(records, self.chunk_size)
+        exhausted = False
+        while True:
+            if not exhausted:
+                acquired = self._slots.acquire(blocking=not pending)
+                if acquired:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        self._slots.release()
+                        exhausted = True
+                    else:
+                        pending.append((self._submit(key, self._source_for(key, source), chunk), chunk))
+                        continue
+            if not pending:
+                return
+            future, chunk = pending.popleft()
+            outcomes = future.result()
+            if outcomes is None:
+                outcomes = self._executor.submit(_evaluate_chunk, key, source, chunk).result()
+            yield from outcomes
+
+    def evaluate_rule(self, node: NodeBase, records: Iterable[Dict[str, Any]], key: Optional[Hashable] = None) -> List[Outcome]:
+        # Ad hoc rules are keyed by a digest of their encoding
+        source = RuleSource.from_node(node)
+        return list(self.evaluate(key if key is not None else ("digest", source.digest()), source, records))
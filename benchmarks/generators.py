@@ -0,0 +1,68 @@
+import random
+from typing import Any, Dict, List, Optional
+
+COMPARATORS = (">", "<", "=", ">=", "<=")
+
+class RuleGenerator:
+    # Synthetic rules and matching records.
+    #   depth: levels of AND/OR nesting
+    #   width: operands per AND/OR group (chains are parenthesized pairwise,
+    #          so the strings parse with any parser version)
+    #   fields: distinct field names in use
+    #   cardinality: distinct values per field (drives selectivity and how
+    #                often conditions repeat across rules)
+    def __init__(
+        self,
+        depth: int = 3,
+        width: int = 2,
+        fields: int = 8,
+        cardinality: int = 50,
+        string_ratio: float = 0.25,
+        seed: Optional[int] = 0
+    ):
+        self.depth = depth
+        self.width = max(2, width)
+        self.fields = [f"f{i}" for i in range(fields)]
+        self.cardinality = max(1, cardinality)
+        self.string_ratio = string_ratio
+        self.random = random.Random(seed)
+        # Fields are either numeric or string-valued, decided once
+        self.string_fields = {
+            field for field in self.fields if self.random.random() < string_ratio
+        }
+
+    def _value(self, field: str) -> Any:
+        index = self.random.randrange(self.cardinality)
+        return f"v{index}" if field in self.string_fields else index
+
+    def condition(self) -> str:
+        field = self.random.choice(self.fields)
+        value = self._value(field)
+        if isinstance(value, str):
+            return f"{field} = '{value}'"
+        return f"{field} {self.random.choice(COMPARATORS)} {value}"
+
+    def rule(self, depth: Optional[int] = None) -> str:
+        depth = self.depth if depth is None else depth
+        if depth <= 0:
+            return self.condition()
+        operator = self.random.choice(("AND", "OR"))
+        expression = self.rule(depth - 1)
+        for _ in range(self.width - 1):
+            expression = f"({expression} {operator} {self.rule(depth - 1)})"
+        return expression
+
+    def rules(self, count: int) -> List[str]:
+        return [self.rule() for _ in range(count)]
+
+    def record(self, extra_fields: int = 0, missing_ratio: float = 0.0) -> Dict[str, Any]:
+        record = {
+            field: self._value(field) for field in self.fields
+            if self.random.random() >= missing_ratio
+        }
+        for i in range(extra_fields):
+            record[f"extra{i}"] = self.random.random()
+        return record
+
+    def records(self, count: int, extra_fields: int = 0, missing_ratio: float = 0.0) -> List[Dict[str, Any]]:
+        return [self.record(extra_fields, missing_ratio) for _ in range(count)]
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+Results = Dict[str, Dict[str, Any]]
+
+def percentile(samples: List[float], fraction: float) -> float:
+    # Nearest-rank on a sorted copy
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+def measure(fn: Callable[[], Any], ops: int = 1, repeat: int = 5, warmup: int = 1) -> Dict[str, Any]:
+    # Runs fn `repeat` times (after `warmup` untimed runs); each run performs
+    # `ops` operations. The headline value is the median seconds per op.
+    for _ in range(warmup):
+        fn()
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        per_op.append((time.perf_counter() - start) / ops)
+    median = statistics.median(per_op)
+    return {
+        "value": median,
+        "unit": "s/op",
+        "higher_is_better": False,
+        "min": min(per_op),
+        "mean": statistics.fmean(per_op),
+        "stdev": statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+        "ops_per_sec": 1 / median if median else None,
+        "ops": ops,
+        "repeat": repeat,
+    }
+
+async def load(
+    request: Callable[[int], Awaitable[Any]],
+    total: int,
+    concurrency: int
+) -> Tuple[List[float], float]:
+    # Closed-loop load: `concurrency` workers issue requests back to back
+    # until `total` have completed. Returns per-request latencies and the
+    # wall time of the whole run.
+    latencies: List[float] = []
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for index in counter:
+            start = time.perf_counter()
+            await request(index)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return latencies, time.perf_counter() - start
+
+def latency_results(name: str, latencies: List[float], elapsed: float) -> Results:
+    details = {
+        "requests": len(latencies),
+        "mean": statistics.fmean(latencies) if latencies else 0.0,
+        "max": max(latencies, default=0.0),
+        "p90": percentile(latencies, 0.90),
+    }
+    return {
+        f"{name}.p50": {"value": percentile(latencies, 0.50), "unit": "s", "higher_is_better": False, **details},
+        f"{name}.p99": {"value": percentile(latencies, 0.99), "unit": "s", "higher_is_better": False, **details},
+        f"{name}.throughput": {
+            "value": len(latencies) / elapsed if elapsed else 0.0,
+            "unit": "req/s",
+            "higher_is_better": True,
+            **details
+        },
+    }
+
+def report(results: Results, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "parameters": parameters,
+        },
+        "results": results,
+    }
+
+def load_report(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+def write_report(path: str, data: Dict[str, Any]) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def compare(current: Results, baseline: Results, threshold: float) -> List[Dict[str, Any]]:
+    # One row per benchmark present in both runs. `regressed` means worse
+    # than the baseline by more than `threshold` (0.1 = 10%).
+    rows = []
+    for name in sorted(current.keys() & baseline.keys()):
+        value = current[name]["value"]
+        base = baseline[name]["value"]
+        higher_is_better = current[name].get("higher_is_better", False)
+        if not base:
+            continue
+        change = (value - base) / base
+        worse = -change if higher_is_better else change
+        rows.append({
+            "name": name,
+            "baseline": base,
+            "current": value,
+            "change": change,
+            "regressed": worse > threshold,
+        })
+    return rows
+
+def format_value(value: float, unit: str) -> str:
+    if unit in ("s", "s/op"):
+        for scale, suffix in ((1, "s"), (1e-3, "ms"), (1e-6, "us")):
+            if value >= scale:
+                return f"{value / scale:.2f}{suffix}"
+        return f"{value / 1e-9:.0f}ns"
+    return f"{value:.1f} {unit}"
+
+def print_results(results: Results, out=sys.stdout) -> None:
+    width = max((len(name) for name in results), default=0)
+    for name, result in results.items():
+        print(f"{name:<{width}}  {format_value(result['value'], result['unit'])}", file=out)
+
+def print_comparison(rows: List[Dict[str, Any]], out=sys.stdout) -> None:
+    width = max((len(row["name"]) for row in rows), default=0)
+    for row in rows:
+        flag = "REGRESSION" if row["regressed"] else ""
+        print(f"{row['name']:<{width}}  {row['change']:+7.1%}  {flag}", file=out)
+
+def summarize(rows: List[Dict[str, Any]]) -> Optional[str]:
+    regressed = [row["name"] for row in rows if row["regressed"]]
+    if not regressed:
+        return None
+    return f"{len(regressed)} regression(s): {', '.join(regressed)}"
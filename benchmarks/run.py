@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+# Point the backend at a throwaway database before anything imports it
+_workdir = tempfile.TemporaryDirectory(prefix="rule-engine-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir.name, 'bench.db')}"
+
+from .harness import Results, compare, load_report, print_comparison, print_results, report, summarize, write_report
+from .suites import SUITES
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Benchmarks for the parser, evaluator, combiner, CRUD paths and API."
+    )
+    parser.add_argument("--suite", choices=sorted(SUITES), action="append",
+                        help="suite to run (repeatable; default: all)")
+    parser.add_argument("--depth", type=int, default=3, help="AND/OR nesting depth of generated rules")
+    parser.add_argument("--width", type=int, default=2, help="operands per AND/OR group")
+    parser.add_argument("--fields", type=int, default=8, help="distinct fields")
+    parser.add_argument("--cardinality", type=int, default=50, help="distinct values per field")
+    parser.add_argument("--rules", type=int, default=200, help="rules for the core suite")
+    parser.add_argument("--crud-rules", type=int, default=200, help="rules for the crud suite")
+    parser.add_argument("--api-rules", type=int, default=50, help="rules created for the api suite")
+    parser.add_argument("--records", type=int, default=500, help="records to evaluate")
+    parser.add_argument("--extra-fields", type=int, default=0, help="unused fields added to api payloads")
+    parser.add_argument("--combine-size", type=int, default=10, help="rules per /combine request")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per api endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent api clients")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per micro-benchmark")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke run")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown counted as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.rules = min(args.rules, 20)
+        args.crud_rules = min(args.crud_rules, 20)
+        args.api_rules = min(args.api_rules, 10)
+        args.records = min(args.records, 50)
+        args.requests = min(args.requests, 100)
+        args.repeat = min(args.repeat, 2)
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    parameters: Dict[str, Any] = {
+        key: value for key, value in vars(args).items()
+        if key not in ("suite", "output", "baseline", "threshold")
+    }
+    results: Results = {}
+    for name in args.suite or list(SUITES):
+        print(f"# {name}", file=sys.stderr)
+        suite_results = SUITES[name](args)
+        print_results(suite_results)
+        results.update(suite_results)
+
+    if args.output:
+        write_report(args.output, report(results, parameters))
+
+    if args.baseline:
+        baseline = load_report(args.baseline)
+        if baseline.get("meta", {}).get("parameters") != parameters:
+            print("warning: baseline was recorded with different parameters", file=sys.stderr)
+        rows = compare(results, baseline["results"], args.threshold)
+        print_comparison(rows)
+        failure = summarize(rows)
+        if failure:
+            print(failure, file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        _workdir.cleanup()
@@ -0,0 +1,192 @@
+import asyncio
+import random
+from argparse import Namespace
+from typing import Callable, Dict
+from .generators import RuleGenerator
+from .harness import Results, latency_results, load, measure
+
+# Backend modules are imported inside the suites: the database URL is read
+# at import time and run.py points it at a temporary database first.
+
+def _generator(args: Namespace, seed: int = 0) -> RuleGenerator:
+    return RuleGenerator(
+        depth=args.depth,
+        width=args.width,
+        fields=args.fields,
+        cardinality=args.cardinality,
+        seed=seed
+    )
+
+def _label(args: Namespace) -> str:
+    return f"[d{args.depth}w{args.width}f{args.fields}c{args.cardinality}]"
+
+def core_suite(args: Namespace) -> Results:
+    from backend.compiler import RuleCompiler
+    from backend.dag import DecisionDag
+    from backend.matcher import RuleIndex
+    from backend.evaluator import RuleEvaluator
+    from backend.parser import RuleParser
+
+    generator = _generator(args)
+    label = _label(args)
+    rule_strings = generator.rules(args.rules)
+    records = generator.records(args.records)
+    evaluator = RuleEvaluator()
+    results: Results = {}
+
+    uncached = RuleParser(cache_size=0)
+    results[f"parser.create_rule{label}"] = measure(
+        lambda: [uncached.create_rule(rule) for rule in rule_strings],
+        ops=len(rule_strings), repeat=args.repeat
+    )
+    cached = RuleParser()
+    results[f"parser.create_rule.cached{label}"] = measure(
+        lambda: [cached.create_rule(rule) for rule in rule_strings],
+        ops=len(rule_strings), repeat=args.repeat
+    )
+
+    asts = [uncached.create_rule(rule) for rule in rule_strings]
+    sample = asts[:max(1, min(len(asts), 20))]
+
+    def evaluate_all(evaluate: Callable) -> None:
+        for ast in sample:
+            for record in records:
+                try:
+                    evaluate(ast, record)
+                except ValueError:
+                    pass
+
+    results[f"evaluator.evaluate_rule{label}"] = measure(
+        lambda: evaluate_all(evaluator.evaluate_rule),
+        ops=len(sample) * len(records), repeat=args.repeat
+    )
+    compiler = RuleCompiler()
+    compiled = {id(ast): compiler.compile(ast) for ast in sample}
+    results[f"compiler.compiled_rule{label}"] = measure(
+        lambda: evaluate_all(lambda ast, record: compiled[id(ast)](record)),
+        ops=len(sample) * len(records), repeat=args.repeat
+    )
+
+    # Whole-rule-set matching; the diagram is built before timing starts
+    matchers = {"matcher.match": RuleIndex(), "dag.match": DecisionDag(background=False)}
+    for name, index in matchers.items():
+        for rule_id, ast in enumerate(sample):
+            index.add_rule(rule_id, ast)
+        index.match(records[0])
+        results[f"{name}[n={len(sample)}]{label}"] = measure(
+            lambda index=index: [index.match(record) for record in records],
+            ops=len(records), repeat=args.repeat
+        )
+
+    results[f"evaluator.combine_rules[n={len(asts)}]{label}"] = measure(
+        lambda: evaluator.combine_rules(asts), ops=1, repeat=args.repeat
+    )
+    return results
+
+def crud_suite(args: Namespace) -> Results:
+    from backend import crud, schemas
+    from backend.database import SessionLocal, create_tables
+    from backend.parser import RuleParser
+
+    create_tables()
+    generator = _generator(args, seed=1)
+    parser = RuleParser()
+    rules = [
+        (schemas.RuleCreate(name=f"bench {i}", rule_string=rule), parser.create_rule(rule).model_dump())
+        for i, rule in enumerate(generator.rules(args.crud_rules))
+    ]
+    records = generator.records(args.records)
+    results: Results = {}
+
+    with SessionLocal() as db:
+        created = []
+
+        def create_all() -> None:
+            for rule, ast_json in rules:
+                created.append(crud.RuleRepository.create_rule(db, rule, ast_json))
+
+        results["crud.create_rule"] = measure(create_all, ops=len(rules), repeat=1, warmup=0)
+        ids = [rule.id for rule in created]
+
+        def get_all() -> None:
+            for rule_id in ids:
+                crud.RuleRepository.get_rule(db, rule_id)
+            db.expire_all()
+
+        results["crud.get_rule"] = measure(get_all, ops=len(ids), repeat=args.repeat)
+        results["crud.get_rules_by_ids"] = measure(
+            lambda: (crud.RuleRepository.get_rules_by_ids(db, ids), db.expire_all()),
+            ops=1, repeat=args.repeat
+        )
+        results["crud.get_rules.page"] = measure(
+            lambda: (crud.RuleRepository.get_rules(db, limit=100), db.expire_all()),
+            ops=1, repeat=args.repeat
+        )
+
+        def update_all() -> None:
+            for rule_id, (rule, ast_json) in zip(ids, rules):
+                crud.RuleRepository.update_rule(db, rule_id, rule, ast_json)
+
+        results["crud.update_rule"] = measure(update_all, ops=len(ids), repeat=1, warmup=0)
+
+        evaluations = [(record, bool(i % 2)) for i, record in enumerate(records)]
+        results[f"crud.create_evaluations[n={len(evaluations)}]"] = measure(
+            lambda: crud.RuleRepository.create_evaluations(db, ids[0], evaluations),
+            ops=len(evaluations), repeat=args.repeat
+        )
+        results["crud.get_rule_evaluations.page"] = measure(
+            lambda: (crud.RuleRepository.get_rule_evaluations(db, ids[0], limit=100), db.expire_all()),
+            ops=1, repeat=args.repeat
+        )
+    return results
+
+def api_suite(args: Namespace) -> Results:
+    return asyncio.run(_api_suite(args))
+
+async def _api_suite(args: Namespace) -> Results:
+    # Drives the real ASGI app in-process (no sockets), with its lifespan
+    import httpx
+    from backend.main import app
+
+    generator = _generator(args, seed=2)
+    rule_strings = generator.rules(args.api_rules)
+    records = generator.records(args.records, extra_fields=args.extra_fields)
+    choice = random.Random(3)
+    results: Results = {}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ids = []
+            for i, rule in enumerate(rule_strings):
+                response = await client.post("/api/rules/", json={"name": f"bench {i}", "rule_string": rule})
+                response.raise_for_status()
+                ids.append(response.json()["id"])
+
+            async def evaluate(index: int) -> None:
+                response = await client.post(
+                    f"/api/rules/{choice.choice(ids)}/evaluate", json=records[index % len(records)]
+                )
+                if response.status_code not in (200, 400):
+                    response.raise_for_status()
+
+            async def combine(index: int) -> None:
+                response = await client.post(
+                    "/api/rules/combine", json={"rule_ids": choice.sample(ids, min(len(ids), args.combine_size))}
+                )
+                response.raise_for_status()
+
+            for name, request, total in (
+                ("api.evaluate", evaluate, args.requests),
+                ("api.combine", combine, max(1, args.requests // 10)),
+            ):
+                await load(request, min(total, args.concurrency * 2), args.concurrency)
+                latencies, elapsed = await load(request, total, args.concurrency)
+                results.update(latency_results(f"{name}[c={args.concurrency}]", latencies, elapsed))
+    return results
+
+SUITES: Dict[str, Callable[[Namespace], Results]] = {
+    "core": core_suite,
+    "crud": crud_suite,
+    "api": api_suite,
+}
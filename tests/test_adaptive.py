@@ -0,0 +1,54 @@
+import random
+import pytest
+from backend.compiler import AdaptiveRule
+from backend.evaluator import RuleEvaluator
+from backend.parser import RuleParser
+
+parser = RuleParser()
+evaluator = RuleEvaluator()
+
+def outcome(evaluate, record):
+    try:
+        return evaluate(record)
+    except (ValueError, TypeError) as e:
+        return ("error", str(e))
+
+def trained(rule_string, record, samples=200):
+    rule = AdaptiveRule(parser.create_rule(rule_string), sample_every=1, replan_every=50)
+    for _ in range(samples):
+        rule(record)
+    return rule
+
+def test_reordered_group_does_not_raise_on_skipped_field():
+    rule = trained("a > 1 AND b > 1", {"a": 5, "b": 0})
+    assert rule.render() == "(b > 1 AND a > 1)"
+    assert rule({"a": 0}) is False
+    assert outcome(rule, {"b": 5}) == ("error", "Field 'a' not found in data")
+
+def test_reordered_or_keeps_error_message():
+    rule = trained("a = 1 OR b > 1", {"a": 0, "b": 5})
+    assert rule.render() == "(b > 1 OR a = 1)"
+    assert rule({"a": 1}) is True
+    assert outcome(rule, {"a": 0, "b": "x"}) == outcome(lambda r: evaluator.evaluate_rule(rule.nodes[0], r), {"a": 0, "b": "x"})
+
+@pytest.mark.parametrize("seed", range(5))
+def test_adaptive_plans_agree_with_evaluate_rule(seed):
+    rng = random.Random(seed)
+    fields = ("a", "b", "c", "d")
+    values = (0, 1, 2, 3, "x")
+
+    def record():
+        return {field: rng.choice(values[:4] if rng.random() < 0.8 else values) for field in fields if rng.random() < 0.8}
+
+    rule_string = "(a > 1 OR b = 2) AND (c < 2 OR d >= 1) AND (a = 0 OR c > 0 AND d < 3)"
+    ast = parser.create_rule(rule_string)
+    rule = AdaptiveRule(ast, sample_every=1, replan_every=20)
+    skewed = {field: rng.choice(values[:4]) for field in fields}
+    for _ in range(100):
+        rule(skewed)
+    for _ in range(2000):
+        current = record()
+        expected = outcome(lambda r: evaluator.evaluate_rule(ast, r), current)
+        got = outcome(rule, current)
+        if isinstance(expected, bool) or isinstance(got, tuple):
+            assert got == expected, (rule.render(), current)
@@ -0,0 +1,41 @@
+from backend import models
+from backend.cache import RuleCache, SchemaCache
+from backend.compiler import CompiledRuleCache
+from backend.parser import RuleParser
+
+parser = RuleParser()
+
+def make_rule(rule_id, rule_string="age > 30", version=1):
+    return models.Rule(
+        id=rule_id, name=f"r{rule_id}", rule_string=rule_string,
+        ast_json=parser.create_rule(rule_string).model_dump(), version=version
+    )
+
+def lookup(cache, rule_id):
+    cached = cache._lookup(rule_id)
+    return None if cached is None else cached.id
+
+def test_hits_keep_rules_cached():
+    cache = RuleCache(CompiledRuleCache(), SchemaCache(), max_size=2)
+    cache.put(make_rule(1))
+    cache.put(make_rule(2))
+    assert lookup(cache, 1) == 1
+    cache.put(make_rule(3))
+    assert lookup(cache, 1) == 1
+    assert lookup(cache, 2) is None
+    assert lookup(cache, 3) == 3
+
+def test_new_version_is_most_recent():
+    cache = RuleCache(CompiledRuleCache(), SchemaCache(), max_size=2)
+    cache.put(make_rule(1))
+    cache.put(make_rule(2))
+    cache.put(make_rule(1, "age > 40", version=2))
+    cache.put(make_rule(3))
+    assert lookup(cache, 2) is None
+    assert cache._lookup(1).version == 2
+
+def test_older_version_is_ignored():
+    cache = RuleCache(CompiledRuleCache(), SchemaCache(), max_size=2)
+    cache.put(make_rule(1, "age > 40", version=2))
+    cache.put(make_rule(1, version=1))
+    assert cache._lookup(1).rule_string == "age > 40"
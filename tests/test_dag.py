@@ -0,0 +1,98 @@
+import math
+import random
+import pytest
+from backend.dag import DecisionDag
+from backend.evaluator import RuleEvaluator
+from backend.matcher import RuleIndex
+from backend.parser import NodeType, Operator
+from backend.schemas import NodeBase
+
+evaluator = RuleEvaluator()
+
+FIELDS = ("a", "b", "c", "d")
+OPERATORS = (">", "<", ">=", "<=", "=")
+NUMBERS = (0, 1, 2, 2.5, 3, 5)
+STRINGS = ("a", "m", "z")
+RECORD_VALUES = (-1, 0, 1, 2, 2.5, 3, 4, 5, 6, "a", "b", "m", "z", "", True, False, math.nan, [1])
+
+def comparison(field, operator, value):
+    return NodeBase(type=NodeType.COMPARISON.value, operator=operator, field=field, value=value)
+
+def group(operator, left, right):
+    return NodeBase(type=NodeType.OPERATOR.value, operator=operator, left=left, right=right)
+
+def random_rule(rng, depth):
+    if depth == 0 or rng.random() < 0.35:
+        field = rng.choice(FIELDS)
+        constants = NUMBERS if rng.random() < 0.75 else STRINGS
+        if rng.random() < 0.15:
+            return comparison(field, Operator.IN.value, rng.sample(NUMBERS + STRINGS, rng.randint(1, 3)))
+        return comparison(field, rng.choice(OPERATORS), rng.choice(constants))
+    operator = rng.choice((Operator.AND.value, Operator.OR.value))
+    return group(operator, random_rule(rng, depth - 1), random_rule(rng, depth - 1))
+
+def random_record(rng):
+    return {field: rng.choice(RECORD_VALUES) for field in FIELDS if rng.random() < 0.8}
+
+def expected_match(rules, record):
+    matched, errors = [], {}
+    for rule_id, ast in rules.items():
+        try:
+            if evaluator.evaluate_rule(ast, record):
+                matched.append(rule_id)
+        except (ValueError, TypeError) as e:
+            errors[rule_id] = str(e)
+    return matched, errors
+
+def build(engine, rules):
+    for rule_id, ast in rules.items():
+        engine.add_rule(rule_id, ast)
+    return engine
+
+@pytest.mark.parametrize("engine", [lambda: DecisionDag(background=False), RuleIndex])
+@pytest.mark.parametrize("seed", range(10))
+def test_match_agrees_with_evaluate_rule(engine, seed):
+    # Mixed number/string constants, IN lists, missing fields, NaN, bools
+    # and unsupported values (lists) in the records
+    rng = random.Random(seed)
+    rules = {rule_id: random_rule(rng, 3) for rule_id in range(1, 13)}
+    index = build(engine(), rules)
+    for _ in range(300):
+        record = random_record(rng)
+        assert index.match(record) == expected_match(rules, record), record
+
+def test_rule_changes_rebuild_the_diagram():
+    rng = random.Random(99)
+    rules = {rule_id: random_rule(rng, 3) for rule_id in range(1, 9)}
+    index = build(DecisionDag(background=False), rules)
+    index.match({})
+    del rules[3]
+    index.remove_rule(3)
+    rules[4] = random_rule(rng, 3)
+    index.add_rule(4, rules[4])
+    for _ in range(200):
+        record = random_record(rng)
+        assert index.match(record) == expected_match(rules, record), record
+    assert index.current
+
+def test_node_limit_falls_back_to_compiled_rules():
+    rng = random.Random(7)
+    rules = {rule_id: random_rule(rng, 4) for rule_id in range(1, 31)}
+    index = build(DecisionDag(max_nodes=10, background=False), rules)
+    index.match({})
+    assert index.exploded
+    assert index.node_count == 0
+    for _ in range(300):
+        record = random_record(rng)
+        assert index.match(record) == expected_match(rules, record), record
+
+def test_unrepresentable_rules_are_evaluated_directly():
+    rules = {
+        1: comparison("a", ">", 1),
+        2: comparison("a", "=", math.nan),
+        3: comparison("b", "=", [1, 2]),
+        4: group(Operator.OR.value, comparison("a", "<", 0), comparison("b", "=", True)),
+    }
+    index = build(DecisionDag(background=False), rules)
+    for record in ({"a": 2, "b": [1, 2]}, {"a": math.nan, "b": 1}, {"a": -1}, {"b": True}, {"a": "x", "b": 0}):
+        assert index.match(record) == expected_match(rules, record), record
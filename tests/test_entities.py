@@ -0,0 +1,72 @@
+import random
+from backend.entities import EntityNetwork
+from backend.evaluator import RuleEvaluator
+from backend.fields import RecordSchema
+from backend.parser import RuleParser
+
+parser = RuleParser()
+evaluator = RuleEvaluator()
+
+RULES = [
+    "age > 30",
+    "age > 30 AND dept = 'Sales'",
+    "dept = 'Sales' OR salary >= 1000",
+    "(age < 18 OR age > 65) AND salary < 500",
+    "age > 30 AND (salary >= 1000 OR dept = 'Eng')",
+]
+VALUES = {
+    "age": [10, 30, 31, 70, "x", None],
+    "dept": ["Sales", "Eng", "HR", 5, None],
+    "salary": [100, 999, 1000, 2000.5, None],
+}
+
+def outcome(ast, fields):
+    try:
+        return evaluator.evaluate_rule(ast, fields)
+    except (ValueError, TypeError) as e:
+        return str(e)
+
+def test_incremental_updates_match_full_evaluation():
+    rng = random.Random(5)
+    asts = {rule_id: parser.create_rule(rule_string) for rule_id, rule_string in enumerate(RULES, 1)}
+    network = EntityNetwork()
+    for rule_id, ast in asts.items():
+        network.add_rule(rule_id, ast)
+    states = {}
+    for step in range(500):
+        entity_id = f"e{rng.randrange(5)}"
+        changes = {field: rng.choice(values) for field, values in VALUES.items() if rng.random() < 0.5}
+        state = states.setdefault(entity_id, {})
+        before = {rule_id: outcome(ast, state) for rule_id, ast in asts.items()}
+        state.update(changes)
+        for field in [field for field, value in state.items() if value is None]:
+            del state[field]
+        after = {rule_id: outcome(ast, state) for rule_id, ast in asts.items()}
+
+        update = network.update(entity_id, changes)
+        assert [(flip.rule_id, flip.previous, flip.current) for flip in update.flipped] == [
+            (rule_id, before[rule_id], after[rule_id]) for rule_id in asts if before[rule_id] != after[rule_id]
+        ]
+        fields, outcomes = network.get(entity_id)
+        assert outcomes == after
+        if step == 250:
+            # Rule changes rebuild the network; entities are re-evaluated lazily
+            asts[6] = parser.create_rule("salary < 1000 AND age >= 31")
+            network.add_rule(6, asts[6])
+            del asts[2]
+            network.remove_rule(2)
+            for other, other_state in states.items():
+                assert network.get(other)[1] == {rule_id: outcome(ast, other_state) for rule_id, ast in asts.items()}
+
+def test_unchanged_values_evaluate_nothing():
+    network = EntityNetwork()
+    network.add_rule(1, parser.create_rule("age > 30"))
+    network.update("e", {"age": 40})
+    update = network.update("e", {"age": 40})
+    assert update.changed_fields == [] and update.flipped == [] and update.evaluated_nodes == 0
+
+def test_typed_rules_coerce_entity_fields():
+    schema = RecordSchema.from_json([{"name": "age", "type": "int"}])
+    network = EntityNetwork()
+    network.add_rule(1, parser.create_rule("age > 30", schema), schema)
+    assert network.update("e", {"age": "35"}).flipped[0].current is True
@@ -0,0 +1,14 @@
+import asyncio
+import itertools
+from sqlalchemy import create_engine
+from backend.history import EvaluationWriter, HistoryMode
+
+def test_full_queue_drops_rows_instead_of_blocking():
+    writer = EvaluationWriter(create_engine("sqlite://"), mode=HistoryMode.BUFFERED, queue_size=2)
+    # Ids as start() would allocate them, but with no thread draining the queue
+    writer._ids = itertools.count(1)
+    evaluations = [({"age": age}, True) for age in range(3)]
+    ids = asyncio.run(asyncio.wait_for(writer.record_many(None, 1, evaluations), timeout=5))
+    assert ids == [1, 2, None]
+    assert writer.dropped == 1
+    assert writer.queue_depth == 2
@@ -0,0 +1,24 @@
+from backend.metrics import Counter, Histogram, Registry
+
+def test_registry_labels_every_sample():
+    registry = Registry({"worker": "7"})
+    histogram = registry.register(Histogram("h_seconds", "H.", ("stage",), buckets=(1.0,)))
+    counter = registry.register(Counter("c_total", "C."))
+    registry.add_collector(lambda: [("g", "gauge", "G.", [({}, 3), ({"state": "idle"}, 1)])])
+    histogram.observe(0.5, "load")
+    counter.inc()
+    lines = [line for line in registry.render().splitlines() if not line.startswith("#")]
+    assert lines == [
+        'h_seconds_bucket{stage="load",worker="7",le="1"} 1',
+        'h_seconds_bucket{stage="load",worker="7",le="+Inf"} 1',
+        'h_seconds_sum{stage="load",worker="7"} 0.5',
+        'h_seconds_count{stage="load",worker="7"} 1',
+        'c_total{worker="7"} 1',
+        'g{worker="7"} 3',
+        'g{state="idle",worker="7"} 1',
+    ]
+
+def test_registry_without_labels():
+    registry = Registry()
+    registry.register(Counter("c_total", "C.")).inc(2)
+    assert 'c_total 2' in registry.render().splitlines()
@@ -0,0 +1,83 @@
+import math
+import random
+import pytest
+from backend.evaluator import RuleEvaluator
+from backend.optimizer import optimize_rule
+from backend.parser import NodeType, Operator, RuleParser
+from backend.schemas import NodeBase
+
+parser = RuleParser()
+evaluator = RuleEvaluator()
+
+FIELDS = ("a", "b", "c")
+OPERATORS = (">", "<", ">=", "<=", "=")
+VALUES = (0, 1, 2, 3, 4, 5, 2.5, "x", math.nan, True)
+
+def outcome(ast, record):
+    try:
+        return evaluator.evaluate_rule(ast, record)
+    except (ValueError, TypeError):
+        return "error"
+
+def random_comparison(rng, constants):
+    field = rng.choice(FIELDS)
+    if rng.random() < 0.15:
+        values = rng.sample(constants, rng.randint(1, 3))
+        return NodeBase(type=NodeType.COMPARISON.value, operator=Operator.IN.value, field=field, value=values)
+    return NodeBase(type=NodeType.COMPARISON.value, operator=rng.choice(OPERATORS), field=field, value=rng.choice(constants))
+
+def random_rule(rng, depth, pool):
+    # Reuses earlier subtrees so that duplicates, merges and absorption occur
+    if pool and rng.random() < 0.3:
+        return rng.choice(pool)
+    if depth == 0 or rng.random() < 0.3:
+        constants = [0, 1, 2, 3, 4] if rng.random() < 0.8 else ["a", "m", "x"]
+        node = random_comparison(rng, constants)
+    else:
+        node = NodeBase(
+            type=NodeType.OPERATOR.value,
+            operator=rng.choice((Operator.AND.value, Operator.OR.value)),
+            left=random_rule(rng, depth - 1, pool),
+            right=random_rule(rng, depth - 1, pool)
+        )
+    pool.append(node)
+    return node
+
+def random_record(rng):
+    return {field: rng.choice(VALUES) for field in FIELDS if rng.random() < 0.75}
+
+@pytest.mark.parametrize("rule_string, record", [
+    ("(((c > 3 AND a = 0) OR b < 2) AND a >= 3) AND b < 2", {"b": 4, "c": 3}),
+    ("((c > 3 AND a = 0) OR b < 2) AND a >= 3 AND b < 2", {"a": 0, "c": 5}),
+    ("(b < 2 OR c > 3) AND a >= 3 AND b < 2", {"b": 4, "c": 1}),
+    ("a = 3 OR b = 1 OR a > 5", {"a": "x", "b": 1}),
+    ("a > 1 OR a < 5", {"a": math.nan}),
+])
+def test_known_cases(rule_string, record):
+    ast = parser.create_rule(rule_string)
+    optimized, _ = optimize_rule(ast)
+    expected = outcome(ast, record)
+    assert expected != "error"
+    assert outcome(optimized, record) == expected
+
+def test_absorbed_operand_keeps_its_place():
+    ast = parser.create_rule("(b < 2 OR c > 3) AND a >= 3 AND b < 2")
+    optimized, findings = optimize_rule(ast)
+    assert [finding.kind for finding in findings] == ["redundant"]
+    assert outcome(optimized, {"b": 4}) is False
+    assert outcome(optimized, {"a": 3, "b": 1}) is True
+
+def test_optimized_rules_agree_with_evaluate_rule():
+    # Wherever the original rule has a result, the optimized one must have
+    # the same result; it may only replace errors with results
+    rng = random.Random(20)
+    mismatches = []
+    for _ in range(3000):
+        ast = random_rule(rng, 4, [])
+        optimized, _ = optimize_rule(ast)
+        for _ in range(20):
+            record = random_record(rng)
+            expected = outcome(ast, record)
+            if expected != "error" and outcome(optimized, record) != expected:
+                mismatches.append((ast, record))
+    assert mismatches == []
@@ -0,0 +1,60 @@
+import pytest
+from backend.evaluator import RuleEvaluator
+from backend.parser import RuleParser, Token, TokenType
+
+parser = RuleParser()
+
+@pytest.mark.parametrize("rule_string", [
+    "age > 30 ",
+    "age > 30\n",
+    " (age > 30) ",
+    "\t\nage > 30\r\n",
+    "  age   >   30  ",
+])
+def test_surrounding_whitespace_is_ignored(rule_string):
+    texts = [token.text for token in parser.tokenize(rule_string)]
+    assert texts == [token.text for token in parser.tokenize(rule_string.strip())]
+    ast = parser.create_rule(rule_string)
+    assert (ast.field, ast.operator, ast.value) == ("age", ">", 30)
+
+def test_whitespace_inside_string_literals_is_kept():
+    ast = parser.create_rule("\n name = ' a b '\n")
+    assert ast.value == " a b "
+
+def test_multiline_rule():
+    ast = parser.create_rule("age > 30\nAND\n  department = 'Sales'\n")
+    assert RuleEvaluator().evaluate_rule(ast, {"age": 31, "department": "Sales"}) is True
+
+@pytest.mark.parametrize("rule_string", ["name = 'abc", "name = 'abc ", "age > 30 '"])
+def test_unterminated_string(rule_string):
+    with pytest.raises(ValueError, match="Unterminated string literal"):
+        parser.tokenize(rule_string)
+
+def test_tokens_are_typed_with_positions():
+    assert parser.tokenize("(age >= 30 OR name = 'a b')") == [
+        Token(TokenType.OPEN, "(", 0),
+        Token(TokenType.WORD, "age", 1),
+        Token(TokenType.COMPARATOR, ">=", 5),
+        Token(TokenType.WORD, "30", 8),
+        Token(TokenType.KEYWORD, "OR", 11),
+        Token(TokenType.WORD, "name", 14),
+        Token(TokenType.COMPARATOR, "=", 19),
+        Token(TokenType.STRING, "'a b'", 21),
+        Token(TokenType.CLOSE, ")", 26),
+    ]
+
+def test_quoted_keyword_is_a_value():
+    assert parser.create_rule("name = 'AND'").value == "AND"
+
+@pytest.mark.parametrize("rule_string, message", [
+    ("name = 'abc", "Unterminated string literal at position 7"),
+    ("age > 30 AND ) ", "Expected a comparison or '\\(' at position 13"),
+    ("age > 30 AND (x = 1", "Missing closing parenthesis for '\\(' at position 13"),
+    ("age AND 30", "Expected a comparison operator after 'age' at position 4"),
+    ("age > OR", "Expected a value after 'age' > at position 6"),
+    ("age > 30 x", "Invalid operator at position 9"),
+    ("age > 30) AND", "Unexpected tokens after expression at position 8"),
+])
+def test_errors_report_character_positions(rule_string, message):
+    with pytest.raises(ValueError, match=message):
+        parser.create_rule(rule_string)
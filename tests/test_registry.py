@@ -0,0 +1,81 @@
+import pytest
+from backend import registry
+from backend.registry import RegistryRecord, SharedRegistry
+
+def rule(rule_id, version, padding=0):
+    return RegistryRecord(registry.RULE, rule_id, {"version": version, "padding": "x" * padding}, b"\x01\x02")
+
+def apply(state, records):
+    # What a worker's rule table looks like after replaying the records
+    for record in records:
+        if record.kind == registry.DELETE:
+            state.pop(record.object_id, None)
+        else:
+            state[record.object_id] = record.data["version"]
+    return state
+
+def open_workers(tmp_path, seeded, capacity=4096):
+    path = str(tmp_path / "registry")
+    first = SharedRegistry(path, capacity)
+    with first.locked():
+        assert not first.attach()
+        first.seed(seeded, next_id=100)
+    second = SharedRegistry(path, capacity)
+    # Records are attributed to the writing process; stand in for another worker
+    second._pid += 1
+    with second.locked():
+        assert second.attach()
+    return first, second
+
+def test_workers_load_the_seed_and_follow_changes(tmp_path):
+    first, second = open_workers(tmp_path, [rule(1, 1)])
+    assert first.poll() == ([rule(1, 1)], True)
+    assert second.poll() == ([rule(1, 1)], True)
+    assert second.poll() is None
+
+    first.publish(rule(2, 1))
+    first.publish(RegistryRecord(registry.DELETE, 1, None, None))
+    assert second.poll() == ([rule(2, 1), RegistryRecord(registry.DELETE, 1, None, None)], False)
+    # A worker does not replay its own changes
+    assert first.poll() == ([], False)
+
+def test_full_log_is_compacted_to_the_latest_records(tmp_path):
+    first, second = open_workers(tmp_path, [rule(1, 1), rule(2, 1)])
+    first.poll()
+    second.poll()
+    for version in range(2, 40):
+        first.publish(rule(1, version, padding=200))
+    first.publish(RegistryRecord(registry.DELETE, 2, None, None))
+    records, reset = second.poll()
+    assert reset
+    assert len(records) < 39
+    assert apply({}, records) == {1: 39}
+    second.publish(rule(3, 1))
+    # The worker that compacted reloads from its snapshot as well
+    records, reset = first.poll()
+    assert reset
+    assert apply({}, records) == {1: 39, 3: 1}
+
+def test_id_blocks_never_overlap(tmp_path):
+    first, second = open_workers(tmp_path, [])
+    blocks = [first.allocate_ids(1, 10), second.allocate_ids(1, 10), first.allocate_ids(500, 10), second.allocate_ids(1, 10)]
+    assert blocks == [100, 110, 500, 510]
+
+@pytest.mark.parametrize("follow", ["allocate_ids", "publish"])
+def test_worker_that_follows_a_compaction_outside_poll_reloads(tmp_path, follow):
+    first, second = open_workers(tmp_path, [rule(1, 1)])
+    first.poll()
+    second.poll()
+    first.publish(rule(1, 2, padding=200))
+    for version in range(3, 40):
+        first.publish(rule(2, version, padding=200))
+    # The second worker re-maps the compacted file before it polls
+    expected = {1: 2, 2: 39}
+    if follow == "allocate_ids":
+        second.allocate_ids(1, 10)
+    else:
+        second.publish(rule(3, 1))
+        expected[3] = 1
+    records, reset = second.poll()
+    assert reset
+    assert apply({}, records) == expected
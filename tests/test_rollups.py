@@ -0,0 +1,60 @@
+import threading
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.pool import StaticPool
+from backend import models
+from backend.database import Base
+from backend.rollups import MINUTE, RollupWriter, add_rollups
+
+def make_writer():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for rule_id in (1, 2):
+            conn.execute(insert(models.Rule.__table__).values(
+                id=rule_id, name=f"rule {rule_id}", rule_string="age > 1", ast_json={}
+            ))
+    writer = RollupWriter(engine)
+    # Counting as start() would enable it, but with no flush thread
+    writer._thread = threading.current_thread()
+    return engine, writer
+
+def rollup_rule_ids(engine):
+    table = models.RuleEvaluationRollup.__table__
+    with engine.connect() as conn:
+        return set(conn.scalars(select(table.c.rule_id)))
+
+def delete_rule(engine, rule_id):
+    with engine.begin() as conn:
+        conn.execute(delete(models.RuleEvaluationRollup.__table__).where(
+            models.RuleEvaluationRollup.__table__.c.rule_id == rule_id
+        ))
+        conn.execute(delete(models.Rule.__table__).where(models.Rule.__table__.c.id == rule_id))
+
+def test_flush_skips_counts_of_deleted_rules():
+    engine, writer = make_writer()
+    writer.record(1, 1, true_count=1)
+    delete_rule(engine, 1)
+    writer.forget(1)
+    # An evaluation that finished after the delete
+    writer.record(1, 1, true_count=1)
+    writer.record(2, 1, false_count=1)
+    writer.flush()
+    assert rollup_rule_ids(engine) == {2}
+
+def test_forget_removes_rows_written_by_a_flush_in_flight():
+    engine, writer = make_writer()
+    writer.record(1, 1, true_count=1)
+    deltas = {key: counts for key, counts in writer._pending.items()}
+    with writer._flush_lock:
+        delete_rule(engine, 1)
+        forgetting = threading.Thread(target=writer.forget, args=(1,))
+        forgetting.start()
+        forgetting.join(0.1)
+        assert forgetting.is_alive()
+        # The flush in flight checked the rule before the delete and
+        # writes its counts after it
+        with engine.begin() as conn:
+            add_rollups(conn, {(1, MINUTE, minute, version): counts for (_, version, minute), counts in deltas.items()})
+        assert rollup_rule_ids(engine) == {1}
+    forgetting.join(5)
+    assert rollup_rule_ids(engine) == set()
@@ -0,0 +1,70 @@
+import pytest
+from backend.compiler import CompiledRuleCache, RuleCompiler
+from backend.dag import DecisionDag
+from backend.fields import RecordSchema
+from backend.matcher import RuleIndex
+from backend.parser import RuleParser
+from backend.vectorized import VectorizedEvaluator
+
+parser = RuleParser()
+schema = RecordSchema.from_json([
+    {"name": "age", "type": "int"},
+    {"name": "salary", "type": "float", "nullable": True},
+    {"name": "dept", "type": "string", "enum": ["Sales", "Eng"]},
+])
+rules = {
+    1: parser.create_rule("age > 30", schema),
+    2: parser.create_rule("age > 30 AND dept = 'Sales'", schema),
+    3: parser.create_rule("salary > 100 OR age < 18", schema),
+}
+untyped = parser.create_rule("age > 30")
+records = [
+    {"age": "35", "dept": "Sales"},
+    {"age": 35.0, "dept": "Eng", "salary": None},
+    {"age": "x", "dept": "Sales"},
+    {"age": 10, "salary": "150.5"},
+    {"dept": "HR", "age": 40},
+    {},
+]
+
+def expected(record):
+    matched, errors = [], {}
+    for rule_id, ast in rules.items():
+        try:
+            if RuleCompiler().compile_typed(ast, schema)(record):
+                matched.append(rule_id)
+        except Exception as e:
+            errors[rule_id] = str(e)
+    try:
+        if RuleCompiler().compile(untyped)(record):
+            matched.append(4)
+    except Exception as e:
+        errors[4] = str(e)
+    return matched, errors
+
+@pytest.mark.parametrize("engine", [RuleIndex, lambda: DecisionDag(background=False)])
+@pytest.mark.parametrize("record", records)
+def test_match_coerces_through_schema(engine, record):
+    index = engine()
+    for rule_id, ast in rules.items():
+        index.add_rule(rule_id, ast, schema)
+    index.add_rule(4, untyped)
+    assert index.match(record) == expected(record)
+
+def test_string_number_matches_int_field():
+    for index in (RuleIndex(), DecisionDag(background=False)):
+        index.add_rule(1, rules[1], schema)
+        assert index.match({"age": "35"}) == ([1], {})
+
+def test_columnar_rows_use_typed_rule():
+    compiled = RuleCompiler().compile_typed(rules[2], schema)
+    columns = {"age": ["35", 20, "x", None], "dept": ["Sales", "Sales", "Eng", "Eng"]}
+    values, errors, messages = VectorizedEvaluator().evaluate_rows(compiled, columns)
+    assert values.tolist() == [True, False, False, False]
+    assert errors.tolist() == [False, False, True, True]
+    assert messages[3] == "Field 'age' not found in data"
+
+def test_plan_miss_caches_the_typed_rule():
+    cache = CompiledRuleCache()
+    cache.plan(1, 1, rules[1].model_dump(), schema=schema)
+    assert cache.get(1, 1, rules[1].model_dump(), schema=schema)({"age": "40"})
@@ -0,0 +1,66 @@
+import pytest
+from backend.evaluator import RuleEvaluator
+from backend.parser import NodeType, Operator, RuleParser
+from backend.schemas import NodeBase
+from backend.vectorized import VectorizedEvaluator
+
+np = pytest.importorskip("numpy")
+
+parser = RuleParser()
+
+def row_outcomes(ast, columns):
+    names = list(columns)
+    size = len(columns[names[0]])
+    outcomes = []
+    for i in range(size):
+        row = {name: columns[name][i] for name in names if columns[name][i] is not None}
+        try:
+            outcomes.append(RuleEvaluator().evaluate_rule(ast, row))
+        except (ValueError, TypeError):
+            outcomes.append("error")
+    return outcomes
+
+def column_outcomes(ast, columns):
+    values, errors, _ = VectorizedEvaluator().evaluate(ast, columns)
+    return ["error" if errors is not None and errors[i] else bool(values[i]) for i in range(len(values))]
+
+@pytest.mark.parametrize("rule_string, columns", [
+    ("age = 1", {"age": [1, "a"]}),
+    ("name = '1'", {"name": [1, "x"]}),
+    ("age > 0", {"age": [1, "a"]}),
+    ("age > 0", {"age": [1, 2.5, None]}),
+    ("flag = 1", {"flag": [True, 1, 0]}),
+    ("age >= 2 OR name = 'x'", {"age": [3, "b", None], "name": ["y", "x", "x"]}),
+    ("age < 5 AND name > 'a'", {"age": [1, 9, 2], "name": [3, "b", "c"]}),
+])
+def test_mixed_columns_match_row_evaluator(rule_string, columns):
+    ast = parser.create_rule(rule_string)
+    assert column_outcomes(ast, columns) == row_outcomes(ast, columns)
+
+def test_membership_on_mixed_column():
+    ast = NodeBase(type=NodeType.COMPARISON, operator=Operator.IN, field="age", value=[1, "a"])
+    columns = {"age": [1, "a", "1", 2, 1.0]}
+    assert column_outcomes(ast, columns) == row_outcomes(ast, columns) == [True, True, False, False, True]
+
+def test_uniform_columns_stay_typed():
+    assert VectorizedEvaluator._as_array([1, 2, 3.5]).dtype.kind == "f"
+    assert VectorizedEvaluator._as_array(["a", "b"]).dtype.kind == "U"
+    assert VectorizedEvaluator._as_array([True, False]).dtype.kind == "b"
+    assert VectorizedEvaluator._as_array([1, "a"]).dtype == object
+    assert VectorizedEvaluator._as_array([True, 1]).dtype == object
+
+@pytest.mark.parametrize("rule_string, columns", [
+    ("name > 5", {"name": ["a", "b"]}),
+    ("age > 0", {"age": [1, "a"]}),
+])
+def test_column_errors_read_like_row_errors(rule_string, columns):
+    ast = parser.create_rule(rule_string)
+    _, errors, messages = VectorizedEvaluator().evaluate(ast, columns)
+    field, = columns
+    for i, value in enumerate(columns[field]):
+        try:
+            RuleEvaluator().evaluate_rule(ast, {field: value})
+        except TypeError as e:
+            assert errors[i] and messages[i] == str(e)
+        else:
+            assert not errors[i]